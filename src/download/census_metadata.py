@@ -0,0 +1,83 @@
+import os
+import gzip
+import json
+import threading
+from utils.logger_utils import setup_logging
+from utils.api_utils import get_response_as_json
+
+logger = setup_logging()
+
+#Variable codes already loaded this run keyed by metadata URL
+loaded_variable_codes: dict[str, set[str]] = {}
+loaded_lock = threading.Lock()
+
+
+def get_variables_url(dataset_url: str) -> str:
+    """Get the URL of a dataset's variables.json, e.g. .../2019/acs/acs5/subject/variables.json"""
+    return f"{dataset_url.rstrip('/')}/variables.json"
+
+def get_metadata_file_path(metadata_folder: str, table: dict, year: int) -> str:
+    """Get the local cache file for a dataset's variable codes."""
+    dataset = table['url_segment'] or 'base'
+    return os.path.join(metadata_folder, f"acs5_{dataset}_{year}_variables.json.gz")
+
+def read_variable_codes(file_path: str) -> set[str]:
+    with gzip.open(file_path, 'rt') as file:
+        return set(json.load(file))
+
+def write_variable_codes(file_path: str, codes: set[str]) -> None:
+    """Write the variable codes atomically to the local cache."""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temp_path = f"{file_path}.tmp"
+    with gzip.open(temp_path, 'wt') as file:
+        json.dump(sorted(codes), file)
+    os.replace(temp_path, file_path)
+
+def get_valid_variable_codes(
+    dataset_url: str,
+    file_path: str,
+    offline: bool = False
+) -> set[str] | None:
+    """
+    Get the variable codes a dataset publishes, fetching variables.json once and caching it locally.
+    Returns: set | None: The variable codes, or None if the metadata is not available
+    """
+    variables_url = get_variables_url(dataset_url)
+    with loaded_lock:
+        if variables_url in loaded_variable_codes:
+            return loaded_variable_codes[variables_url]
+
+    if os.path.exists(file_path):
+        codes = read_variable_codes(file_path)
+    elif offline:
+        logger.warning(f"Variable metadata for {variables_url} is not cached, skipping validation in offline mode")
+        return None
+    else:
+        logger.info(f"Fetching variable metadata from {variables_url}")
+        metadata = get_response_as_json(variables_url, params=None)
+        if not metadata or 'variables' not in metadata:
+            logger.warning(f"Could not fetch variable metadata from {variables_url}, skipping validation")
+            return None
+        codes = set(metadata['variables'])
+        write_variable_codes(file_path, codes)
+
+    with loaded_lock:
+        loaded_variable_codes[variables_url] = codes
+    return codes
+
+def validate_codes(
+    codes: list[str],
+    valid_codes: set[str] | None,
+    table_name: str,
+    year: int
+) -> list[str]:
+    """
+    Report codes the dataset does not publish
+    Returns: list: The invalid codes
+    """
+    if valid_codes is None:
+        return []
+    invalid_codes = [code for code in codes if code not in valid_codes]
+    for code in invalid_codes:
+        logger.error(f"Variable code {code} does not exist in the {year} {table_name} dataset")
+    return invalid_codes
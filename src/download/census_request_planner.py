@@ -0,0 +1,109 @@
+import os
+from typing import TypedDict
+from utils.logger_utils import setup_logging
+from utils.file_utils import get_project_path
+from utils.census_utils import load_census_config, get_variable_catalog
+
+logger = setup_logging()
+
+class CensusRequest(TypedDict):
+    table_name: str
+    year: int
+    chunk_index: int
+    codes: list[str]
+    width: int
+
+
+def get_default_column_names(config: dict) -> list[str]:
+    """Get the names of the default columns included in every request."""
+    return [col['name'] for col in config['default_columns']]
+
+def get_request_codes(config: dict, year: int, table_name: str) -> list[str]:
+    """
+    Get the variable codes actually requested for a table and year.
+    Year overrides are applied and variables marked missing are dropped.
+    Default columns are excluded since they are added to every request.
+    """
+    default_columns = set(get_default_column_names(config))
+    # The catalog lists each code once, in the config order
+    codes = get_variable_catalog(config).get_codes(table_name, year)
+    return [code for code in codes if code not in default_columns]
+
+def get_request_capacity(config: dict) -> int:
+    """Get the number of variable codes that fit in one request alongside the default columns."""
+    api_var_limit = config['constants'].get('api_var_limit', 50)
+    capacity = api_var_limit - len(config['default_columns'])
+    if capacity <= 0:
+        raise ValueError(f"api_var_limit {api_var_limit} leaves no room for variables after the default columns")
+    return capacity
+
+def plan_table_year(config: dict, table_name: str, year: int, valid_codes: set[str] = None) -> list[CensusRequest]:
+    """
+    Pack the codes for a table and year into the fewest requests.
+    Every request is filled up to api_var_limit, only the last one can be narrower.
+    Codes not in valid_codes, when given, are pruned before packing.
+    """
+    codes = get_request_codes(config, year, table_name)
+    if valid_codes is not None:
+        codes = [code for code in codes if code in valid_codes]
+    capacity = get_request_capacity(config)
+    num_defaults = len(config['default_columns'])
+
+    return [
+        CensusRequest(
+            table_name=table_name,
+            year=year,
+            chunk_index=chunk_index,
+            codes=codes[start:start + capacity],
+            width=num_defaults + len(codes[start:start + capacity])
+        )
+        for chunk_index, start in enumerate(range(0, len(codes), capacity))
+    ]
+
+def plan_census_requests(
+    config: dict,
+    table_name: str,
+    first_year: int,
+    last_year: int,
+    valid_codes_by_year: dict[int, set[str] | None] = None
+) -> list[CensusRequest]:
+    """Plan the requests for a table across a range of years."""
+    valid_codes_by_year = valid_codes_by_year or {}
+    plan = []
+    for year in range(first_year, last_year + 1):
+        plan.extend(plan_table_year(config, table_name, year, valid_codes_by_year.get(year)))
+    return plan
+
+def log_request_plan(plan: list[CensusRequest], num_geo_levels: int = 1) -> None:
+    """Log the planned requests and their widths, e.g. for a dry run."""
+    for request in plan:
+        logger.info(
+            f"{request['table_name']} {request['year']} chunk {request['chunk_index']}: "
+            f"{request['width']} columns ({len(request['codes'])} variable codes)"
+        )
+    logger.info(f"Planned {len(plan)} requests per geo level, {len(plan) * num_geo_levels} requests in total")
+
+def main(project_path=None, config_path=None, config=None) -> list[CensusRequest]:
+    """Dry run: list the requests a download would make without calling the API."""
+    if project_path is None:
+        project_path = get_project_path()
+    if config_path is None:
+        config_path = os.path.join(project_path, 'config/census_variables.yml')
+    if config is None:
+        config = load_census_config(config_path)
+
+    plan = []
+    for table in config['tables']:
+        plan.extend(plan_census_requests(
+            config,
+            table['name'],
+            config['constants']['first_year'],
+            config['constants']['last_year']
+        ))
+
+    log_request_plan(plan, num_geo_levels=len(config['geo_levels']))
+    return plan
+
+
+if __name__ == "__main__":
+    main()
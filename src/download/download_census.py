@@ -1,14 +1,24 @@
 import pandas as pd
 import os
-import math
-from typing import TypedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, TypedDict
+from urllib.parse import urlparse
 from utils.logger_utils import setup_logging
-from utils.api_utils import get_response_as_df
-from utils.file_utils import prepare_and_clean_folder, write_df_to_csv, get_project_path
-from utils.census_utils import load_census_config, get_column_string
+from utils.api_utils import get_response_as_df, set_rate_limit, set_retry_policy
+from utils.retry_utils import RetryPolicy, configure_circuit_breaker, reset_retry_stats, log_retry_stats
+from utils.session_utils import configure_session, log_connection_stats
+from utils.cache_utils import ResponseCache
+from utils.manifest_utils import DownloadManifest, get_unit_signature
+from utils.file_utils import prepare_and_clean_folder, create_output_dir, write_df, get_project_path, get_storage_format, get_file_extension, is_data_file, delete_csv, delete_parquet
+from utils.census_utils import load_census_config, get_variable_catalog, CATALOG_CACHE_FOLDER
+from utils.schema_utils import apply_dtype_schema, read_census_file
+from download.census_request_planner import plan_census_requests, get_default_column_names, get_request_codes, log_request_plan
+from download.census_metadata import get_valid_variable_codes, get_metadata_file_path, validate_codes
 
 logger = setup_logging()
 
+MANIFEST_FILE_NAME = 'manifest.json'
+
 class CensusConfig(TypedDict):
     variables: dict[str, dict]
     suffixes: list[str]
@@ -17,10 +27,11 @@ class CensusConfig(TypedDict):
 
 
 def create_file_name(config: dict, year: int, chunk_number: int,geo_level: str, table_name: str=None) -> str:
-    """Create a file name for the processed Census data."""
+    """Create a file name for the processed Census data, with the extension of the configured storage format."""
     file_name_prefix = config['constants']['file_name_prefix']
+    extension = get_file_extension(get_storage_format(config))
 
-    return f"{file_name_prefix}_{table_name}_{geo_level}_{year}_{chunk_number}.csv"
+    return f"{file_name_prefix}_{table_name}_{geo_level}_{year}_{chunk_number}{extension}"
 
 def create_url(config: dict, year: int, table: dict) -> str:
     """Create URL for Census API request."""
@@ -29,94 +40,296 @@ def create_url(config: dict, year: int, table: dict) -> str:
         return f"{base_url_template.format(year=str(year))}"
     return f"{base_url_template.format(year=str(year))}/{table['url_segment']}"
 
-def get_census_as_df(config: dict, year: int, table: dict, geo_level:dict, variables: list) -> pd.DataFrame | None:
-    """Retrieve data from the Census API for a specific year."""
+def get_census_as_df(config: dict, year: int, table: dict, geo_level:dict, codes: list, cache: ResponseCache = None) -> pd.DataFrame | None:
+    """
+    Retrieve the variable codes planned for a request from the Census API for a specific year.
+    Columns are converted to the dtype schema of the variable catalog, e.g. float32 margins of error.
+    """
     url = create_url(config, year, table)
-    table_name = table['name']
+    columns = get_default_column_names(config) + codes
+    logger.info(f"Number of variables being passed to API {len(columns)}")
 
     params = {
-        'get': get_column_string(config, year, table_name, variables),
+        'get': ','.join(columns),
         'for': f'{geo_level['for_parameter']}:*'
     }
     
     logger.info(f"Downloading Census data for {year}: {params}")
     
     try:
-        df = get_response_as_df(url, params)
+        ttl = cache.get_ttl(year) if cache is not None else None
+        df = get_response_as_df(url, params, cache=cache, ttl=ttl, numeric_columns=set(codes))
+        if df is not None:
+            df = apply_dtype_schema(df, get_variable_catalog(config).get_dtypes(df.columns))
         logger.info(f"Processed data for {year}")
         return df
     except Exception as e:
         logger.error(f"Error getting data for {year}: {e}")
         return None
 
-def calculate_chunk_size(config: dict, table_name: str) -> int:
-    """Calculate the chunk size for Census API requests."""
-    num_variables = len(config['variables'].get(table_name, []))
-    return math.floor(50 / len(config['suffixes']))
-
-def calculate_num_chunks(config: dict, table_name: str) -> int:
-    """Calculate the number of chunks for Census API requests."""
-    num_variables = len(config['variables'].get(table_name, []))
-    chunk_size = calculate_chunk_size(config, table_name)
-    return (num_variables + chunk_size - 1) // chunk_size
-
-def calculate_chunk_variables(config: dict, table_name: str, chunk_index: int) -> list:
-    """
-    Calculate variables for a chunk accounting for suffixes multiplication.
-    In the census data, each variable has multiple suffixes that represent different measures.
-    The API allows for a maximum of 50 variables per request. This function calculates the
-    variables for a chunk based on the number of suffixes and the total number of variables.
-    """
-    num_suffixes = len(config['suffixes'])
-    num_default_columns = len(config['default_columns'])
-    child_var_limit = 50
-    parent_var_limit = (child_var_limit - num_default_columns) // num_suffixes
-    
-    variables = list(config['variables'].get(table_name, []))
-    start = chunk_index * parent_var_limit
-    end = min((chunk_index + 1) * parent_var_limit, len(variables))
-    
-    return variables[start:end]
-
 def validate_year_range(first_year: int, last_year: int) -> None:
     if first_year > last_year:
         raise ValueError("First year must be less than or equal to last year")
     if first_year < 2000:  # Or whatever earliest valid year is
         raise ValueError("Census API data not available before 2000")
 
-def download_census_data(
+class CensusWorkItem(TypedDict):
+    table: dict
+    geo_level: dict
+    year: int
+    chunk_index: int
+    num_chunks: int
+    codes: list
+    width: int
+    file_path: str
+
+class DownloadResult(TypedDict):
+    table_name: str
+    geo_level: str
+    year: int
+    chunk_index: int
+    file_path: str
+    success: bool
+    rows: int
+    error: str | None
+
+
+def build_work_items(
     folder_path: str,
     first_year: int,
     last_year: int,
     config: CensusConfig,
-    table: dict
-) -> None:
-    """Download census data for a range of years and save to CSV files."""
-    years = [year for year in range(first_year, last_year + 1)]
+    table: dict,
+    valid_codes_by_year: dict[int, set[str] | None] = None
+) -> list[CensusWorkItem]:
+    """Build the (table, geo_level, year, chunk) work items for a table from the request plan."""
     table_name = table['name']
+    plan = plan_census_requests(config, table_name, first_year, last_year, valid_codes_by_year)
+    num_chunks_by_year = {}
+    for request in plan:
+        num_chunks_by_year[request['year']] = num_chunks_by_year.get(request['year'], 0) + 1
 
+    work_items = []
     for geo_level in config['geo_levels']:
+        for request in plan:
+            year = request['year']
+            chunk_index = request['chunk_index']
+            file_name = create_file_name(config, year, chunk_index, geo_level['file_name_segment'], table_name)
+            work_items.append(CensusWorkItem(
+                table=table,
+                geo_level=geo_level,
+                year=year,
+                chunk_index=chunk_index,
+                num_chunks=num_chunks_by_year[year],
+                codes=request['codes'],
+                width=request['width'],
+                file_path=os.path.join(folder_path, file_name)
+            ))
+
+    return work_items
 
-        for year in years:
+def prefetch_valid_codes(
+    project_path: str,
+    config: CensusConfig,
+    table: dict,
+    offline: bool = False
+) -> dict[int, set[str] | None]:
+    """
+    Fetch each year's variable metadata for a table and validate the planned codes before any data request.
+    Invalid codes are pruned from the plan, or raise a ValueError if prune_invalid is disabled.
+    Returns: dict: year -> valid codes, None for years whose metadata is not available
+    """
+    validation_config = config['constants'].get('validation', {})
+    metadata_folder = os.path.join(project_path, validation_config.get('folder', 'data/cache/census/metadata'))
+    table_name = table['name']
+
+    valid_codes_by_year = {}
+    invalid_codes = {}
+    for year in range(config['constants']['first_year'], config['constants']['last_year'] + 1):
+        valid_codes = get_valid_variable_codes(
+            create_url(config, year, table),
+            get_metadata_file_path(metadata_folder, table, year),
+            offline=offline
+        )
+        valid_codes_by_year[year] = valid_codes
+        invalid = validate_codes(get_request_codes(config, year, table_name), valid_codes, table_name, year)
+        if invalid:
+            invalid_codes[year] = invalid
+
+    if invalid_codes:
+        if not validation_config.get('prune_invalid', True):
+            raise ValueError(f"Invalid variable codes in the {table_name} configuration: {invalid_codes}")
+        logger.warning(f"Pruning invalid variable codes from the {table_name} requests: {invalid_codes}")
+
+    return valid_codes_by_year
+
+def get_unit_key(item: CensusWorkItem) -> str:
+    """Get the manifest key of a work item."""
+    return f"{item['table']['name']}/{item['geo_level']['file_name_segment']}/{item['year']}/{item['chunk_index']}"
+
+def get_pending_work_items(work_items: list[CensusWorkItem], manifest: DownloadManifest) -> list[CensusWorkItem]:
+    """Get the work items that are not already complete in the manifest."""
+    pending = [
+        item for item in work_items
+        if not manifest.is_complete(get_unit_key(item), item['file_path'], get_unit_signature(item['codes']))
+    ]
+    if len(pending) < len(work_items):
+        logger.info(f"Resuming download, skipping {len(work_items) - len(pending)} completed work items")
+    return pending
 
-            num_chunks = calculate_num_chunks(config, table_name)
-            for chunk_index in range(num_chunks):
-                # Get variables for this chunk       
-                variables = calculate_chunk_variables(config, table_name, chunk_index)
-                logger.info(f"Downloading data for {year} chunk {chunk_index+1}/{num_chunks}\n")
-                logger.debug(f"Variables: {variables}")
+def download_work_item(
+    config: CensusConfig,
+    item: CensusWorkItem,
+    cache: ResponseCache = None,
+    manifest: DownloadManifest = None,
+    save: bool = True,
+    on_download: Callable[[CensusWorkItem, pd.DataFrame], None] = None
+) -> DownloadResult:
+    """
+    Download a single work item and save it to its chunk file, CSV or Parquet.
+    The file is written atomically and, if a manifest is given, recorded in it
+    so a retried chunk replaces its file instead of duplicating rows.
+    With on_download, the downloaded DataFrame is passed to it as well, e.g. to transform it in memory,
+    after the download is recorded, so its errors never mark the download as failed.
+    Without save, no chunk file is written and the manifest is not updated.
+    """
+    year = item['year']
+    file_path = item['file_path']
+    result = DownloadResult(
+        table_name=item['table']['name'],
+        geo_level=item['geo_level']['file_name_segment'],
+        year=year,
+        chunk_index=item['chunk_index'],
+        file_path=file_path,
+        success=False,
+        rows=0,
+        error=None
+    )
+
+    logger.info(f"Downloading {result['table_name']} {result['geo_level']} data for {year} chunk {item['chunk_index']+1}/{item['num_chunks']}\n")
+    logger.debug(f"Variable codes: {item['codes']}")
+
+    df = None
+    try:
+        df = get_census_as_df(config, year, item['table'], item['geo_level'], item['codes'], cache=cache)
+        if df is not None:
+            if save:
+                write_df(df, file_path, atomic=True)
+            result['success'] = True
+            result['rows'] = len(df)
+        else:
+            logger.error("Dataframe is None, skipping write to CSV")
+            result['error'] = "No data returned from the Census API"
+    except Exception as e:
+        logger.error(f"Error saving {year} data to {file_path}: {e}")
+        result['error'] = str(e)
+
+    if manifest is not None and save:
+        signature = get_unit_signature(item['codes'])
+        if result['success']:
+            manifest.record_success(get_unit_key(item), file_path, result['rows'], signature)
+        else:
+            manifest.record_failure(get_unit_key(item), result['error'], signature)
 
-                file_name = create_file_name(config, year, chunk_index, geo_level['file_name_segment'], table_name)
-                file_path = os.path.join(folder_path, file_name)
+    # The download result and manifest only record the download, on_download reports its own failures
+    if on_download is not None and result['success']:
+        try:
+            on_download(item, df)
+        except Exception as e:
+            logger.error(f"Error handling downloaded {result['table_name']} {year} chunk {item['chunk_index']}: {e}")
 
-                try:
-                    df = get_census_as_df(config, year, table, geo_level, variables)
-                    if df is not None:
-                        write_df_to_csv(df, file_path, append=True)
-                    else:
-                        logger.error("Dataframe is None, skipping write to CSV")
-                except Exception as e:
-                    logger.error(f"Error saving {year} data to {file_path}: {e}")
+    return result
+
+def download_census_data(
+    folder_path: str,
+    first_year: int,
+    last_year: int,
+    config: CensusConfig,
+    table: dict,
+    cache: ResponseCache = None,
+    manifest: DownloadManifest = None
+) -> list[DownloadResult]:
+    """Download census data for a range of years and save to CSV files."""
+    work_items = build_work_items(folder_path, first_year, last_year, config, table)
+    if manifest is not None:
+        work_items = get_pending_work_items(work_items, manifest)
+    return [download_work_item(config, item, cache, manifest) for item in work_items]
+
+def download_census_data_concurrent(
+    work_items: list[CensusWorkItem],
+    config: CensusConfig,
+    max_workers: int = 8,
+    cache: ResponseCache = None,
+    manifests: dict[str, DownloadManifest] = None,
+    save: bool = True,
+    on_download: Callable[[CensusWorkItem, pd.DataFrame], None] = None
+) -> list[DownloadResult]:
+    """
+    Download work items concurrently with at most max_workers requests in flight.
+    Rate limiting against the Census API is applied per request in get_response.
+    manifests maps each table name to the manifest its work items are recorded in.
+    on_download is called from the worker threads, see download_work_item.
+    """
+    manifests = manifests or {}
+    logger.info(f"Downloading {len(work_items)} work items with {max_workers} workers")
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                download_work_item, config, item, cache, manifests.get(item['table']['name']), save, on_download
+            ): item
+            for item in work_items
+        }
+        for future in as_completed(futures):
+            results.append(future.result())
+
+    # Report in a stable order regardless of completion order
+    results.sort(key=lambda r: (r['table_name'], r['geo_level'], r['year'], r['chunk_index']))
+    return results
+
+def replay_completed_work_items(
+    config: CensusConfig,
+    work_items: list[CensusWorkItem],
+    pending: list[CensusWorkItem],
+    on_download: Callable[[CensusWorkItem, pd.DataFrame], None]
+) -> None:
+    """Pass the chunk files of work items completed by an earlier run to on_download, as if they were downloaded."""
+    pending_keys = {get_unit_key(item) for item in pending}
+    catalog = get_variable_catalog(config)
+    for item in work_items:
+        if get_unit_key(item) not in pending_keys:
+            on_download(item, read_census_file(item['file_path'], catalog))
+
+def report_download_results(results: list[DownloadResult]) -> None:
+    """Log a summary of the download results and every failed work item."""
+    failures = [result for result in results if not result['success']]
+    total_rows = sum(result['rows'] for result in results)
+    logger.info(f"Census download complete: {len(results) - len(failures)}/{len(results)} work items succeeded, {total_rows} rows downloaded")
+    for failure in failures:
+        logger.error(
+            f"Failed: {failure['table_name']} {failure['geo_level']} {failure['year']} "
+            f"chunk {failure['chunk_index']} ({failure['file_path']}): {failure['error']}"
+        )
+
+def configure_download(config: dict) -> dict:
+    """
+    Get the download settings from the configuration, register the Census API rate limit,
+    retry policy and circuit breaker and size the shared HTTP connection pool to the download concurrency.
+    """
+    download_config = config['constants'].get('download', {})
+    host = urlparse(config['constants']['base_url_template']).netloc
+
+    requests_per_second = download_config.get('requests_per_second')
+    if requests_per_second:
+        set_rate_limit(host, requests_per_second, download_config.get('burst', 1))
+
+    max_workers = download_config.get('max_workers', 8)
+    configure_session(pool_maxsize=max_workers, host_pool_limits={host: max_workers})
+
+    set_retry_policy(host, RetryPolicy(**download_config.get('retry', {})))
+    configure_circuit_breaker(host, **download_config.get('circuit_breaker', {}))
+    reset_retry_stats()
+    return download_config
 
 def validate_year_range(start_year: int, end_year: int) -> None:
     if not isinstance(start_year, int) or not isinstance(end_year, int):
@@ -140,24 +353,155 @@ def get_year_range(config: dict) -> tuple:
         raise
 
 
-def main(project_path=None, config_path=None, config=None) -> None:
+def create_response_cache(project_path: str, config: dict, offline: bool = None) -> ResponseCache | None:
+    """Create the Census API response cache from the configuration, None if caching is disabled."""
+    cache_config = config['constants'].get('cache', {})
+    if offline is None:
+        offline = cache_config.get('offline', False)
+    if not cache_config.get('enabled', False) and not offline:
+        return None
+
+    seconds_per_day = 24 * 60 * 60
+    max_size_mb = cache_config.get('max_size_mb')
+    default_ttl_days = cache_config.get('default_ttl_days')
+
+    return ResponseCache(
+        cache_dir=os.path.join(project_path, cache_config.get('folder', 'data/cache/census/responses')),
+        max_size_bytes=max_size_mb * 1024 * 1024 if max_size_mb else None,
+        default_ttl=default_ttl_days * seconds_per_day if default_ttl_days else None,
+        ttl_by_year={
+            int(year): days * seconds_per_day
+            for year, days in (cache_config.get('ttl_days_by_year') or {}).items()
+        },
+        offline=offline
+    )
+
+def delete_stale_chunk_files(folder_path: str, work_items: list[CensusWorkItem]) -> int:
+    """
+    Delete the chunk files of a table folder that are not a work item of the current plan
+    e.g. chunks of years dropped from the configuration, higher chunk indices of an older plan or
+    CSV chunks left after switching to Parquet, which the transform would otherwise merge.
+    Returns: int: The number of files deleted
+    """
+    planned = {os.path.abspath(item['file_path']) for item in work_items}
+    deleted = 0
+    for entry in os.scandir(folder_path):
+        if not is_data_file(entry.name) or os.path.abspath(entry.path) in planned:
+            continue
+        logger.info(f"Deleting chunk file {entry.path}, it is not part of the current request plan")
+        if entry.name.endswith('.csv'):
+            delete_csv(entry.path)
+        else:
+            delete_parquet(entry.path)
+        deleted += 1
+    return deleted
+
+def main(
+    project_path=None,
+    config_path=None,
+    config=None,
+    concurrent=None,
+    offline=None,
+    resume=True,
+    dry_run=False,
+    save_chunks=True,
+    on_download: Callable[[CensusWorkItem, pd.DataFrame], None] = None
+) -> list[DownloadResult]:
+    """
+    Download the Census tables in the configuration.
+    With resume, work items already completed in each table's manifest are skipped and chunk files
+    outside the current plan are deleted, otherwise the table folders are cleaned and everything is downloaded again.
+    A dry run only logs the planned requests and their widths.
+    With on_download, every chunk DataFrame is passed to it, including the chunk files of
+    skipped work items. Without save_chunks no raw chunk files are written and nothing is skipped.
+    """
     if project_path is None:
         project_path = get_project_path()
     if config_path is None:
         config_path = os.path.join(project_path, 'config/census_variables.yml')
     if config is None:
         config = load_census_config(config_path)
-    
+    # Compile the variable catalog the request planner reads from, or load it from the cache
+    get_variable_catalog(config, cache_folder=os.path.join(project_path, CATALOG_CACHE_FOLDER))
+
+    if dry_run:
+        for table in config['tables']:
+            plan = plan_census_requests(
+                config,
+                table['name'],
+                config['constants']['first_year'],
+                config['constants']['last_year']
+            )
+            log_request_plan(plan, num_geo_levels=len(config['geo_levels']))
+        return []
+
+    download_config = configure_download(config)
+    cache = create_response_cache(project_path, config, offline)
+    validate = config['constants'].get('validation', {}).get('enabled', False)
+    if concurrent is None:
+        concurrent = download_config.get('concurrent', False)
+
+    work_items = []
+    manifests = {}
     for table in config['tables']:
         folder_path = os.path.join(project_path, 'data/raw/census', table['name'])
-        prepare_and_clean_folder(folder_path)
-        download_census_data(
+        manifest = DownloadManifest(os.path.join(folder_path, MANIFEST_FILE_NAME))
+        if resume:
+            create_output_dir(folder_path)
+        else:
+            prepare_and_clean_folder(folder_path)
+            manifest.clear()
+        manifests[table['name']] = manifest
+
+        valid_codes_by_year = None
+        if validate:
+            valid_codes_by_year = prefetch_valid_codes(
+                project_path,
+                config,
+                table,
+                offline=cache is not None and cache.offline
+            )
+
+        table_work_items = build_work_items(
             folder_path=folder_path,
             first_year=config['constants']['first_year'],
             last_year=config['constants']['last_year'],
             config=config,
             table=table,
+            valid_codes_by_year=valid_codes_by_year
+        )
+        if resume:
+            delete_stale_chunk_files(folder_path, table_work_items)
+        if not save_chunks:
+            work_items.extend(table_work_items)
+            continue
+        pending = get_pending_work_items(table_work_items, manifest)
+        if on_download is not None:
+            replay_completed_work_items(config, table_work_items, pending, on_download)
+        work_items.extend(pending)
+
+    if concurrent:
+        results = download_census_data_concurrent(
+            work_items,
+            config,
+            max_workers=download_config.get('max_workers', 8),
+            cache=cache,
+            manifests=manifests,
+            save=save_chunks,
+            on_download=on_download
         )
+    else:
+        results = [
+            download_work_item(config, item, cache, manifests[item['table']['name']], save_chunks, on_download)
+            for item in work_items
+        ]
+
+    if cache is not None:
+        cache.flush()
+    report_download_results(results)
+    log_connection_stats()
+    log_retry_stats()
+    return results
 
 
 if __name__ == "__main__":
@@ -1,11 +1,16 @@
 from dotenv import load_dotenv
 import os
+import json
 import datetime
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypedDict
 from utils.logger_utils import setup_logging
 import requests
-from utils.file_utils import create_output_dir, write_response_to_csv
+from utils.file_utils import create_output_dir, write_response_to_csv, get_part_file_path
 from utils.api_utils import get_response
+from utils.session_utils import log_connection_stats
 
 
 #Load the environment variables
@@ -13,67 +18,193 @@ load_dotenv()
 
 logger = setup_logging()
 
-timestamps = {
-    "start_time": None,
-    "download_end_time": None,
-    "write_end_time": None
-    
-}
+#Streaming buffer size for response bodies
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+STATE_FILE_NAME = 'download_state.json'
+state_lock = threading.Lock()
 
-def get_csv(url: str, csv_output_name: str, folder_path: str) -> None:
+def load_download_state(folder_path: str) -> dict:
+    """
+    Load the validators (ETag and Last-Modified) recorded for each downloaded file
+    """
+    state_path = os.path.join(folder_path, STATE_FILE_NAME)
+    if not os.path.exists(state_path):
+        return {}
+    try:
+        with open(state_path, 'r') as file:
+            return json.load(file)
+    except (IOError, ValueError) as e:
+        logger.error(f"Error reading download state {state_path}, files will be downloaded in full: {e}")
+        return {}
+
+def update_download_state(folder_path: str, csv_output_name: str, file_state: dict) -> None:
+    """
+    Update the state of one file and write the state file atomically
+    """
+    state_path = os.path.join(folder_path, STATE_FILE_NAME)
+    with state_lock:
+        state = load_download_state(folder_path)
+        state[csv_output_name] = file_state
+        temp_path = f"{state_path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(state, file, indent=2)
+        os.replace(temp_path, state_path)
+
+def build_request_headers(file_path: str, file_state: dict) -> dict:
+    """
+    Build the headers that resume a partial download with a Range request,
+    or skip an unchanged file with a conditional request
+    """
+    headers = {}
+    part_path = get_part_file_path(file_path)
+    part_validator = file_state.get('part_etag') or file_state.get('part_last_modified')
+
+    if os.path.exists(part_path) and part_validator:
+        # If-Range makes the server send the whole file if it changed since the part was written
+        headers['Range'] = f"bytes={os.path.getsize(part_path)}-"
+        headers['If-Range'] = part_validator
+    elif os.path.exists(file_path):
+        if file_state.get('etag'):
+            headers['If-None-Match'] = file_state['etag']
+        if file_state.get('last_modified'):
+            headers['If-Modified-Since'] = file_state['last_modified']
+
+    return headers
+
+class RealtorDownloadResult(TypedDict):
+    csv_output_name: str
+    url: str
+    status: str
+    bytes: int
+    elapsed_seconds: float
+    ttfb_seconds: float | None
+    bytes_per_second: float | None
+    error: str | None
+
+
+def get_csv(url: str, csv_output_name: str, folder_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> RealtorDownloadResult:
 
     """
     Make a request to download a CSV file
+    Unchanged files are skipped and interrupted downloads are resumed
+
+    Returns: RealtorDownloadResult: The outcome with bytes/sec and time to first byte
     """
 
     logger.info(f"Downloading {csv_output_name} from {url}...")
-    
-
-    timestamps["start_time"] = datetime.datetime.now()
-    logger.info(f"Download start time: {timestamps['start_time']}")
+    start_time = time.monotonic()
+    result = RealtorDownloadResult(
+        csv_output_name=csv_output_name,
+        url=url,
+        status='failed',
+        bytes=0,
+        elapsed_seconds=0.0,
+        ttfb_seconds=None,
+        bytes_per_second=None,
+        error=None
+    )
 
     try:
         create_output_dir(folder_path)
-        response = get_response(url=url)
-        if(response):
-            timestamps["download_end_time"] = datetime.datetime.now()
-            logger.info(f"Download end time: {timestamps["download_end_time"]}")
-            
-            file_path = f"{folder_path}/{csv_output_name}"
-
-            write_response_to_csv(response, file_path)
-            
-            timestamps["write_end_time"] = datetime.datetime.now()
-            logger.info(f"Download complete for {csv_output_name}, saved to {file_path}")
-            logger.info(f"Time to download and process: {timestamps["write_end_time"] - timestamps["start_time"]}")
-
-            
+        file_path = f"{folder_path}/{csv_output_name}"
+        file_state = load_download_state(folder_path).get(csv_output_name, {})
+        headers = build_request_headers(file_path, file_state)
+
+        response = get_response(url=url, stream=True, headers=headers, allowed_statuses=(416,) if 'Range' in headers else ())
+        if response is not None and response.status_code == 416:
+            # 416 Range Not Satisfiable, the partial file can not be resumed, start over
+            # A failed If-Range check needs no handling, the server sends the whole file with a 200 instead
+            logger.info(f"Could not resume {csv_output_name}, downloading the full file")
+            response.close()
+            os.remove(get_part_file_path(file_path))
+            response = get_response(url=url, stream=True)
+
+        if response is None:
+            result['error'] = "No response received"
+        else:
+            # Time from sending the request until the response headers arrived
+            result['ttfb_seconds'] = response.elapsed.total_seconds()
+
+            if response.status_code == 304:
+                logger.info(f"{csv_output_name} has not changed since the last download, skipping")
+                result['status'] = 'unchanged'
+            else:
+                resumed = response.status_code == 206
+                if resumed:
+                    logger.info(f"Resuming download of {csv_output_name} from byte {os.path.getsize(get_part_file_path(file_path))}")
+
+                # Remember the validators of the transfer in progress so it can be resumed
+                file_state.update({
+                    'part_etag': response.headers.get('ETag'),
+                    'part_last_modified': response.headers.get('Last-Modified')
+                })
+                update_download_state(folder_path, csv_output_name, file_state)
+
+                result['bytes'] = write_response_to_csv(response, file_path, append=resumed, chunk_size=chunk_size)
+                result['status'] = 'resumed' if resumed else 'downloaded'
+
+                update_download_state(folder_path, csv_output_name, {
+                    'url': url,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'completed_at': datetime.datetime.now().isoformat()
+                })
+                logger.info(f"Download complete for {csv_output_name}, saved to {file_path}")
+
     except Exception as e:
         logger.error(f"Error getting response for {csv_output_name}: {e}")
+        result['error'] = str(e)
 
+    result['elapsed_seconds'] = time.monotonic() - start_time
+    if result['bytes'] and result['elapsed_seconds'] > 0:
+        result['bytes_per_second'] = result['bytes'] / result['elapsed_seconds']
+    return result
 
 
-def download_realtor_data(folder_path: str) -> None:
-    
+def get_realtor_files() -> list[tuple[str, str]]:
     """
-    Download the Realtor.com CSV files
-    
-    Parameters:
-    folder_path (str): The folder path to save the CSV files
+    Get the URL and output file name of each Realtor.com history file
     """
 
     base_url = 'https://econdata.s3-us-west-2.amazonaws.com/Reports/Core/RDC_Inventory_Core_Metrics_'
     tables = ['Country', 'State', 'Metro', 'County', 'Zip']
     table_type = 'History'
     file_extension = '.csv'
+
+    return [
+        (base_url + table + "_" + table_type + file_extension, "realtor_" + table.lower() + ".csv")
+        for table in tables
+    ]
+
+
+def download_realtor_data(
+    folder_path: str,
+    max_workers: int = 5,
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> list[RealtorDownloadResult]:
     
-    #Iterate through the tables
-    for table in tables:
-        url = base_url + table + "_" + table_type + file_extension
-        csv_output_name = "realtor_" + table.lower() + ".csv"
+    """
+    Download the Realtor.com CSV files in parallel
+    
+    Parameters:
+    folder_path (str): The folder path to save the CSV files
+    max_workers (int): The maximum number of files downloaded at once
+    chunk_size (int): The streaming buffer size in bytes
 
+    Returns: list[RealtorDownloadResult]: One result per file, in table order
+    """
+
+    files = get_realtor_files()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
         #Get the data from the API
-        get_csv(url=url, csv_output_name=csv_output_name, folder_path=folder_path)
+        results = list(executor.map(
+            lambda file: get_csv(url=file[0], csv_output_name=file[1], folder_path=folder_path, chunk_size=chunk_size),
+            files
+        ))
+
+    log_connection_stats()
+    return results
 
 def main() -> None:
 
@@ -0,0 +1,120 @@
+import os
+from sqlalchemy import text
+from utils.db_utils import get_engine, quote_identifier
+from utils.logger_utils import setup_logging
+
+logger = setup_logging()
+
+#Table in each raw schema recording the chunks committed by full loads
+CHECKPOINT_TABLE = '_ingest_checkpoints'
+
+
+def get_checkpoint_table(schema: str) -> str:
+    return f"{quote_identifier(schema)}.{quote_identifier(CHECKPOINT_TABLE)}"
+
+
+def ensure_checkpoint_table(schema: str) -> None:
+    """Create the checkpoint table of a schema if it does not exist"""
+    sql_statement = (
+        f"CREATE TABLE IF NOT EXISTS {get_checkpoint_table(schema)} ("
+        "table_name VARCHAR NOT NULL, "
+        "signature VARCHAR NOT NULL, "
+        "chunk_start BIGINT NOT NULL, "
+        "chunk_end BIGINT, "
+        "row_count BIGINT NOT NULL, "
+        "committed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, "
+        "PRIMARY KEY (table_name, signature, chunk_start))"
+    )
+    with get_engine().connect() as connection:
+        connection.execute(text(sql_statement))
+        connection.commit()
+
+
+def get_file_signature(file_path: str, method: str, chunk_size: int) -> str:
+    """
+    Identify a file and how it is split into chunks
+    A checkpoint only applies to the same file contents split the same way.
+    A partitioned Parquet dataset folder is identified by all of its files.
+    """
+    if os.path.isdir(file_path):
+        stats = [
+            os.stat(os.path.join(folder, file))
+            for folder, _, files in os.walk(file_path) for file in files
+        ]
+        size = sum(stat.st_size for stat in stats)
+        mtime = max((stat.st_mtime_ns for stat in stats), default=0)
+        return f"{size}:{mtime}:{len(stats)}:{method}:{chunk_size}"
+    stat = os.stat(file_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}:{method}:{chunk_size}"
+
+
+def get_committed_chunks(schema: str, table_name: str, signature: str) -> dict[int, int]:
+    """
+    Get the chunks of a file already committed to a table
+    Returns: dict: Chunk start (byte offset for COPY, row offset for inserts) -> rows loaded
+    """
+    sql_statement = (
+        f"SELECT chunk_start, row_count FROM {get_checkpoint_table(schema)} "
+        "WHERE table_name = :table_name AND signature = :signature"
+    )
+    with get_engine().connect() as connection:
+        rows = connection.execute(text(sql_statement), {'table_name': table_name, 'signature': signature}).fetchall()
+    return {row.chunk_start: row.row_count for row in rows}
+
+
+def clear_checkpoints(schema: str, table_name: str) -> None:
+    """Forget the committed chunks of a table, e.g. before it is reloaded from scratch"""
+    with get_engine().connect() as connection:
+        connection.execute(
+            text(f"DELETE FROM {get_checkpoint_table(schema)} WHERE table_name = :table_name"),
+            {'table_name': table_name}
+        )
+        connection.commit()
+
+
+def record_checkpoint(
+    connection,
+    schema: str,
+    table_name: str,
+    signature: str,
+    chunk_start: int,
+    chunk_end: int | None,
+    row_count: int
+) -> None:
+    """Record a committed chunk, using the connection of the transaction that loaded it"""
+    connection.execute(
+        text(
+            f"INSERT INTO {get_checkpoint_table(schema)} (table_name, signature, chunk_start, chunk_end, row_count) "
+            "VALUES (:table_name, :signature, :chunk_start, :chunk_end, :row_count)"
+        ),
+        {
+            'table_name': table_name,
+            'signature': signature,
+            'chunk_start': chunk_start,
+            'chunk_end': chunk_end,
+            'row_count': row_count
+        }
+    )
+
+
+def record_checkpoint_with_cursor(
+    cursor,
+    schema: str,
+    table_name: str,
+    signature: str,
+    chunk_start: int,
+    chunk_end: int | None,
+    row_count: int
+) -> None:
+    """Record a committed chunk with the DBAPI cursor of a COPY, see db_utils.copy_from_stream"""
+    cursor.execute(
+        f"INSERT INTO {get_checkpoint_table(schema)} (table_name, signature, chunk_start, chunk_end, row_count) "
+        "VALUES (%s, %s, %s, %s, %s)",
+        (table_name, signature, chunk_start, chunk_end, row_count)
+    )
+
+
+def get_dead_letter_path(dead_letter_folder: str, table_name: str, chunk_start: int, chunk_end: int | None) -> str:
+    """Get the file a chunk that could not be loaded is saved to"""
+    end = '' if chunk_end is None else f"_{chunk_end}"
+    return os.path.join(dead_letter_folder, f"{table_name}_{chunk_start}{end}.csv")
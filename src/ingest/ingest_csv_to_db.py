@@ -1,10 +1,28 @@
 import pandas as pd
+import io
 import os
+import time
 import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import Callable, TypedDict
 from dotenv import load_dotenv
-from utils.db_utils import get_engine, delete_table, create_table
+from utils.db_utils import get_engine, delete_table, create_table, table_exists, get_row_count, copy_from_stream, widen_column_to_text, get_copy_error_column
 from utils.logger_utils import setup_logging
-from utils.file_utils import get_project_path
+from utils.file_utils import (
+    get_project_path, create_output_dir, read_csv_header, get_csv_byte_ranges, FileRange, write_csv_range, write_df_to_csv,
+    is_parquet_path, is_data_file, read_columns, get_parquet_dataset, get_parquet_fragments, ParquetCsvStream
+)
+from utils.retry_utils import RetryPolicy
+from utils.batch_utils import BatchSizeController, get_learned_batch_state, update_batch_state, DEFAULT_BATCH_SIZE, DEFAULT_MEMORY_LIMIT
+from ingest.ingest_incremental import ingest_csv_incremental, REALTOR_KEY_COLUMNS, MONTH_COLUMN
+from utils.schema_utils import infer_column_types, get_census_column_types, DEFAULT_SAMPLE_ROWS
+from utils.census_utils import load_census_config
+from ingest.ingest_swap import get_shadow_table_name, get_live_table_name, finalize_shadow_table, swap_shadow_table
+from ingest.ingest_checkpoint import (
+    ensure_checkpoint_table, get_file_signature, get_committed_chunks, clear_checkpoints,
+    record_checkpoint, record_checkpoint_with_cursor, get_dead_letter_path
+)
 
 
 logger = setup_logging()
@@ -12,42 +30,354 @@ load_dotenv()
 
 env = os.getenv("ENV")
 
-def ingest_csv_to_db(file_path: str, schema: str, table_name: str) -> None:
+class IngestStats(TypedDict):
+    table_name: str
+    method: str
+    rows: int
+    seconds: float
+    rows_per_second: float | None
+    failed_chunks: int
 
+class IngestUnit(TypedDict):
+    file_path: str
+    table_name: str
+    byte_range: tuple[int, int] | None
+    signature: str
+
+
+#Bytes read from the file per COPY round trip
+DEFAULT_COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+#Files are split into byte-range chunks of this size, loaded on separate connections and checkpointed
+DEFAULT_SHARD_SIZE = 128 * 1024 * 1024
+
+#Attempts and backoff for chunks that fail to load, e.g. on a dropped connection
+DEFAULT_RETRY_POLICY = RetryPolicy(max_retries=5, base_delay=1, max_delay=30)
+
+BATCH_STATE_FILE_NAME = 'batch_sizes.json'
+
+def get_default_method(engine) -> str:
+    """COPY for PostgreSQL, DataFrame.to_sql for any other engine"""
+    return 'copy' if engine.dialect.name == 'postgresql' else 'insert'
+
+def copy_csv_range_to_db(
+    file_path: str,
+    schema: str,
+    table_name: str,
+    byte_range: tuple[int, int],
+    engine,
+    buffer_size: int = DEFAULT_COPY_BUFFER_SIZE,
+    checkpoint: str = None
+) -> int:
+    """
+    Stream the rows in a byte range of a CSV file into a PostgreSQL table with COPY ... FROM STDIN
+    The rows are not parsed by pandas, values are loaded exactly as they appear in the file.
+    With checkpoint, a file signature, the range is recorded as committed in the same transaction.
+
+    Returns: int: The number of rows loaded
+    """
+    with open(file_path, 'rb') as file:
+        columns = read_csv_header(file)
+
+    after_copy = None
+    if checkpoint is not None:
+        after_copy = lambda cursor, row_count: record_checkpoint_with_cursor(
+            cursor, schema, table_name, checkpoint, byte_range[0], byte_range[1], row_count
+        )
+
+    with io.BufferedReader(FileRange(file_path, *byte_range), buffer_size=buffer_size) as stream:
+        return copy_from_stream(
+            stream, schema, table_name, columns, engine=engine, buffer_size=buffer_size, after_copy=after_copy
+        )
+
+def copy_with_text_fallback(copy_function, schema: str, table_name: str) -> int:
+    """
+    Run a COPY into a typed table, widening a column to text and retrying whenever a
+    value does not fit the column's inferred type. The failed COPY is rolled back, so
+    retrying it loads nothing twice.
+
+    Returns: int: The number of rows loaded
+    """
+    widened_columns = set()
+    while True:
+        try:
+            return copy_function()
+        except Exception as e:
+            column = get_copy_error_column(e)
+            if column is None or column in widened_columns:
+                raise
+            logger.warning(f"Column {column} of {schema}.{table_name} does not fit its type, widening it to text")
+            widen_column_to_text(schema, table_name, column)
+            widened_columns.add(column)
+
+def is_data_error(error: Exception) -> bool:
+    """Check if a load failed on the data itself, which fails the same way on every attempt"""
+    error = getattr(error, 'orig', None) or error
+    return (getattr(error, 'pgcode', None) or '')[:2] in ('22', '23')
+
+def copy_parquet_to_db(
+    file_path: str,
+    schema: str,
+    table_name: str,
+    engine,
+    buffer_size: int = DEFAULT_COPY_BUFFER_SIZE,
+    checkpoint: str = None,
+    retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+    dead_letter_folder: str = None
+) -> tuple[int, int]:
+    """
+    Stream a Parquet file or partitioned dataset into a PostgreSQL table with COPY, one file per transaction
+    Record batches are converted to CSV as they are read, the data is never fully held in memory.
+    With checkpoint, a file signature, every file is recorded as committed by its index in the dataset
+    and files committed by an earlier run are skipped. Files that keep failing are saved to
+    dead_letter_folder as CSV.
+
+    Returns: tuple: The number of rows loaded and the number of files that failed
     """
-    Ingest the data from a CSV file into a PostgreSQL database
+    dataset = get_parquet_dataset(file_path)
+    columns = dataset.schema.names
+    committed = get_committed_chunks(schema, table_name, checkpoint) if checkpoint is not None else {}
+
+    rows = 0
+    failed_chunks = 0
+    for index, fragment in enumerate(get_parquet_fragments(dataset)):
+        if index in committed:
+            continue
+
+        after_copy = None
+        if checkpoint is not None:
+            after_copy = lambda cursor, row_count: record_checkpoint_with_cursor(
+                cursor, schema, table_name, checkpoint, index, None, row_count
+            )
+
+        def copy_fragment() -> int:
+            with io.BufferedReader(ParquetCsvStream(file_path, columns, fragment=index), buffer_size=buffer_size) as stream:
+                return copy_from_stream(
+                    stream, schema, table_name, columns, engine=engine, buffer_size=buffer_size, after_copy=after_copy
+                )
+
+        loaded = load_chunk_with_retries(
+            lambda: copy_with_text_fallback(copy_fragment, schema, table_name),
+            f"{fragment.path} of {file_path}",
+            retry_policy
+        )
+        if loaded is None:
+            failed_chunks += 1
+            if dead_letter_folder is not None:
+                create_output_dir(dead_letter_folder)
+                df = fragment.to_table(schema=dataset.schema, columns=columns).to_pandas()
+                write_df_to_csv(df, get_dead_letter_path(dead_letter_folder, table_name, index, None))
+        else:
+            rows += loaded
+    return rows, failed_chunks
+
+def load_chunk_with_retries(load: Callable[[], int], description: str, retry_policy: RetryPolicy) -> int | None:
+    """
+    Load a chunk, backing off between attempts
+    Returns: int | None: The number of rows loaded, or None if the chunk could not be loaded
+    """
+    for attempt in range(retry_policy.max_retries):
+        try:
+            return load()
+        except Exception as e:
+            if is_data_error(e) or attempt + 1 >= retry_policy.max_retries:
+                logger.error(f"Giving up on {description} after {attempt + 1} attempts: {e}")
+                return None
+            delay = retry_policy.get_backoff(attempt)
+            logger.warning(
+                f"Loading {description} failed, attempt {attempt + 1} of {retry_policy.max_retries}. "
+                f"Retrying in {delay:.1f} seconds: {e}"
+            )
+            time.sleep(delay)
+    return None
+
+def get_batch_state_path() -> str:
+    """Get the file the batch sizes learned for each table are kept in"""
+    return os.path.join(get_project_path(), 'data/cache/ingest', BATCH_STATE_FILE_NAME)
+
+def insert_csv_to_db(
+    file_path: str,
+    schema: str,
+    table_name: str,
+    engine,
+    checkpoint: str = None,
+    retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+    dead_letter_folder: str = None,
+    batch_state_path: str = None,
+    memory_limit: int = DEFAULT_MEMORY_LIMIT
+) -> tuple[int, int]:
+    """
+    Ingest a CSV file in batches with DataFrame.to_sql, for engines that do not support COPY
+    The batch size is tuned to the best rows/sec within memory_limit, starting from the size
+    learned for the table by earlier runs, and the result is saved to batch_state_path.
+    With checkpoint, a file signature, every batch is recorded as committed by row offset in the
+    same transaction and rows committed by an earlier run are skipped. Batches that keep failing
+    are saved to dead_letter_folder.
+
+    Returns: tuple: The number of rows loaded and the number of batches that failed
+    """
+    if batch_state_path is None:
+        batch_state_path = get_batch_state_path()
+    table_key = f"{schema}.{get_live_table_name(table_name)}"
+    learned_state = get_learned_batch_state(batch_state_path, table_key)
+    controller = BatchSizeController(
+        initial_size=learned_state.get('batch_size', DEFAULT_BATCH_SIZE),
+        memory_limit=memory_limit,
+        bytes_per_row=learned_state.get('bytes_per_row')
+    )
+    committed = get_committed_chunks(schema, table_name, checkpoint) if checkpoint is not None else {}
+
+    rows = 0
+    failed_chunks = 0
+    offset = 0
+    with pd.read_csv(file_path, iterator=True) as reader:
+        while True:
+            if offset in committed:
+                # Skip the rows an earlier run already loaded
+                try:
+                    offset += len(reader.get_chunk(committed[offset]))
+                except StopIteration:
+                    break
+                continue
+
+            # Stop at the next committed batch so it is not loaded twice
+            batch_size = controller.next_size()
+            next_committed = min((start for start in committed if start > offset), default=None)
+            if next_committed is not None:
+                batch_size = min(batch_size, next_committed - offset)
+            try:
+                chunk = reader.get_chunk(batch_size)
+            except StopIteration:
+                break
+            chunk_start = offset
+            offset += len(chunk)
+
+            def load_chunk() -> int:
+                with engine.begin() as connection:
+                    ingest_df_to_db(df=chunk, schema=schema, table_name=table_name, engine=connection)
+                    if checkpoint is not None:
+                        record_checkpoint(connection, schema, table_name, checkpoint, chunk_start, offset, len(chunk))
+                return len(chunk)
+
+            batch_start_time = time.perf_counter()
+            loaded = load_chunk_with_retries(load_chunk, f"rows {chunk_start}-{offset} of {file_path}", retry_policy)
+            if loaded is None:
+                failed_chunks += 1
+                if dead_letter_folder is not None:
+                    create_output_dir(dead_letter_folder)
+                    write_df_to_csv(chunk, get_dead_letter_path(dead_letter_folder, table_name, chunk_start, offset))
+                continue
+            controller.record(loaded, time.perf_counter() - batch_start_time, chunk.memory_usage(deep=True).sum())
+            logger.info(f"Rows {chunk_start}-{offset} succesfully ingested into table {table_name}")
+            rows += loaded
+
+    # Keep the learned state when no full batch was measured, e.g. everything was already committed
+    if controller.measured_batches == 0:
+        logger.info(f"No batch of {table_key} was measured, keeping its learned batch size")
+        return rows, failed_chunks
+    batch_state = controller.get_state()
+    update_batch_state(batch_state_path, table_key, batch_state)
+    logger.info(
+        f"Batch size for {table_key}: {batch_state['batch_size']} rows at "
+        f"{batch_state['rows_per_second']} rows/sec, {batch_state['bytes_per_row']} bytes per row"
+    )
+    return rows, failed_chunks
+
+def ingest_csv_to_db(
+    file_path: str,
+    schema: str,
+    table_name: str,
+    method: str = None,
+    buffer_size: int = DEFAULT_COPY_BUFFER_SIZE,
+    byte_range: tuple[int, int] = None,
+    engine=None,
+    checkpoint: str = None,
+    retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+    dead_letter_folder: str = None
+) -> IngestStats:
+
+    """
+    Ingest the data from a CSV file, or a Parquet file or dataset, into a PostgreSQL database
 
     Parameters:
     file_path (str): The path to the CSV file
     schema (str): The schema to ingest the data into
     table_name (str): The name of the table_name to ingest the data into
+    method (str): 'copy' to bulk load with COPY, 'insert' for DataFrame.to_sql,
+        defaults to 'copy' for PostgreSQL and 'insert' for other engines
+    buffer_size (int): The number of bytes read per COPY round trip
+    byte_range (tuple): Only load the rows in this (start, end) byte range, requires COPY
+    engine (sqlalchemy.engine.base.Engine): The database engine to use, defaults to get_engine()
+    checkpoint (str): The file signature committed chunks are recorded under, see ingest_checkpoint
+    retry_policy (RetryPolicy): The attempts and backoff for failed chunks
+    dead_letter_folder (str): The folder chunks that keep failing are saved to,
+        defaults to data/dead_letter/<schema>
 
+    Returns: IngestStats: The rows loaded and rows/sec so loaders can be compared
     """
 
     #Database connection
-    engine = get_engine()
-    chunksize = 1000
-    max_retries = 10
-
+    if engine is None:
+        engine = get_engine()
+    if method is None:
+        method = get_default_method(engine)
+    if byte_range is not None and method != 'copy':
+        raise ValueError("Loading a byte range of a file requires the 'copy' method")
+    if is_parquet_path(file_path) and (method != 'copy' or byte_range is not None):
+        raise ValueError("Parquet files are loaded whole with the 'copy' method")
+    if dead_letter_folder is None:
+        dead_letter_folder = os.path.join(get_project_path(), 'data/dead_letter', schema)
 
     ingest_start_time = datetime.datetime.now()
- 
-    for chunk_number, chunk in enumerate(pd.read_csv(file_path, chunksize=chunksize)):
-        for attempt in range(max_retries):  
-            try:
-                ingest_df_to_db(df=chunk,schema=schema, table_name=table_name, engine=engine)
-                logger.info(f"Chunk number {chunk_number + 1} succesfully ingested into table {table_name}")
-                break
-            except Exception as e:
-                logger.error(f"Error processing chunk {chunk_number}. Attempt {attempt + 1} of {max_retries}")
-                if not (attempt < max_retries):
-                    logger.error(f"Maximum number of attempts reached for chunk {chunk_number}")
-                
+
+    if method == 'copy' and is_parquet_path(file_path):
+        rows, failed_chunks = copy_parquet_to_db(
+            file_path, schema, table_name, engine, buffer_size, checkpoint, retry_policy, dead_letter_folder
+        )
+    elif method == 'copy':
+        # Load the whole file as a single range after the header
+        byte_ranges = [byte_range] if byte_range is not None else get_csv_byte_ranges(file_path, os.path.getsize(file_path))
+        rows = 0
+        failed_chunks = 0
+        for chunk_range in byte_ranges:
+            loaded = load_chunk_with_retries(
+                lambda: copy_with_text_fallback(
+                    lambda: copy_csv_range_to_db(file_path, schema, table_name, chunk_range, engine, buffer_size, checkpoint),
+                    schema, table_name
+                ),
+                f"bytes {chunk_range[0]}-{chunk_range[1]} of {file_path}",
+                retry_policy
+            )
+            if loaded is None:
+                failed_chunks += 1
+                write_csv_range(file_path, chunk_range, get_dead_letter_path(dead_letter_folder, table_name, *chunk_range))
+            else:
+                rows += loaded
+    elif method == 'insert':
+        rows, failed_chunks = insert_csv_to_db(
+            file_path, schema, table_name, engine, checkpoint, retry_policy, dead_letter_folder
+        )
+    else:
+        raise ValueError(f"Unknown ingestion method {method}, expected 'copy' or 'insert'")
 
     ingest_end_time = datetime.datetime.now()
+    seconds = (ingest_end_time - ingest_start_time).total_seconds()
+    stats = IngestStats(
+        table_name=table_name,
+        method=method,
+        rows=rows,
+        seconds=seconds,
+        rows_per_second=rows / seconds if seconds > 0 else None,
+        failed_chunks=failed_chunks
+    )
     logger.info(f"Ingestion start time: {ingest_start_time}")
     logger.info(f"Ingestion end time: {ingest_end_time}")
     logger.info(f"Total ingestion time: {ingest_end_time - ingest_start_time}")
+    source = f"bytes {byte_range[0]}-{byte_range[1]} of {file_path}" if byte_range else file_path
+    logger.info(f"Ingested {rows} rows from {source} into {schema}.{table_name} with {method} at {stats['rows_per_second'] or 0:.0f} rows/sec")
+    if failed_chunks:
+        logger.error(f"{failed_chunks} chunks of {source} could not be loaded into {schema}.{table_name}, see {dead_letter_folder}")
+    return stats
 
 
 
@@ -58,7 +388,7 @@ def ingest_df_to_db(df, schema: str, table_name: str, engine) -> None:
     df (pd.DataFrame): The DataFrame to ingest
     schema (str): The schema to ingest to in the database
     table_name (str): The name of the table to ingest the data into
-    engine (sqlalchemy.engine.base.Engine): The database engine to use
+    engine (sqlalchemy.engine.base.Engine): The database engine, or a connection to load within its transaction
     """
 
     try:
@@ -68,41 +398,277 @@ def ingest_df_to_db(df, schema: str, table_name: str, engine) -> None:
         logger.error(f"An error occured while ingesting data into {table_name}: {str(e)}")
         raise
 
-def ingest_all_csv_files_in_folder(folder_path: str, schema: str) -> None:
+def prepare_load_table(
+    file_path: str,
+    schema: str,
+    table_name: str,
+    swap: bool = False,
+    infer_types: Callable[[str], dict] = None
+) -> str:
+    """
+    Create the table a file is loaded into
+    With swap, an UNLOGGED shadow table is created and the live table is left untouched.
+    With infer_types, a function returning column name -> SQL type for a file, the columns are typed.
+    Returns: str: The name of the table to load into
+    """
+    load_table = get_shadow_table_name(table_name) if swap else table_name
+    column_types = infer_types(file_path) if infer_types is not None else None
+    delete_table(schema=schema, table_name=load_table)
+    create_table(
+        df=pd.DataFrame(columns=read_columns(file_path)),
+        schema=schema,
+        table_name=load_table,
+        unlogged=swap,
+        column_types=column_types
+    )
+    return load_table
+
+def complete_load(schema: str, table_name: str, swap: bool = False, unique_keys: list = None) -> None:
+    """Swap a loaded shadow table in for the live table, nothing to do for direct loads"""
+    if swap:
+        index_renames = finalize_shadow_table(schema, table_name, unique_keys)
+        swap_shadow_table(schema, table_name, index_renames)
+
+def prepare_resumable_load(
+    file_path: str,
+    schema: str,
+    table_name: str,
+    signature: str,
+    swap: bool = False,
+    infer_types: Callable[[str], dict] = None,
+    resume: bool = True
+) -> tuple[str, dict[int, int]]:
+    """
+    Resume an interrupted load of the same file, or recreate the table and start over
+    Returns: tuple: The name of the table to load into and its committed chunks
+    """
+    load_table = get_shadow_table_name(table_name) if swap else table_name
+    committed = get_committed_chunks(schema, load_table, signature) if resume else {}
+    if committed and table_exists(schema, load_table):
+        # An unlogged shadow table is emptied by a crash while its checkpoints survive
+        if get_row_count(schema, load_table) == sum(committed.values()):
+            logger.info(f"Resuming the load of {schema}.{load_table}, {len(committed)} chunks are already committed")
+            return load_table, committed
+        logger.warning(f"{schema}.{load_table} does not hold the rows of its checkpoints, reloading it")
+
+    clear_checkpoints(schema, load_table)
+    prepare_load_table(file_path, schema, table_name, swap, infer_types)
+    return load_table, {}
+
+def plan_ingest_units(
+    file_path: str,
+    table_name: str,
+    signature: str,
+    chunk_size: int = None,
+    committed: dict[int, int] = None
+) -> list[IngestUnit]:
+    """
+    Split a file into units that are loaded and checkpointed on their own
+    With chunk_size, the file is split into byte ranges for COPY and committed ranges are skipped.
+    Without it the file is a single unit, the insert and Parquet loaders checkpoint their own chunks.
+    """
+    if chunk_size is None or is_parquet_path(file_path):
+        return [IngestUnit(file_path=file_path, table_name=table_name, byte_range=None, signature=signature)]
+    committed = committed or {}
+    return [
+        IngestUnit(file_path=file_path, table_name=table_name, byte_range=byte_range, signature=signature)
+        for byte_range in get_csv_byte_ranges(file_path, chunk_size)
+        if byte_range[0] not in committed
+    ]
+
+def ingest_files(
+    files: list[tuple[str, str]],
+    schema: str,
+    max_workers: int = 1,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    method: str = None,
+    swap: bool = False,
+    unique_keys: dict = None,
+    infer_types: Callable[[str], dict] = None,
+    resume: bool = True,
+    dead_letter_folder: str = None
+) -> list[IngestStats]:
+    """
+    Fully load files into their tables in checkpointed chunks, concurrently on separate connections
+    Every table is recreated before any of its data is loaded. With COPY, files are split into
+    byte-range chunks of shard_size so a single large CSV file is loaded in parallel too.
+    Parquet files and datasets are loaded as one unit that checkpoints each of its files.
+    Every chunk is recorded in the schema's checkpoint table in the transaction that loads it,
+    so an interrupted load of the same file resumes after its last committed chunks.
+    Without swap, a table with failed chunks is left partially loaded until the load is resumed.
+
+    Parameters:
+    files (list): (file path, table name) pairs
+    schema (str): The schema to ingest to in the database
+    max_workers (int): The maximum number of concurrent loads
+    shard_size (int): The target size of each chunk in bytes
+    method (str): 'copy' or 'insert', see ingest_csv_to_db
+    swap (bool): Load into shadow tables and swap each one in once all of its data is loaded
+    unique_keys (dict): Table name -> column lists to build unique indexes on before a swap
+    infer_types (Callable): Returns column name -> SQL type for a file, see prepare_load_table
+    resume (bool): Resume interrupted loads, False to always reload from scratch
+    dead_letter_folder (str): The folder chunks that keep failing are saved to
+    Returns: list: The IngestStats of every loaded chunk
+    """
+
+    engine = get_engine()
+    if method is None:
+        method = get_default_method(engine)
+    chunk_size = shard_size if method == 'copy' else None
+    ensure_checkpoint_table(schema)
+
+    #Prepare the database before any load starts
+    units = []
+    for file_path, table_name in files:
+        signature = get_file_signature(file_path, method, shard_size)
+        load_table, committed = prepare_resumable_load(file_path, schema, table_name, signature, swap, infer_types, resume)
+        units.extend(plan_ingest_units(file_path, load_table, signature, chunk_size, committed))
+    logger.info(f"Loading {len(files)} files as {len(units)} units with {max_workers} workers")
+
+    ingest_start_time = datetime.datetime.now()
+    results = []
+    failed_tables = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                ingest_csv_to_db,
+                file_path=unit['file_path'],
+                schema=schema,
+                table_name=unit['table_name'],
+                method=method,
+                byte_range=unit['byte_range'],
+                engine=engine,
+                checkpoint=unit['signature'],
+                dead_letter_folder=dead_letter_folder
+            ): unit
+            for unit in units
+        }
+        for future in as_completed(futures):
+            unit = futures[future]
+            try:
+                result = future.result()
+                results.append(result)
+                if result['failed_chunks']:
+                    failed_tables.add(unit['table_name'])
+            except Exception as e:
+                logger.error(f"Loading {unit['file_path']} {unit['byte_range'] or ''} into {schema}.{unit['table_name']} failed: {e}")
+                failed_tables.add(unit['table_name'])
+
+    unique_keys = unique_keys or {}
+    for _, table_name in files:
+        load_table = get_shadow_table_name(table_name) if swap else table_name
+        if load_table not in failed_tables:
+            complete_load(schema, table_name, swap, unique_keys.get(table_name))
+            if swap:
+                # The shadow is now the live table, the next load starts a new shadow
+                clear_checkpoints(schema, load_table)
+                clear_checkpoints(schema, table_name)
+
+    seconds = (datetime.datetime.now() - ingest_start_time).total_seconds()
+    rows = sum(result['rows'] for result in results)
+    logger.info(f"Ingested {rows} rows into {schema} in {seconds:.1f} seconds, {rows / seconds if seconds > 0 else 0:.0f} rows/sec")
+    if failed_tables:
+        raise RuntimeError(
+            f"Failed to load tables {sorted(failed_tables)} into {schema}, "
+            f"run the load again to resume them after fixing the failed chunks"
+        )
+    return results
+
+def ingest_all_csv_files_in_folder(
+    folder_path: str,
+    schema: str,
+    key_columns: dict = None,
+    max_workers: int = 1,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    swap: bool = False,
+    unique_keys: dict = None,
+    infer_types: Callable[[str], dict] = None,
+    resume: bool = True
+) -> None:
     """
     Ingest the Zillow CSV files into the PostgreSQL database
+    Parquet files and partitioned Parquet dataset folders are loaded as well, always fully
     Parameters:
     folder_path (str): The path to the folder containing the Zillow CSV files
     schema (str): The schema to ingest to in the database
+    key_columns (dict): Table name -> columns identifying a row within a month. Tables listed here
+        are loaded incrementally, appending only new or revised months, once they exist
+    max_workers (int): Load up to this many files or chunks of large files concurrently
+    shard_size (int): The target size in bytes of the chunks files are split into
+    swap (bool): Load into UNLOGGED shadow tables and swap them in when complete instead of
+        dropping the live tables first, so readers and dependent views never see partial data
+    unique_keys (dict): Table name -> column lists to build unique indexes on before a swap
+    infer_types (Callable): Returns column name -> SQL type for a file, columns are VARCHAR without it
+    resume (bool): Resume interrupted loads from their checkpoints instead of reloading the tables
     """
 
+    key_columns = key_columns or {}
+    full_loads = []
     for file in os.listdir(folder_path):
-        if file.endswith(".csv"):
+        if is_data_file(file):
             file_path = f"{folder_path}/{file}"
             table_name = file.split('.')[0].lower()
-                
-            #Prepare the database
-            delete_table(schema=schema, table_name=table_name)
-            create_table(df=pd.read_csv(file_path, nrows=1), schema=schema, table_name=table_name)
-            ingest_csv_to_db(file_path=file_path, schema=schema, table_name=table_name)
 
+            if table_name in key_columns and not is_parquet_path(file_path):
+                if ingest_csv_incremental(file_path, schema, table_name, key_columns[table_name]):
+                    continue
+                logger.info(f"Falling back to a full load of {schema}.{table_name}")
+            full_loads.append((file_path, table_name))
+
+    ingest_files(
+        full_loads, schema, max_workers=max_workers, shard_size=shard_size,
+        swap=swap, unique_keys=unique_keys, infer_types=infer_types, resume=resume
+    )
 
-def ingest_census_data(folder_path: str=None) -> None:
+
+def ingest_census_data(
+    folder_path: str=None,
+    max_workers: int = 1,
+    swap: bool = False,
+    typed: bool = False,
+    config: dict = None
+) -> None:
     """
     Ingest the processed census data into the database
+    With max_workers above 1 the tables are loaded concurrently
+    With swap, tables are loaded into shadow tables and swapped in when complete
+    With typed, configured variables are loaded into NUMERIC columns instead of VARCHAR
     """
 
     
+    project_path = get_project_path()
     if folder_path is None:
         #Get the file path
-        project_path = get_project_path()
         folder_path = f"{project_path}/data/processed/census"
+
+    infer_types = None
+    if typed:
+        if config is None:
+            config = load_census_config(os.path.join(project_path, 'config/census_variables.yml'))
+        infer_types = partial(get_census_column_types, config=config)
     
-    ingest_all_csv_files_in_folder(folder_path=folder_path, schema="raw_census")
+    ingest_all_csv_files_in_folder(
+        folder_path=folder_path,
+        schema="raw_census",
+        max_workers=max_workers,
+        swap=swap,
+        infer_types=infer_types
+    )
 
-def ingest_realtor_data(folder_path: str=None) -> None:
+def ingest_realtor_data(
+    folder_path: str=None,
+    incremental: bool = False,
+    max_workers: int = 1,
+    swap: bool = False,
+    typed: bool = False,
+    sample_rows: int = DEFAULT_SAMPLE_ROWS
+) -> None:
     """
     Ingest the processed realtor data into the database
+    With incremental, only new or revised months are upserted into existing tables
+    With max_workers above 1 the files, and shards of large files like realtor_zip, are loaded concurrently
+    With swap, full loads go into shadow tables that are swapped in with their upsert keys already indexed
+    With typed, column types are inferred from sample_rows rows of each file, identifier columns stay text
     """
 
     if folder_path is None:
@@ -110,7 +676,20 @@ def ingest_realtor_data(folder_path: str=None) -> None:
         project_path = get_project_path()
         folder_path = f"{project_path}/data/raw/realtor"
     
-    ingest_all_csv_files_in_folder(folder_path=folder_path, schema="raw_realtor")
+    infer_types = None
+    if typed:
+        text_columns = [col for columns in REALTOR_KEY_COLUMNS.values() for col in columns]
+        infer_types = partial(infer_column_types, sample_rows=sample_rows, text_columns=text_columns)
+
+    ingest_all_csv_files_in_folder(
+        folder_path=folder_path,
+        schema="raw_realtor",
+        key_columns=REALTOR_KEY_COLUMNS if incremental else None,
+        max_workers=max_workers,
+        swap=swap,
+        unique_keys={table: [columns + [MONTH_COLUMN]] for table, columns in REALTOR_KEY_COLUMNS.items()},
+        infer_types=infer_types
+    )
 
 
 
@@ -0,0 +1,189 @@
+import datetime
+import pandas as pd
+from sqlalchemy import text
+from utils.db_utils import get_engine, quote_identifier, table_exists
+from utils.logger_utils import setup_logging
+
+logger = setup_logging()
+
+MONTH_COLUMN = 'month_date_yyyymm'
+
+#Columns that identify a row of each Realtor.com history table within a month
+REALTOR_KEY_COLUMNS = {
+    'realtor_country': ['country'],
+    'realtor_state': ['state_id'],
+    'realtor_metro': ['cbsa_code'],
+    'realtor_county': ['county_fips'],
+    'realtor_zip': ['postal_code'],
+}
+
+
+def get_file_month_counts(file_path: str, month_column: str = MONTH_COLUMN) -> pd.Series:
+    """Count the rows of each month in a CSV file, reading only the month column"""
+    months = pd.read_csv(file_path, usecols=[month_column], dtype=str)[month_column]
+    return months.value_counts()
+
+
+def get_loaded_month_counts(schema: str, table_name: str, month_column: str = MONTH_COLUMN) -> pd.Series:
+    """Count the rows of each month already loaded into a table"""
+    month = quote_identifier(month_column)
+    sql_statement = (
+        f'SELECT {month}::text AS month, COUNT(*) AS row_count '
+        f'FROM {quote_identifier(schema)}.{quote_identifier(table_name)} GROUP BY {month}'
+    )
+    with get_engine().connect() as connection:
+        rows = connection.execute(text(sql_statement)).fetchall()
+    return pd.Series({row.month: row.row_count for row in rows}, dtype='int64')
+
+
+def get_months_to_load(file_counts: pd.Series, loaded_counts: pd.Series, revision_window: int = 2) -> list:
+    """
+    Get the months that are new or revised
+    A month is revised when its row count changed. The newest revision_window months are
+    always reloaded since Realtor.com revises recent months without changing their row count.
+    """
+    new_months = set(file_counts.index) - set(loaded_counts.index)
+    changed_months = {
+        month for month in file_counts.index
+        if month in loaded_counts.index and file_counts[month] != loaded_counts[month]
+    }
+    recent_months = set(sorted(file_counts.index)[-revision_window:]) if revision_window > 0 else set()
+
+    logger.info(f"New months: {sorted(new_months)}, months with changed row counts: {sorted(changed_months)}")
+    return sorted(new_months | changed_months | recent_months)
+
+
+def get_unique_key_name(table_name: str, key_columns: list) -> str:
+    """Get the name of the unique index on key_columns of a table"""
+    return f"{table_name}_{'_'.join(key_columns)}_key"
+
+
+def ensure_unique_key(schema: str, table_name: str, key_columns: list) -> None:
+    """Create the unique index the upsert is keyed on if it does not exist"""
+    index_name = get_unique_key_name(table_name, key_columns)
+    column_list = ", ".join(quote_identifier(col) for col in key_columns)
+    sql_statement = (
+        f'CREATE UNIQUE INDEX IF NOT EXISTS {quote_identifier(index_name)} '
+        f'ON {quote_identifier(schema)}.{quote_identifier(table_name)} ({column_list})'
+    )
+    with get_engine().connect() as connection:
+        connection.execute(text(sql_statement))
+        connection.commit()
+        logger.info(f"SQL Command: {sql_statement}")
+
+
+def stage_months(file_path: str, schema: str, table_name: str, staging_table: str, months: list, chunksize: int = 100000) -> int:
+    """
+    Load the rows of the given months into an unlogged staging table shaped like the target table
+    Returns: int: The number of rows staged
+    """
+    engine = get_engine()
+    target = f"{quote_identifier(schema)}.{quote_identifier(table_name)}"
+    staging = f"{quote_identifier(schema)}.{quote_identifier(staging_table)}"
+
+    with engine.connect() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS {staging}"))
+        connection.execute(text(f"CREATE UNLOGGED TABLE {staging} (LIKE {target})"))
+        connection.commit()
+
+    months = set(months)
+    staged_rows = 0
+    # Keep values as text, matching what the COPY loader stores for a full load
+    for chunk in pd.read_csv(file_path, chunksize=chunksize, dtype=str):
+        delta = chunk[chunk[MONTH_COLUMN].isin(months)]
+        if not delta.empty:
+            delta.to_sql(staging_table, engine, if_exists='append', schema=schema, index=False)
+            staged_rows += len(delta)
+    return staged_rows
+
+
+def upsert_staged_months(schema: str, table_name: str, staging_table: str, key_columns: list, columns: list, months: list) -> None:
+    """
+    Upsert the staged rows into the target table and remove rows of the reloaded months
+    that are no longer in the file, all in one transaction
+    """
+    target = f"{quote_identifier(schema)}.{quote_identifier(table_name)}"
+    staging = f"{quote_identifier(schema)}.{quote_identifier(staging_table)}"
+    column_list = ", ".join(quote_identifier(col) for col in columns)
+    key_list = ", ".join(quote_identifier(col) for col in key_columns)
+    updates = ", ".join(
+        f"{quote_identifier(col)} = EXCLUDED.{quote_identifier(col)}"
+        for col in columns if col not in key_columns
+    )
+    # Plain equality lets the anti-join use the unique index. Rows with a NULL key never
+    # conflict on upsert, so deleting and reinserting them keeps them from being duplicated.
+    key_match = " AND ".join(
+        f"s.{quote_identifier(col)} = t.{quote_identifier(col)}" for col in key_columns
+    )
+
+    upsert_statement = (
+        f"INSERT INTO {target} ({column_list}) SELECT {column_list} FROM {staging} "
+        f"ON CONFLICT ({key_list}) DO UPDATE SET {updates}"
+    )
+    delete_statement = (
+        f"DELETE FROM {target} t WHERE t.{quote_identifier(MONTH_COLUMN)}::text = ANY(:months) "
+        f"AND NOT EXISTS (SELECT 1 FROM {staging} s WHERE {key_match})"
+    )
+
+    with get_engine().begin() as connection:
+        connection.execute(text(delete_statement), {'months': [str(month) for month in months]})
+        result = connection.execute(text(upsert_statement))
+        logger.info(f"Upserted {result.rowcount} rows into {schema}.{table_name}")
+        connection.execute(text(f"DROP TABLE {staging}"))
+
+
+def ingest_csv_incremental(
+    file_path: str,
+    schema: str,
+    table_name: str,
+    key_columns: list,
+    revision_window: int = 2
+) -> bool:
+    """
+    Append only the new or revised months of a history file to an existing table
+    Rows are upserted on (key_columns, month_date_yyyymm).
+
+    Parameters:
+    file_path (str): The path to the CSV file
+    schema (str): The schema of the table
+    table_name (str): The name of the table
+    key_columns (list): The columns identifying a row within a month, e.g. ['postal_code']
+    revision_window (int): The number of most recent months that are always reloaded
+    Returns: bool: False if the table has to be fully loaded instead, e.g. it does not exist yet
+    """
+
+    if not table_exists(schema, table_name):
+        logger.info(f"Table {schema}.{table_name} does not exist, a full load is needed")
+        return False
+
+    columns = pd.read_csv(file_path, nrows=0).columns.tolist()
+    upsert_key = key_columns + [MONTH_COLUMN]
+    missing_columns = [col for col in upsert_key if col not in columns]
+    if missing_columns:
+        logger.warning(f"{file_path} has no {missing_columns} columns to upsert on, a full load is needed")
+        return False
+
+    ingest_start_time = datetime.datetime.now()
+    try:
+        ensure_unique_key(schema, table_name, upsert_key)
+    except Exception as e:
+        logger.warning(f"Could not create a unique key on {schema}.{table_name}, a full load is needed: {e}")
+        return False
+
+    months = get_months_to_load(
+        get_file_month_counts(file_path),
+        get_loaded_month_counts(schema, table_name),
+        revision_window
+    )
+    if not months:
+        logger.info(f"No new or revised months for {schema}.{table_name}")
+        return True
+
+    logger.info(f"Loading months {months} into {schema}.{table_name}")
+    staging_table = f"{table_name}__delta"
+    staged_rows = stage_months(file_path, schema, table_name, staging_table, months)
+    upsert_staged_months(schema, table_name, staging_table, key_columns + [MONTH_COLUMN], columns, months)
+
+    ingest_end_time = datetime.datetime.now()
+    logger.info(f"Incremental ingestion of {staged_rows} rows took {ingest_end_time - ingest_start_time}")
+    return True
@@ -0,0 +1,103 @@
+import io
+import os
+import gzip
+import datetime
+import pandas as pd
+from utils.db_utils import delete_table, create_table, copy_from_stream
+from utils.logger_utils import setup_logging
+from utils.api_utils import get_response
+from utils.file_utils import create_output_dir, get_part_file_path, read_csv_header
+
+logger = setup_logging()
+
+#Streaming buffer size for response bodies and COPY round trips
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+
+class ResponseStream(io.RawIOBase):
+    """
+    Read-only file-like view of a streamed HTTP response body.
+    Every byte read is optionally written to an archive file as well.
+
+    Parameters:
+    response (requests.Response): A response requested with stream=True
+    chunk_size (int): The number of bytes pulled from the response at a time
+    archive (file): Optional binary file the body is teed into
+    """
+
+    def __init__(self, response, chunk_size: int = DEFAULT_BUFFER_SIZE, archive=None) -> None:
+        self.chunks = response.iter_content(chunk_size=chunk_size)
+        self.archive = archive
+        self.pending = b''
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.pending:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            if self.archive is not None:
+                self.archive.write(chunk)
+            self.pending = chunk
+
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        self.bytes_read += size
+        return size
+
+
+def stream_csv_to_db(
+    url: str,
+    schema: str,
+    table_name: str,
+    archive_path: str = None,
+    buffer_size: int = DEFAULT_BUFFER_SIZE
+) -> int:
+    """
+    Pipe a CSV download straight into a PostgreSQL table without landing it on disk
+    The table is recreated from the header line, then the rest of the body is bulk loaded with COPY.
+
+    Parameters:
+    url (str): The URL of the CSV file
+    schema (str): The schema to ingest the data into
+    table_name (str): The name of the table to ingest the data into
+    archive_path (str): Optional path of a gzip compressed copy of the download
+    buffer_size (int): The streaming buffer size in bytes
+    Returns: int: The number of rows loaded
+    """
+
+    ingest_start_time = datetime.datetime.now()
+    response = get_response(url=url, stream=True)
+    if response is None:
+        raise IOError(f"No response received from {url}")
+
+    archive = None
+    try:
+        if archive_path is not None:
+            create_output_dir(os.path.dirname(archive_path))
+            archive = gzip.open(get_part_file_path(archive_path), 'wb')
+
+        stream = io.BufferedReader(ResponseStream(response, buffer_size, archive), buffer_size=buffer_size)
+        columns = read_csv_header(stream)
+
+        #Prepare the database
+        delete_table(schema=schema, table_name=table_name)
+        create_table(df=pd.DataFrame(columns=columns), schema=schema, table_name=table_name)
+        row_count = copy_from_stream(stream, schema, table_name, columns, buffer_size=buffer_size)
+    finally:
+        response.close()
+        if archive is not None:
+            archive.close()
+
+    # Only keep archives of loads that completed
+    if archive is not None:
+        os.replace(get_part_file_path(archive_path), archive_path)
+
+    ingest_end_time = datetime.datetime.now()
+    logger.info(f"Streamed {row_count} rows from {url} into {schema}.{table_name}")
+    logger.info(f"Total ingestion time: {ingest_end_time - ingest_start_time}")
+    return row_count
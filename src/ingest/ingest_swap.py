@@ -0,0 +1,193 @@
+from sqlalchemy import text
+from utils.db_utils import get_engine, quote_identifier
+from utils.logger_utils import setup_logging
+from ingest.ingest_incremental import get_unique_key_name
+
+logger = setup_logging()
+
+#Views and materialized views built on a table, directly or through other views, deepest last
+DEPENDENT_VIEWS_QUERY = """
+WITH RECURSIVE dependents AS (
+    SELECT rewrite.ev_class AS oid, 1 AS depth
+    FROM pg_depend depend
+    JOIN pg_rewrite rewrite ON rewrite.oid = depend.objid
+    WHERE depend.classid = 'pg_rewrite'::regclass
+      AND depend.refobjid = to_regclass(:table_name)
+      AND rewrite.ev_class <> depend.refobjid
+    UNION ALL
+    SELECT rewrite.ev_class, dependents.depth + 1
+    FROM dependents
+    JOIN pg_depend depend ON depend.refobjid = dependents.oid
+    JOIN pg_rewrite rewrite ON rewrite.oid = depend.objid
+    WHERE depend.classid = 'pg_rewrite'::regclass
+      AND rewrite.ev_class <> dependents.oid
+)
+SELECT class.oid, namespace.nspname AS schema, class.relname AS name, class.relkind AS kind,
+       pg_get_viewdef(class.oid) AS definition, MAX(dependents.depth) AS depth
+FROM dependents
+JOIN pg_class class ON class.oid = dependents.oid
+JOIN pg_namespace namespace ON namespace.oid = class.relnamespace
+GROUP BY namespace.nspname, class.relname, class.relkind, class.oid
+ORDER BY depth
+"""
+
+#Statements restoring the owner, privileges, comments and (with :include_indexes) indexes of a relation
+RESTORE_STATEMENTS_QUERY = """
+SELECT 1 AS step, format('ALTER %s %s OWNER TO %I', :kind, class.oid::regclass, pg_get_userbyid(class.relowner)) AS statement
+FROM pg_class class
+WHERE class.oid = :oid AND class.relowner <> (SELECT oid FROM pg_roles WHERE rolname = current_user)
+UNION ALL
+SELECT 2, format('GRANT %s ON %s TO %s%s', acl.privilege_type, class.oid::regclass,
+       CASE WHEN acl.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(acl.grantee)) END,
+       CASE WHEN acl.is_grantable THEN ' WITH GRANT OPTION' ELSE '' END)
+FROM pg_class class, aclexplode(class.relacl) acl
+WHERE class.oid = :oid
+UNION ALL
+SELECT 3, format('COMMENT ON %s %s IS %L', :kind, class.oid::regclass, description.description)
+FROM pg_class class
+JOIN pg_description description ON description.objoid = class.oid
+     AND description.classoid = 'pg_class'::regclass AND description.objsubid = 0
+WHERE class.oid = :oid
+UNION ALL
+SELECT 4, format('COMMENT ON COLUMN %s.%I IS %L', class.oid::regclass, attribute.attname, description.description)
+FROM pg_class class
+JOIN pg_description description ON description.objoid = class.oid
+     AND description.classoid = 'pg_class'::regclass AND description.objsubid > 0
+JOIN pg_attribute attribute ON attribute.attrelid = class.oid AND attribute.attnum = description.objsubid
+WHERE class.oid = :oid
+UNION ALL
+SELECT 5, pg_get_indexdef(index.indexrelid)
+FROM pg_index index
+WHERE index.indrelid = :oid AND :include_indexes
+ORDER BY step
+"""
+
+#Keywords of the relation kinds in ALTER and COMMENT statements
+RELATION_KINDS = {'r': 'TABLE', 'p': 'TABLE', 'v': 'VIEW', 'm': 'MATERIALIZED VIEW'}
+
+
+def get_shadow_table_name(table_name: str) -> str:
+    """Get the name of the table a swap load writes to before it replaces table_name"""
+    return f"{table_name}__shadow"
+
+
+def get_live_table_name(table_name: str) -> str:
+    """Get the name of the table a shadow table replaces, any other name is returned unchanged"""
+    return table_name.removesuffix(get_shadow_table_name(''))
+
+
+def get_dependent_views(connection, schema: str, table_name: str) -> list:
+    """Get the views that depend on a table, in the order they have to be recreated"""
+    qualified_name = f"{quote_identifier(schema)}.{quote_identifier(table_name)}"
+    return connection.execute(text(DEPENDENT_VIEWS_QUERY), {'table_name': qualified_name}).fetchall()
+
+
+def get_restore_statements(connection, oid: int, kind: str, include_indexes: bool = False) -> list[str]:
+    """
+    Get the statements that give a recreated relation the owner, GRANTs and comments of the one it replaces
+    Parameters:
+    connection: An open connection
+    oid (int): The oid of the relation to capture
+    kind (str): The pg_class relkind of the relation, e.g. 'v' for a view
+    include_indexes (bool): Also capture the CREATE INDEX statements of its indexes, e.g. of a materialized view
+    """
+    rows = connection.execute(
+        text(RESTORE_STATEMENTS_QUERY),
+        {'oid': oid, 'kind': RELATION_KINDS[kind], 'include_indexes': include_indexes}
+    ).fetchall()
+    return [row.statement for row in rows]
+
+
+def execute_generated_sql(connection, statement: str) -> None:
+    """
+    Run SQL read back from the catalog, e.g. a view definition or a COMMENT, as is
+    text() would take a :word in a literal or comment for a bind parameter, and drivers with
+    the format paramstyles, like psycopg2, would read a % as a placeholder, so it is escaped.
+    """
+    if connection.dialect.paramstyle in ('format', 'pyformat'):
+        statement = statement.replace('%', '%%')
+    connection.exec_driver_sql(statement)
+
+
+def recreate_view(connection, view, restore_statements: list = None) -> None:
+    """Recreate a view captured by get_dependent_views, then run its restore statements"""
+    kind = RELATION_KINDS[view.kind]
+    definition = view.definition.rstrip().rstrip(';')
+    execute_generated_sql(
+        connection,
+        f"CREATE {kind} {quote_identifier(view.schema)}.{quote_identifier(view.name)} AS {definition}"
+    )
+    for statement in restore_statements or []:
+        execute_generated_sql(connection, statement)
+    logger.info(f"Recreated {kind.lower()} {view.schema}.{view.name} with {len(restore_statements or [])} restored grants, comments and indexes")
+
+
+def finalize_shadow_table(schema: str, table_name: str, unique_keys: list = None) -> list:
+    """
+    Make a loaded shadow table ready to be swapped in: build its indexes, ANALYZE it and set it LOGGED
+    Indexes are built once the data is in, which is faster than maintaining them during the load.
+    Parameters:
+    schema (str): The schema of the table
+    table_name (str): The name of the table the shadow replaces
+    unique_keys (list): Column lists to build unique indexes on
+    Returns: list: (shadow index name, final index name) pairs to rename when swapping
+    """
+    shadow_table = get_shadow_table_name(table_name)
+    shadow = f"{quote_identifier(schema)}.{quote_identifier(shadow_table)}"
+    engine = get_engine()
+    index_renames = []
+
+    for key_columns in unique_keys or []:
+        index_name = get_unique_key_name(shadow_table, key_columns)
+        column_list = ", ".join(quote_identifier(col) for col in key_columns)
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(f"CREATE UNIQUE INDEX {quote_identifier(index_name)} ON {shadow} ({column_list})"))
+            index_renames.append((index_name, get_unique_key_name(table_name, key_columns)))
+        except Exception as e:
+            logger.warning(f"Could not create a unique index on {key_columns} of {schema}.{shadow_table}: {e}")
+
+    with engine.connect() as connection:
+        connection.execute(text(f"ANALYZE {shadow}"))
+        connection.execute(text(f"ALTER TABLE {shadow} SET LOGGED"))
+        connection.commit()
+    logger.info(f"Analyzed {schema}.{shadow_table} and set it LOGGED")
+    return index_renames
+
+
+def swap_shadow_table(schema: str, table_name: str, index_renames: list = None) -> None:
+    """
+    Replace a table with its shadow in one transaction
+    Views depending on the old table are dropped with it and recreated on the new one,
+    so readers see either the old or the new data, never a missing or partial table.
+    The owner, GRANTs and comments of the table and its views, and the indexes of materialized views,
+    are captured before the drop and restored. Anything else attached to them, e.g. triggers, row level
+    security policies or other tables' foreign keys, is dropped with the old table and not restored.
+    """
+    shadow_table = get_shadow_table_name(table_name)
+    target = f"{quote_identifier(schema)}.{quote_identifier(table_name)}"
+
+    with get_engine().begin() as connection:
+        table_oid = connection.execute(text("SELECT to_regclass(:table_name)::oid"), {'table_name': target}).scalar()
+        table_statements = get_restore_statements(connection, table_oid, 'r') if table_oid is not None else []
+        views = get_dependent_views(connection, schema, table_name)
+        view_statements = [
+            get_restore_statements(connection, view.oid, view.kind, include_indexes=view.kind == 'm')
+            for view in views
+        ]
+        connection.execute(text(f"DROP TABLE IF EXISTS {target} CASCADE"))
+        connection.execute(text(
+            f"ALTER TABLE {quote_identifier(schema)}.{quote_identifier(shadow_table)} "
+            f"RENAME TO {quote_identifier(table_name)}"
+        ))
+        for shadow_index, index_name in index_renames or []:
+            connection.execute(text(
+                f"ALTER INDEX {quote_identifier(schema)}.{quote_identifier(shadow_index)} "
+                f"RENAME TO {quote_identifier(index_name)}"
+            ))
+        for statement in table_statements:
+            execute_generated_sql(connection, statement)
+        for view, statements in zip(views, view_statements):
+            recreate_view(connection, view, statements)
+
+    logger.info(f"Swapped {schema}.{shadow_table} in as {schema}.{table_name}, recreated {len(views)} dependent views")
@@ -1,11 +1,14 @@
 import os
 import logging
-from typing import Dict, Any
+from contextlib import nullcontext
+from typing import Callable, Dict, Any
 import download.download_census as download_census
 import transform.transform_census as transform_census
 import ingest.ingest_csv_to_db as ingest_csv_to_db
-from utils.file_utils import get_project_path
-from utils.census_utils import load_census_config 
+from utils.file_utils import get_project_path, prepare_and_clean_folder
+from utils.db_utils import configure_engine, log_pool_stats
+from utils.memory_utils import track_peak_memory
+from utils.census_utils import load_census_config, get_variable_catalog, CATALOG_CACHE_FOLDER
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,7 +25,21 @@ def setup_pipeline_config() -> Dict[str, Any]:
         'config_path': config_path,
         'raw_folder': os.path.join(project_path, 'data/raw/census'),
         'processed_folder': os.path.join(project_path, 'data/processed/census'),
-        'census_config': load_census_config(config_path)
+        'census_config': load_census_config(config_path),
+        # Number of processes transforming table and year groups concurrently
+        'transform_workers': 4,
+        # Transform each table, geo level and year in memory as its chunks are downloaded
+        'fused_transform': False,
+        # Also write the raw chunk files in fused mode, e.g. for debugging or resuming a download
+        'keep_raw_chunks': True,
+        # Log the peak memory of each stage, tracing allocations slows the pipeline down
+        'track_memory': False,
+        # Number of processed tables loaded into the database concurrently
+        'ingest_workers': 4,
+        # Load into shadow tables and swap them in, so readers never see a missing or partial table
+        'swap_load': True,
+        # Create NUMERIC columns for the configured variables instead of storing everything as text
+        'typed_columns': True
     }
 
 def run_download(project_path: str, config_path: str, census_config: Dict[str, Any], **kwargs) -> None:
@@ -38,28 +55,88 @@ def run_download(project_path: str, config_path: str, census_config: Dict[str, A
         logger.error(f"Download failed: {str(e)}")
         raise
 
-def run_transform(project_path: str, raw_folder: str, config_path: str, census_config: Dict[str, Any], **kwargs) -> None:
+def run_fused_download_transform(
+    project_path: str,
+    config_path: str,
+    processed_folder: str,
+    census_config: Dict[str, Any],
+    keep_raw_chunks: bool = True,
+    **kwargs
+) -> None:
+    """Wrapper function for the download process with the transform applied to each downloaded group"""
+    try:
+        prepare_and_clean_folder(processed_folder)
+        catalog = get_variable_catalog(
+            census_config,
+            cache_folder=os.path.join(project_path, CATALOG_CACHE_FOLDER)
+        )
+        collector = transform_census.CensusChunkCollector(catalog, processed_folder)
+        download_census.main(
+            project_path=project_path,
+            config_path=config_path,
+            config=census_config,
+            save_chunks=keep_raw_chunks,
+            on_download=collector.add
+        )
+        collector.log_incomplete_groups()
+        collector.log_failed_groups()
+    except Exception as e:
+        logger.error(f"Fused download and transform failed: {str(e)}")
+        raise
+
+def run_transform(
+    project_path: str,
+    raw_folder: str,
+    config_path: str,
+    census_config: Dict[str, Any],
+    transform_workers: int = 1,
+    **kwargs
+) -> None:
     """Wrapper function for transform process"""
     try:
         transform_census.main(
             project_path=project_path,
             census_raw_folder=raw_folder,
             config_path=config_path,
-            config=census_config
+            config=census_config,
+            max_workers=transform_workers
         )
     except Exception as e:
         logger.error(f"Transform failed: {str(e)}")
         raise
 
-def run_ingest(project_path: str, processed_folder: str, **kwargs) -> None:
+def run_ingest(
+    project_path: str,
+    processed_folder: str,
+    census_config: Dict[str, Any] = None,
+    ingest_workers: int = 1,
+    swap_load: bool = False,
+    typed_columns: bool = False,
+    **kwargs
+) -> None:
     """Wrapper function for ingestion process"""
     try:
         # Call ingest_census_data directly instead of main
-        ingest_csv_to_db.ingest_census_data()
+        # Keep a pooled connection open for every worker
+        configure_engine(pool_size=max(ingest_workers, 1))
+        ingest_csv_to_db.ingest_census_data(
+            processed_folder,
+            max_workers=ingest_workers,
+            swap=swap_load,
+            typed=typed_columns,
+            config=census_config
+        )
+        log_pool_stats()
     except Exception as e:
         logger.error(f"Ingestion failed: {str(e)}")
         raise
 
+def run_stage(stage_name: str, stage: Callable[..., None], config: Dict[str, Any]) -> None:
+    """Run a pipeline stage, logging its peak memory when track_memory is set"""
+    logger.info(f"Starting {stage_name} process")
+    with track_peak_memory(stage_name) if config.get('track_memory') else nullcontext():
+        stage(**config)
+
 def run_pipeline(config: Dict[str, Any] = None) -> None:
     """
     Main pipeline function that orchestrates the entire process
@@ -70,17 +147,18 @@ def run_pipeline(config: Dict[str, Any] = None) -> None:
     logger.info("Starting census data pipeline")
     
     try:
-        # Run download
-        logger.info("Starting download process")
-        run_download(**config)
-        
-        # Run transform
-        logger.info("Starting transform process")
-        run_transform(**config)
+        if config.get('fused_transform'):
+            # Download and transform in one pass, raw chunk files are not read back
+            run_stage("fused download and transform", run_fused_download_transform, config)
+        else:
+            # Run download
+            run_stage("download", run_download, config)
+
+            # Run transform
+            run_stage("transform", run_transform, config)
         
         # Run ingest
-        logger.info("Starting ingest process")
-        run_ingest(**config)
+        run_stage("ingest", run_ingest, config)
         
         logger.info("Pipeline completed successfully")
         
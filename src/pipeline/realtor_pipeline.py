@@ -1,9 +1,11 @@
 import os
 import logging
 from typing import Dict, Any
-from download.download_realtor import download_realtor_data
+from download.download_realtor import download_realtor_data, get_realtor_files
 from ingest.ingest_csv_to_db import ingest_realtor_data
+from ingest.ingest_stream_to_db import stream_csv_to_db
 from utils.file_utils import get_project_path
+from utils.db_utils import configure_engine, log_pool_stats
 from utils.census_utils import load_census_config 
 
 logging.basicConfig(level=logging.INFO)
@@ -19,26 +21,62 @@ def setup_pipeline_config() -> Dict[str, Any]:
     return {
         'project_path': project_path,
         'folder_path': os.path.join(project_path, 'data/raw/realtor'),
+        'archive_folder': os.path.join(project_path, 'data/archive/realtor'),
+        # Stream downloads straight into the database instead of landing them in folder_path
+        'streaming': False,
+        # Keep a gzip compressed copy of each streamed file in archive_folder
+        'archive': True,
+        # Upsert only new or revised months into existing tables instead of reloading them
+        'incremental': False,
+        # Number of files, or shards of large files, loaded into the database concurrently
+        'ingest_workers': 4,
+        # Load into shadow tables and swap them in, so readers never see a missing or partial table
+        'swap_load': True,
+        # Create numeric columns from a sample of each file instead of storing everything as text
+        'typed_columns': True,
     }
 
 def run_download(folder_path: str, **kwargs) -> None:
     """Wrapper function for download process"""
     try:
         # Modify the main function to accept parameters
-        download_realtor_data(folder_path)
+        results = download_realtor_data(folder_path)
+        for result in results:
+            logger.info(f"Download result: {result}")
     except Exception as e:
         logger.error(f"Download failed: {str(e)}")
         raise
 
-def run_ingest(folder_path: str, **kwargs) -> None:
+def run_ingest(
+    folder_path: str,
+    incremental: bool = False,
+    ingest_workers: int = 1,
+    swap_load: bool = False,
+    typed_columns: bool = False,
+    **kwargs
+) -> None:
     """Wrapper function for ingestion process"""
     try:
         # Call ingest_census_data directly instead of main
-        ingest_realtor_data(folder_path)
+        # Keep a pooled connection open for every worker
+        configure_engine(pool_size=max(ingest_workers, 1))
+        ingest_realtor_data(folder_path, incremental=incremental, max_workers=ingest_workers, swap=swap_load, typed=typed_columns)
+        log_pool_stats()
     except Exception as e:
         logger.error(f"Ingestion failed: {str(e)}")
         raise
 
+def run_streaming_ingest(archive_folder: str, archive: bool = True, **kwargs) -> None:
+    """Stream each Realtor.com file from S3 straight into the database"""
+    try:
+        for url, csv_output_name in get_realtor_files():
+            table_name = csv_output_name.split('.')[0].lower()
+            archive_path = os.path.join(archive_folder, f"{csv_output_name}.gz") if archive else None
+            stream_csv_to_db(url=url, schema="raw_realtor", table_name=table_name, archive_path=archive_path)
+    except Exception as e:
+        logger.error(f"Streaming ingestion failed: {str(e)}")
+        raise
+
 def run_pipeline(config: Dict[str, Any] = None) -> None:
     """
     Main pipeline function that orchestrates the entire process
@@ -49,13 +87,18 @@ def run_pipeline(config: Dict[str, Any] = None) -> None:
     logger.info("Starting census data pipeline")
     
     try:
-        # Run download
-        logger.info("Starting download process")
-        run_download(**config)
-        
-        # Run ingest
-        logger.info("Starting ingest process")
-        run_ingest(**config)
+        if config.get('streaming', False):
+            # Download and ingest in one pass, nothing is landed in the raw folder
+            logger.info("Starting streaming ingest process")
+            run_streaming_ingest(**config)
+        else:
+            # Run download
+            logger.info("Starting download process")
+            run_download(**config)
+
+            # Run ingest
+            logger.info("Starting ingest process")
+            run_ingest(**config)
         
         logger.info("Pipeline completed successfully")
         
@@ -1,12 +1,25 @@
 import pandas as pd
 import os
-from pathlib import Path
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 from utils.logger_utils import setup_logging
-from utils.file_utils import write_df_to_csv, prepare_and_clean_folder, get_project_path
-from utils.census_utils import load_census_config, create_column_mapping
+from utils.file_utils import write_df, read_df, read_columns, prepare_and_clean_folder, get_project_path
+from utils.census_utils import load_census_config, get_variable_catalog, VariableCatalog, CATALOG_CACHE_FOLDER
+from utils.schema_utils import apply_dtype_schema, read_census_file
 
 logger = setup_logging()
 
+#Raw chunk files are named <prefix>_<table>_<geo level>_<year>_<chunk index>.csv, or .parquet
+CHUNK_FILE_PATTERN = re.compile(r'^(?P<base>.+)_(?P<year>\d{4})_(?P<chunk>\d+)(?P<extension>\.csv|\.parquet)$')
+
+#Consolidated Parquet datasets are partitioned into a folder per year
+PARTITION_COLUMNS = ['year']
+
+#Groups submitted to the process pool ahead of the one being written, per worker
+GROUPS_IN_FLIGHT_PER_WORKER = 2
+
 def add_year_column(df: pd.DataFrame, year: int) -> pd.DataFrame:
     """Add year column to DataFrame."""
     try:
@@ -30,8 +43,9 @@ def get_base_name(file_name):
    return file_name.rsplit('_', 2)[0]
 
 def get_consolidated_file_name(file_name: str) -> str:
-    """Get consolidated file name based"""
-    return f"{get_base_name(file_name)}.csv"
+    """Get consolidated file name based, in the storage format of the raw file"""
+    base_name, extension = os.path.splitext(file_name)
+    return f"{get_base_name(base_name)}{extension}"
 
 def get_processed_file_path(raw_file_path: str) -> str:
     file_name = os.path.basename(raw_file_path)
@@ -68,92 +82,289 @@ def remove_column(df: pd.DataFrame, column: str) -> pd.DataFrame:
         logger.error(f"Error removing column {column}: {e}")
         return df
     
-def merge_files_with_same_base(raw_file_path):
-    base_file_name = Path(raw_file_path).stem.split('_0')[0]
+def restore_integer_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert float columns holding only whole numbers back to nullable integers.
+    Missing values turn integer columns into floats, which would be written as e.g. 123.0
+    and loaded verbatim by COPY, breaking the integer casts in the dbt models.
+    """
+    for col in df.select_dtypes(include='float').columns:
+        values = df[col].dropna()
+        if (values == values.round()).all():
+            df[col] = df[col].astype('Int64')
+    return df
 
-    logger.info(f"Checking for matching files with base name: {base_file_name}")
-    directory = os.path.dirname(raw_file_path)
-    matching_files = [f for f in os.listdir(directory) if base_file_name in f]
-    logger.info(f"Found {len(matching_files)} matching files")
+def group_chunk_files(directory: str) -> dict[tuple[str, int], list[str]]:
+    """
+    Group the chunk files of a folder by (base name, year) with a single directory scan
+    e.g. census_acs5_subject_zcta_2019_0.csv and census_acs5_subject_zcta_2019_1.csv
+    Returns: dict: (base name, year) -> chunk file paths ordered by chunk index
+    """
+    groups = {}
+    for entry in os.scandir(directory):
+        match = CHUNK_FILE_PATTERN.match(entry.name)
+        if match is None:
+            continue
+        key = (match.group('base'), int(match.group('year')))
+        groups.setdefault(key, []).append((int(match.group('chunk')), entry.path))
+    return {key: [path for _, path in sorted(chunks)] for key, chunks in sorted(groups.items())}
 
-    if len(matching_files) == 1:
-        logger.info(f"Only one file found. Returning DataFrame")
-        return pd.read_csv(raw_file_path)
-        
-    dfs = []
-    for file in matching_files:
-        file_path = os.path.join(directory, file)
-        logger.info(f"Reading file: {file_path}")
-        # Check if columns already exist in merged DataFrame to avoid duplicates
-        df = pd.read_csv(file_path, low_memory=False)
-        if len(dfs) > 0:
-            existing_cols = set().union(*[set(df.columns) for df in dfs])
-            cols_to_keep = ['GEO_ID'] + [col for col in df.columns if col not in existing_cols]
-            df = df[cols_to_keep]
-
-        dfs.append(df)
-
-    # Merge all dataframes with outer join on GEO_ID
-    final_df = dfs[0]
-    logger.info(f"Merging {len(dfs)} DataFrames")
+def merge_chunk_frames(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Combine the chunk DataFrames of one table, geo level and year into a single DataFrame
+    Each frame adds the columns not in an earlier frame, aligned on GEO_ID and joined with one concat.
+    """
+    if len(frames) == 1:
+        return frames[0]
+
+    indexed_frames = []
+    column_order = []
+    seen_columns = set()
+    for df in frames:
+        new_columns = [col for col in df.columns if col not in seen_columns]
+        if indexed_frames:
+            if not new_columns:
+                continue
+            df = df[['GEO_ID'] + new_columns]
+        df = df.set_index('GEO_ID')
+        duplicates = df.index.duplicated()
+        if duplicates.any():
+            logger.warning(f"Dropping {duplicates.sum()} rows with duplicate GEO_IDs")
+            df = df[~duplicates]
+
+        indexed_frames.append(df)
+        column_order.extend(new_columns)
+        seen_columns.update(new_columns)
+
+    logger.info(f"Merging {len(indexed_frames)} DataFrames")
     try:
-        for df in dfs[1:]:
-            final_df = pd.merge(final_df, df, on='GEO_ID', how='outer') 
+        merged = pd.concat(indexed_frames, axis=1, join='outer')
     except Exception as e:
         logger.error(f"Error merging DataFrames: {e}")
         raise
 
-    return final_df
+    # Keep the column order of the chunks, GEO_ID included
+    return merged.rename_axis('GEO_ID').reset_index()[column_order]
+
+def read_chunk_file(file_path: str, columns: list, catalog: VariableCatalog = None) -> pd.DataFrame:
+    """Read columns of a chunk file, in the dtype schema of the catalog if given"""
+    if catalog is None:
+        return read_df(file_path, columns=columns, low_memory=False)
+    return read_census_file(file_path, catalog, columns)
+
+def merge_chunk_files(chunk_file_paths: list[str], skip_columns: list = None, catalog: VariableCatalog = None) -> pd.DataFrame:
+    """
+    Combine the chunk files of one table, geo level and year into a single DataFrame
+    Each file is read only for the columns it adds, see merge_chunk_frames.
+    Columns in skip_columns are not read at all.
+    """
+    skip_columns = set(skip_columns or [])
+    if len(chunk_file_paths) == 1:
+        logger.info(f"Only one file found. Returning DataFrame")
+        header = read_columns(chunk_file_paths[0])
+        return read_chunk_file(chunk_file_paths[0], [col for col in header if col not in skip_columns], catalog)
+
+    frames = []
+    seen_columns = set(skip_columns)
+    for file_path in chunk_file_paths:
+        header = [col for col in read_columns(file_path) if col not in skip_columns]
+        new_columns = [col for col in header if col not in seen_columns]
+        if not frames:
+            usecols = list(header)
+        elif new_columns:
+            usecols = ['GEO_ID'] + new_columns
+        else:
+            logger.info(f"Skipping {file_path}, it adds no new columns")
+            continue
+
+        logger.info(f"Reading {len(usecols)} columns from file: {file_path}")
+        frames.append(read_chunk_file(file_path, usecols, catalog))
+        seen_columns.update(new_columns)
+
+    return merge_chunk_frames(frames)
+
+def transform_census_df(df: pd.DataFrame, column_mapping: dict, year: int, catalog: VariableCatalog = None) -> pd.DataFrame:
+    """
+    Map the columns of a merged table, geo level and year, add its year and drop state
+    With catalog, the columns are converted to the dtypes of its schema.
+    """
+    df = map_columns(df, column_mapping)
+    df = add_year_column(df, year)
+    df = remove_column(df, 'state')
+    df = restore_integer_columns(df)
+    if catalog is not None:
+        df = apply_dtype_schema(df, catalog.get_dtypes(df.columns))
+    return df
+
+def transform_chunk_files(
+    chunk_file_paths: list[str],
+    column_mapping: dict,
+    year: int,
+    catalog: VariableCatalog = None
+) -> pd.DataFrame | None:
+    """
+    Merge and transform the chunk files of one table, geo level and year
+    Runs in a worker process in parallel mode, so errors are logged and None is returned.
+    """
+    logger.info(f"Processing files: {chunk_file_paths}")
+    try:
+        # state is dropped from the output, so it is never read
+        df = merge_chunk_files(chunk_file_paths, skip_columns=['state'], catalog=catalog)
+        return transform_census_df(df, column_mapping, year, catalog)
+    except Exception as e:
+        logger.error(f"Error processing files {chunk_file_paths}: {e}")
+        return None
 
 def process_census_file(
-    raw_file_path: str,
+    chunk_file_paths: list[str],
     processed_file_path: str,
-    column_mapping: dict
+    column_mapping: dict,
+    year: int,
+    catalog: VariableCatalog = None
 ) -> None:
-    """Process a single census file."""
-    logger.info(f"Processing file: {raw_file_path}")
-    try:
-        # Read and transform the file
-        df = merge_files_with_same_base(raw_file_path)
-        df = map_columns(df, column_mapping)
-        df = add_year_column(df, int(get_year_from_file_name(raw_file_path)))
-        df = remove_column(df, 'state')
-
+    """Process the chunk files of one table, geo level and year."""
+    df = transform_chunk_files(chunk_file_paths, column_mapping, year, catalog)
+    if df is not None:
         # Save the processed data
-        write_df_to_csv(df, processed_file_path, append=True)
-    except Exception as e:
-        logger.error(f"Error processing file {raw_file_path}: {e}")
+        write_df(df, processed_file_path, append=True, partition_cols=PARTITION_COLUMNS)
+
+def plan_census_transform(raw_folder_path: str) -> list[tuple[str, int, list[str], str]]:
+    """
+    List the chunk file groups to transform, ordered by processed file and year
+    Returns: list: (processed file path, year, chunk file paths, table name) tuples
+    """
+    groups = []
+    for folder in os.listdir(raw_folder_path):
+        raw_subfolder_path = os.path.join(raw_folder_path, folder)
+        if not os.path.isdir(raw_subfolder_path):
+            continue
+        for (base_name, year), chunk_file_paths in group_chunk_files(raw_subfolder_path).items():
+            # Create processed file path using table name from raw folder path being processed
+            groups.append((get_processed_file_path(chunk_file_paths[0]), year, chunk_file_paths, folder))
+    return sorted(groups, key=lambda group: (group[0], group[1]))
 
 def process_and_consolidate_census_files(
     raw_folder_path: str,
-    column_mapping: dict
+    catalog: VariableCatalog,
+    max_workers: int = 1
 ) -> None:
-    """Process all census files and consolidate into files based on table."""
+    """
+    Process all census files and consolidate into files based on table.
+    Each table and year is mapped with its own column mapping and dtype schema from the variable catalog.
+    With max_workers above 1 the groups are transformed in a process pool. Only this process
+    writes, appending each group's result in year order, so outputs never interleave.
+    """
 
     logger.info(f"Processing all files in {raw_folder_path}")
 
     # Create processed folder if it doesn't exist and delete existing files
     prepare_and_clean_folder(raw_folder_path.replace('raw', 'processed'))
 
-    # Process each file in each census table folder
-    for folder in os.listdir(raw_folder_path):
-        # Create processed file path using table name from raw folder path being processed
-        raw_subfolder_path = os.path.join(raw_folder_path, folder)
+    groups = plan_census_transform(raw_folder_path)
+    if max_workers <= 1:
+        for processed_file_path, year, chunk_file_paths, table_name in groups:
+            process_census_file(
+                chunk_file_paths=chunk_file_paths,
+                processed_file_path=processed_file_path,
+                column_mapping=catalog.get_column_mapping(table_name, year),
+                year=year,
+                catalog=catalog
+            )
+        return
+
+    logger.info(f"Transforming {len(groups)} file groups with {max_workers} processes")
+    max_in_flight = max_workers * GROUPS_IN_FLIGHT_PER_WORKER
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Results are written in submission order, i.e. by processed file and year,
+        # and only a few groups per worker are submitted ahead so finished DataFrames do not pile up
+        in_flight = deque()
+        for processed_file_path, year, chunk_file_paths, table_name in groups:
+            future = executor.submit(
+                transform_chunk_files,
+                chunk_file_paths,
+                catalog.get_column_mapping(table_name, year),
+                year,
+                catalog
+            )
+            in_flight.append((processed_file_path, future))
+            if len(in_flight) >= max_in_flight:
+                write_transformed_group(*in_flight.popleft())
+        while in_flight:
+            write_transformed_group(*in_flight.popleft())
+
+def write_transformed_group(processed_file_path: str, future) -> None:
+    """Append the result of a transform_chunk_files future to its processed file"""
+    df = future.result()
+    if df is not None:
+        write_df(df, processed_file_path, append=True, partition_cols=PARTITION_COLUMNS)
+
+class CensusChunkCollector:
+    """
+    Transforms downloaded chunks in memory instead of reading them back from raw chunk files.
+    The chunk DataFrames of each table, geo level and year are kept until the last one arrives,
+    then merged, transformed and written to the processed file once.
+    Chunks may be added from several download threads.
+
+    Parameters:
+    catalog (VariableCatalog): The catalog each table and year is mapped with
+    processed_folder (str): The folder the consolidated files are written to
+    """
+
+    def __init__(self, catalog: VariableCatalog, processed_folder: str) -> None:
+        self.catalog = catalog
+        self.processed_folder = processed_folder
+        self.chunks = {}
+        self.failed = {}
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+
+    def add(self, item: dict, df: pd.DataFrame) -> None:
+        """
+        Add the DataFrame of a downloaded work item, see download_census.CensusWorkItem
+        Writes the group of the item once all of its chunks have been added. A group that fails to
+        transform or write is logged and kept in failed, see log_failed_groups, instead of raising into the download.
+        """
+        key = (item['table']['name'], item['geo_level']['file_name_segment'], item['year'])
+        with self.lock:
+            chunks = self.chunks.setdefault(key, {})
+            chunks[item['chunk_index']] = df
+            if len(chunks) < item['num_chunks']:
+                return
+            del self.chunks[key]
+
+        logger.info(f"Transforming {key[0]} {key[1]} {key[2]} from {len(chunks)} downloaded chunks")
+        try:
+            df = merge_chunk_frames([chunks[index] for index in sorted(chunks)])
+            df = transform_census_df(df, self.catalog.get_column_mapping(key[0], item['year']), item['year'], self.catalog)
+            processed_file_path = os.path.join(
+                self.processed_folder,
+                get_consolidated_file_name(os.path.basename(item['file_path']))
+            )
+            # Appends from different threads must not interleave
+            with self.write_lock:
+                write_df(df, processed_file_path, append=True, partition_cols=PARTITION_COLUMNS)
+        except Exception as e:
+            logger.error(f"Error transforming {key[0]} {key[1]} {key[2]}: {e}")
+            with self.lock:
+                self.failed[key] = str(e)
 
-        # Process each file in the folder
-        for file_name in os.listdir(os.path.join(raw_folder_path, folder)):
-            # Process the first file for each year
-            if file_name.endswith("_0.csv"):
-                raw_file_path = os.path.join(raw_subfolder_path, file_name)
-                processed_file_path = get_processed_file_path(raw_file_path)
+    def log_incomplete_groups(self) -> list:
+        """Log the groups that were not written because some of their chunks failed to download"""
+        with self.lock:
+            incomplete = sorted(self.chunks)
+        for table_name, geo_level, year in incomplete:
+            logger.error(f"{table_name} {geo_level} {year} was not written, some of its chunks failed to download")
+        return incomplete
 
-                process_census_file(
-                    raw_file_path=os.path.join(raw_subfolder_path, file_name),
-                    processed_file_path=processed_file_path,
-                    column_mapping=column_mapping
-                )
+    def log_failed_groups(self) -> list:
+        """Log the groups that were downloaded but not written because transforming or writing them failed"""
+        with self.lock:
+            failed = sorted(self.failed.items())
+        for (table_name, geo_level, year), error in failed:
+            logger.error(f"{table_name} {geo_level} {year} was not written, it failed to transform: {error}")
+        return [key for key, _ in failed]
 
-def main(project_path=None, census_raw_folder=None, config_path=None, config=None) -> None:
+def main(project_path=None, census_raw_folder=None, config_path=None, config=None, max_workers: int = 1) -> None:
     if project_path is None:
         project_path = get_project_path()
     if census_raw_folder is None:
@@ -163,11 +374,12 @@ def main(project_path=None, census_raw_folder=None, config_path=None, config=Non
     if config is None:
         config = load_census_config(config_path)
     
-    column_mapping = create_column_mapping(config)
+    catalog = get_variable_catalog(config, cache_folder=os.path.join(project_path, CATALOG_CACHE_FOLDER))
     logger.info(f"Processing census files in {census_raw_folder}")
     process_and_consolidate_census_files(
         raw_folder_path=census_raw_folder,
-        column_mapping=column_mapping
+        catalog=catalog,
+        max_workers=max_workers
     )
 
 
@@ -1,57 +1,186 @@
 import requests
 from utils.logger_utils import setup_logging
 import time
+import json
+import threading
+from urllib.parse import urlparse
 import pandas as pd
+from utils.session_utils import get_session
+from utils.cache_utils import ResponseCache
+from utils.json_stream_utils import decode_census_response
+from utils.retry_utils import RetryPolicy, get_circuit_breaker, record_retry_stat
 
 logger = setup_logging()
 
-def get_response(url, params=None, max_retries=10, retry_delay=5, timeout=30):
 
-    #Initial retry delay
-    initial_retry_delay = retry_delay
+class TokenBucket:
+    """
+    Thread-safe token bucket used to rate limit requests to a single host
+    Parameters:
+    rate (float): The number of tokens added per second
+    capacity (int): The maximum number of tokens the bucket can hold
+    """
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        if rate <= 0:
+            raise ValueError("Token bucket rate must be greater than 0")
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self, tokens: int = 1) -> None:
+        """Block until the requested number of tokens is available"""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_time = (tokens - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+#Rate limiters keyed by host name
+rate_limiters: dict[str, TokenBucket] = {}
+
+
+def set_rate_limit(host: str, requests_per_second: float, burst: int = 1) -> None:
+    """
+    Register a token bucket rate limit for all requests made to a host
+    Parameters:
+    host (str): The host to rate limit, e.g. api.census.gov
+    requests_per_second (float): The sustained request rate allowed
+    burst (int): The number of requests that can be made back to back
+    """
+    rate_limiters[host] = TokenBucket(rate=requests_per_second, capacity=burst)
+    logger.info(f"Rate limiting {host} to {requests_per_second} requests/second (burst {burst})")
+
+
+def wait_for_rate_limit(url: str) -> None:
+    """Wait for a token from the rate limiter registered for the URL's host, if any"""
+    limiter = rate_limiters.get(urlparse(url).netloc)
+    if limiter is not None:
+        limiter.acquire()
+
+
+#Retry policies keyed by host name, used when get_response is not given one
+retry_policies: dict[str, RetryPolicy] = {}
+
+
+def set_retry_policy(host: str, policy: RetryPolicy) -> None:
+    """
+    Register the retry policy used by get_response for requests to a host when none is passed
+    Parameters:
+    host (str): The host the policy applies to, e.g. api.census.gov
+    policy (RetryPolicy): The retry policy
+    """
+    retry_policies[host] = policy
+
+
+def get_response(url, params=None, max_retries=10, retry_delay=5, timeout=30, stream=False, retry_policy: RetryPolicy = None, headers: dict = None, allowed_statuses: tuple = ()):
+    """
+    Make a GET request, retrying failures the retry policy considers retryable
+    Requests wait for the host's rate limiter and circuit breaker before every attempt.
+    allowed_statuses are error statuses returned to the caller instead of failing, e.g. 416 for a Range request.
+    Returns: requests.Response | None: The response, or None if the request failed
+    """
+    host = urlparse(url).netloc
+    policy = retry_policy or retry_policies.get(host) or RetryPolicy(max_retries=max_retries, base_delay=retry_delay)
+    circuit_breaker = get_circuit_breaker(host)
 
     #Retry loop
-    for attempt in range(max_retries):
+    for attempt in range(policy.max_retries):
+        response = None
         try:
+            #Respect the circuit breaker and per-host rate limit before every attempt
+            circuit_breaker.wait_until_closed()
+            wait_for_rate_limit(url)
+
             #Make the request to the API
-            response = requests.get(url, params=params, timeout=timeout)
-            response.raise_for_status() #Raise an error for bad HTTP responses
-            #Exit attempt loop if successful
-            if response.status_code == 200:
-                #Reset the retry delay
-                retry_delay = initial_retry_delay
-                return response
-        
+            record_retry_stat(host, 'requests')
+            response = get_session().get(url, params=params, timeout=timeout, stream=stream, headers=headers)
+            if response.status_code not in allowed_statuses:
+                response.raise_for_status() #Raise an error for bad HTTP responses
+            circuit_breaker.record_success()
+            record_retry_stat(host, 'successes')
+            return response
+
         except requests.exceptions.RequestException as e:
-            logger.info(f'Attempt {attempt + 1} of {max_retries} failed: {str(e)}')
-            logger.info(f"Response content: {response.content}")
-            if attempt < max_retries:
-                logger.info(f"Retrying in {retry_delay} seconds...")
-                
-                #Exponential backoff
-                if attempt > 0:
-                    retry_delay = round(retry_delay * 1.5, 0)
-                
-                #Wait for the retry delay
-                time.sleep(retry_delay)
-            else:
-                print("Max retries reached. Returning None")
+            logger.info(f'Attempt {attempt + 1} of {policy.max_retries} failed: {str(e)}')
+            if response is not None:
+                logger.info(f"Response content: {response.content}")
+
+            #Fail fast on requests that can never succeed, e.g. a 400 for an unknown variable
+            if not policy.is_retryable(e):
+                record_retry_stat(host, 'non_retryable')
+                logger.error(f"Non-retryable error for {url}, not retrying: {str(e)}")
                 return None
-            
-def get_response_as_json(url: str, params: dict):
+
+            circuit_breaker.record_failure()
+            if attempt + 1 >= policy.max_retries:
+                break
+
+            delay = policy.get_delay(attempt, response)
+            if response is not None and response.headers.get('Retry-After') is not None:
+                record_retry_stat(host, 'retry_after_waits')
+            record_retry_stat(host, 'retries')
+            record_retry_stat(host, 'backoff_seconds', delay)
+            logger.info(f"Retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+
+    record_retry_stat(host, 'exhausted')
+    logger.error(f"Max retries reached for {url}. Returning None")
+    return None
+
+def get_cached_body(cache: ResponseCache, url: str, params: dict, ttl: float = None) -> tuple[str, bytes | None]:
+    """
+    Look up a response body in the cache
+    Returns: tuple: The cache key and the cached body, or None if it is not cached
+    """
+    cache_key = cache.make_key(url, params)
+    body = cache.get(cache_key, ttl=ttl)
+    if body is not None:
+        logger.info(f"Serving response for {url} from cache")
+    elif cache.offline:
+        logger.error(f"Response for {url} is not cached and offline replay mode is enabled: {params}")
+    return cache_key, body
+
+def get_response_as_json(url: str, params: dict, cache: ResponseCache = None, ttl: float = None):
     """
     Retrieve data from an API as JSON
     year (str): The year to retrieve data for
     params (dict): dictionary of parameters to pass to the API
+    cache (ResponseCache): Optional cache to serve the response from and store it in
+    ttl (float): Seconds before a cached response expires, None to never expire
     """
+    if cache is not None:
+        cache_key, body = get_cached_body(cache, url, params, ttl)
+        if body is not None:
+            return json.loads(body)
+        if cache.offline:
+            return None
+
+    response = get_response(url, params)
+    if response is None:
+        return None
+
     try:
-        response = get_response(url, params)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        data = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
         logger.error(f"Error getting response for {url}: {e}")
         return None
 
+    if cache is not None:
+        cache.put(cache_key, response.content)
+    return data
+
 def convert_json_to_df(data: list) -> None:
     """
     Process the data from the census API
@@ -68,12 +197,71 @@ def convert_json_to_df(data: list) -> None:
         return None
 
 
-def get_response_as_df(url, params: dict) -> pd.DataFrame:
+def get_streamed_response_as_df(
+    url: str,
+    params: dict,
+    numeric_columns: set[str],
+    cache: ResponseCache = None,
+    ttl: float = None,
+    chunk_size: int = 1024 * 1024
+) -> pd.DataFrame | None:
+    """
+    Retrieves a JSON array of arrays and decodes it into typed columns while the body streams in,
+    without building an intermediate list of lists
+    numeric_columns (set): The columns to parse as numbers
+    """
+    if cache is not None:
+        cache_key, body = get_cached_body(cache, url, params, ttl)
+        if body is not None:
+            return decode_census_response([body], numeric_columns)
+        if cache.offline:
+            return None
+
+    response = get_response(url, params, stream=True)
+    if response is None:
+        logger.error(f"No data received from {url}")
+        return None
+
+    # Keep the raw body only when it has to be cached
+    body_parts = [] if cache is not None else None
+
+    def iter_body():
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if body_parts is not None:
+                body_parts.append(chunk)
+            yield chunk
+
+    try:
+        df = decode_census_response(iter_body(), numeric_columns)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.error(f"Error decoding response for {url}: {e}")
+        return None
+    finally:
+        response.close()
+
+    if cache is not None:
+        cache.put(cache_key, b''.join(body_parts))
+
+    logger.info(f"Processed data for {url}")
+    return df
+
+
+def get_response_as_df(
+    url,
+    params: dict,
+    cache: ResponseCache = None,
+    ttl: float = None,
+    numeric_columns: set[str] = None
+) -> pd.DataFrame:
     """
     Retrieves data from an API and converts it to a DataFrame
+    If numeric_columns is given the response is decoded while it streams in, see get_streamed_response_as_df
     """
     logger.info(f"Downloading Data for {url}")
-    data = get_response_as_json(url, params=params)
+    if numeric_columns is not None:
+        return get_streamed_response_as_df(url, params, numeric_columns, cache=cache, ttl=ttl)
+
+    data = get_response_as_json(url, params=params, cache=cache, ttl=ttl)
 
     if data is None:
         logger.error(f"No data received from {url}")
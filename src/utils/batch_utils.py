@@ -0,0 +1,125 @@
+import os
+import json
+import datetime
+import threading
+from utils.logger_utils import setup_logging
+
+logger = setup_logging()
+
+DEFAULT_BATCH_SIZE = 1000
+MIN_BATCH_SIZE = 500
+MAX_BATCH_SIZE = 1000000
+
+#Largest in-memory DataFrame a batch may grow to
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+
+#A larger batch must be this much faster to be kept
+IMPROVEMENT_THRESHOLD = 1.05
+
+state_lock = threading.Lock()
+
+
+class BatchSizeController:
+    """
+    Tunes the number of rows per batch to the best measured throughput.
+    The size doubles while rows/sec keeps improving, then settles on the fastest size seen.
+    Batches never grow past the memory limit, estimated from the bytes per row of earlier batches.
+
+    Parameters:
+    initial_size (int): The first batch size, e.g. the size learned by an earlier run
+    min_size (int): The smallest batch size
+    max_size (int): The largest batch size
+    memory_limit (int): The largest batch in bytes
+    bytes_per_row (float): The bytes per row learned by an earlier run, so the first batch is held to memory_limit
+    """
+
+    def __init__(
+        self,
+        initial_size: int = DEFAULT_BATCH_SIZE,
+        min_size: int = MIN_BATCH_SIZE,
+        max_size: int = MAX_BATCH_SIZE,
+        memory_limit: int = DEFAULT_MEMORY_LIMIT,
+        bytes_per_row: float = None
+    ) -> None:
+        self.min_size = min_size
+        self.max_size = max_size
+        self.memory_limit = memory_limit
+        self.bytes_per_row = bytes_per_row
+        self.size = self.clamp(initial_size)
+        self.best_size = self.size
+        self.best_rate = 0.0
+        self.exploring = True
+        self.misses = 0
+        self.measured_batches = 0
+
+    def clamp(self, size: int) -> int:
+        ceiling = self.max_size
+        if self.bytes_per_row:
+            ceiling = min(ceiling, int(self.memory_limit / self.bytes_per_row))
+        return max(self.min_size, min(int(size), ceiling))
+
+    def next_size(self) -> int:
+        return self.size
+
+    def record(self, rows: int, seconds: float, memory_bytes: int) -> None:
+        """Record a loaded batch and pick the size of the next one"""
+        if rows <= 0 or seconds <= 0:
+            return
+        self.bytes_per_row = memory_bytes / rows
+        # A short batch, e.g. the end of the file, says little about its size
+        if rows < self.size:
+            return
+
+        rate = rows / seconds
+        self.measured_batches += 1
+        if rate >= self.best_rate * IMPROVEMENT_THRESHOLD:
+            self.best_rate, self.best_size = rate, rows
+            self.misses = 0
+            if self.exploring:
+                self.size = self.clamp(rows * 2)
+                return
+        elif self.exploring:
+            # Measure a larger size twice before giving up on it, single batches are noisy
+            self.misses += 1
+            if self.misses < 2:
+                return
+            logger.info(f"Batch size settled on {self.best_size} rows at {self.best_rate:.0f} rows/sec")
+            self.exploring = False
+        self.size = self.clamp(self.best_size)
+
+    def get_state(self) -> dict:
+        return {
+            'batch_size': self.best_size,
+            'rows_per_second': round(self.best_rate, 1),
+            'bytes_per_row': round(self.bytes_per_row, 1) if self.bytes_per_row else None,
+            'updated_at': datetime.datetime.now().isoformat()
+        }
+
+
+def load_batch_state(state_path: str) -> dict:
+    """Load the batch sizes and rates learned for each table"""
+    if not os.path.exists(state_path):
+        return {}
+    try:
+        with open(state_path, 'r') as file:
+            return json.load(file)
+    except (IOError, ValueError) as e:
+        logger.error(f"Error reading batch state {state_path}, batch sizes will be learned again: {e}")
+        return {}
+
+
+def get_learned_batch_state(state_path: str, table_key: str) -> dict:
+    """Get the batch size and bytes per row learned for a table, empty if it was never measured"""
+    return load_batch_state(state_path).get(table_key, {})
+
+
+def update_batch_state(state_path: str, table_key: str, table_state: dict) -> None:
+    """Update the learned state of one table and write the state file atomically"""
+    with state_lock:
+        state = load_batch_state(state_path)
+        state[table_key] = table_state
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        temp_path = f"{state_path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(state, file, indent=2)
+        os.replace(temp_path, state_path)
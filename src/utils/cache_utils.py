@@ -0,0 +1,163 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+from urllib.parse import urlparse
+from utils.logger_utils import setup_logging
+
+logger = setup_logging()
+
+INDEX_FILE_NAME = 'index.json'
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of API response bodies.
+    Bodies are stored gzip compressed and evicted least recently used first
+    once the cache grows past max_size_bytes.
+
+    Parameters:
+    cache_dir (str): The folder to store cached responses in
+    max_size_bytes (int): The maximum total size of compressed bodies, None for no limit
+    default_ttl (float): Seconds before a cached response expires, None to never expire
+    ttl_by_year (dict): Per-year TTL in seconds overriding default_ttl
+    offline (bool): Serve responses only from the cache and never call the API
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_size_bytes: int = None,
+        default_ttl: float = None,
+        ttl_by_year: dict[int, float] = None,
+        offline: bool = False
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.default_ttl = default_ttl
+        self.ttl_by_year = ttl_by_year or {}
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self._load_index()
+
+    @staticmethod
+    def make_key(url: str, params: dict = None) -> str:
+        """
+        Create a cache key from the URL and normalized parameters.
+        Parameter names are sorted and the comma separated 'get' column list is
+        sorted so the same request always maps to the same key.
+        """
+        parsed = urlparse(url)
+        normalized_url = f"{parsed.scheme.lower()}://{parsed.netloc.lower()}{parsed.path.rstrip('/')}"
+
+        normalized_params = {}
+        for name, value in (params or {}).items():
+            value = str(value).strip()
+            if name == 'get':
+                value = ','.join(sorted(code.strip() for code in value.split(',')))
+            normalized_params[name] = value
+
+        key_source = json.dumps([normalized_url, normalized_params], sort_keys=True)
+        return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+    def get_ttl(self, year: int = None) -> float | None:
+        """Get the TTL in seconds for responses from a year"""
+        return self.ttl_by_year.get(year, self.default_ttl)
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json.gz")
+
+    def _load_index(self) -> dict:
+        index_path = os.path.join(self.cache_dir, INDEX_FILE_NAME)
+        if not os.path.exists(index_path):
+            return {}
+        try:
+            with open(index_path, 'r') as file:
+                return json.load(file)
+        except (IOError, ValueError) as e:
+            logger.error(f"Error reading cache index {index_path}, starting with an empty index: {e}")
+            return {}
+
+    def _save_index(self) -> None:
+        index_path = os.path.join(self.cache_dir, INDEX_FILE_NAME)
+        temp_path = f"{index_path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(self.index, file)
+        os.replace(temp_path, index_path)
+
+    def _remove(self, key: str) -> None:
+        self.index.pop(key, None)
+        try:
+            os.remove(self._get_path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key: str, ttl: float = None) -> bytes | None:
+        """
+        Get a cached response body
+        Returns: bytes | None: The body, or None if it is not cached or has expired
+        """
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None or not os.path.exists(self._get_path(key)):
+                self.stats['misses'] += 1
+                return None
+
+            if ttl is not None and time.time() - entry['created'] > ttl:
+                logger.info(f"Cached response {key} has expired")
+                self._remove(key)
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+
+            entry['last_access'] = time.time()
+            self.stats['hits'] += 1
+
+        try:
+            with gzip.open(self._get_path(key), 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            #Evicted by another thread after the index lookup
+            return None
+
+    def put(self, key: str, body: bytes) -> None:
+        """Store a response body in the cache and evict old entries if the cache is full"""
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(gzip.compress(body))
+        os.replace(temp_path, path)
+
+        now = time.time()
+        with self.lock:
+            self.index[key] = {'size': os.path.getsize(path), 'created': now, 'last_access': now}
+            self._evict()
+            self._save_index()
+
+    def _evict(self) -> None:
+        """Remove least recently used entries until the cache fits in max_size_bytes"""
+        if self.max_size_bytes is None:
+            return
+        total_size = sum(entry['size'] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]['last_access']):
+            if total_size <= self.max_size_bytes:
+                break
+            total_size -= self.index[key]['size']
+            self._remove(key)
+            self.stats['evicted'] += 1
+
+    def flush(self) -> None:
+        """Persist the access times recorded by cache hits"""
+        with self.lock:
+            self._save_index()
+        logger.info(
+            f"Response cache: {self.stats['hits']} hits, {self.stats['misses']} misses, "
+            f"{self.stats['expired']} expired, {self.stats['evicted']} evicted"
+        )
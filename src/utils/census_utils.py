@@ -1,9 +1,28 @@
+import os
+import json
 import yaml
+import hashlib
+import threading
+import numpy as np
 from typing import Dict, List
 from utils.logger_utils import setup_logging
 
 logger = setup_logging()
 
+#Compiled variable catalogs are cached here, relative to the project path
+CATALOG_CACHE_FOLDER = 'data/cache/census/catalog'
+
+#dtypes used when the configuration does not set them
+DEFAULT_SUFFIX_DTYPE = 'float64'
+DEFAULT_GEOGRAPHY_DTYPES = {'default': 'string', 'state': 'category'}
+
+#Census annotation values, kept in sync with realty_dbt/seeds/census__value_annotations.csv
+ANNOTATION_VALUE_CODES = (-666666666, -999999999, -888888888, -222222222, -333333333, -555555555)
+
+#Catalogs compiled by this process, keyed by the hash of their configuration
+catalogs = {}
+catalog_lock = threading.Lock()
+
 def get_table_names(config: dict) -> List[str]:
     """Get all table names from configuration."""
     return config['table_types'].values()
@@ -93,32 +112,225 @@ def create_column_mapping(config: dict) -> Dict[str, str]:
     """
     Create a mapping from Census codes to human-readable names.
     Uses variable names as base for column names with suffixes for different measures.
+    The mapping covers every table and year, see VariableCatalog.get_column_mapping for a single one,
+    so a variable with overrides maps both its default codes and its override codes,
+    e.g. S1903_C03_001E and, for 2016, S1903_C02_001E to median_household_income_estimate.
     """
-    mapping = {}
-    
-    # Add default columns to mapping
-    for col in config['default_columns']:
-        mapping[col['name']] = col['name'].lower()
+    return get_variable_catalog(config).get_column_mapping()
 
-    
-    for table_name, table_config in config['variables'].items():
-
-        for var_name, var_config in table_config.items():
-            # Map year-specific variables
-            if var_config.get('overrides') is not None:
-                # Loop through year-specific configurations
-                for year, year_config in var_config['overrides'].items():
-                    # Generate variable code for each suffix based on table prefix
-                    for suffix in config['suffixes']:
-                        variable_code = generate_variable_code(var_config, suffix['code'], year)
-                        readable_name = f"{var_name}_{suffix['mapping'].lower()}"
-
-                        mapping[variable_code] = readable_name.lower()
-            # Map standard variables
+def get_config_hash(config: dict) -> str:
+    """Get a hash of the contents of a loaded census_variables.yml"""
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def get_annotation_safe_dtype(dtype: str) -> str:
+    """
+    Get the dtype a variable can be held in without corrupting the Census annotation values
+    Dtypes that do not hold every annotation value exactly, e.g. float32, fall back to the default suffix dtype.
+    """
+    codes = np.array(ANNOTATION_VALUE_CODES, dtype='int64')
+    try:
+        round_trip = codes.astype(dtype).astype('int64')
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Cannot check dtype {dtype} against the Census annotation values, using {DEFAULT_SUFFIX_DTYPE}: {e}")
+        return DEFAULT_SUFFIX_DTYPE
+    if not np.array_equal(round_trip, codes):
+        corrupted = {int(code): int(value) for code, value in zip(codes, round_trip) if code != value}
+        logger.warning(
+            f"dtype {dtype} would change the Census annotation values {corrupted}, using {DEFAULT_SUFFIX_DTYPE}"
+        )
+        return DEFAULT_SUFFIX_DTYPE
+    return dtype
+
+
+class VariableCatalog:
+    """
+    Census variable codes and column names compiled once from the configuration.
+    Every table is compiled for its default codes and for each year with overrides, so the codes
+    and names of one year never shadow another year or another table.
+
+    Parameters:
+    tables (dict): Table name -> year ('default' or the year as a string) -> [code, column name, suffix code] entries
+    default_columns (list): The names of the default columns included in every request
+    config_hash (str): The hash of the configuration the catalog was compiled from
+    dtypes (dict): The pandas dtypes of each 'suffixes' code, 'default_columns' name and 'geography' column
+    """
+
+    def __init__(self, tables: dict, default_columns: list, config_hash: str = None, dtypes: dict = None) -> None:
+        self.tables = tables
+        self.default_columns = default_columns
+        self.config_hash = config_hash
+        self.dtypes = dtypes or {'suffixes': {}, 'default_columns': {}, 'geography': DEFAULT_GEOGRAPHY_DTYPES}
+        self.dtypes['suffixes'] = {
+            suffix: get_annotation_safe_dtype(dtype) for suffix, dtype in self.dtypes['suffixes'].items()
+        }
+
+        # Forward code lists and reverse code -> column name indexes of each table and year
+        self.codes = {}
+        self.columns = {}
+        self.column_suffixes = {}
+        self.code_suffixes = {}
+        default_mapping = {name: name.lower() for name in default_columns}
+        for table_name, years in tables.items():
+            for year, entries in years.items():
+                year = None if year == 'default' else int(year)
+                mapping = dict(default_mapping)
+                codes = self.codes.setdefault((table_name, year, None), [])
+                for code, column, suffix in entries:
+                    codes.append(code)
+                    self.codes.setdefault((table_name, year, suffix), []).append(code)
+                    mapping[code] = column
+                    self.column_suffixes[column] = suffix
+                    self.code_suffixes[code] = suffix
+                self.columns[(table_name, year)] = mapping
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'VariableCatalog':
+        """Compile the catalog of a loaded census_variables.yml"""
+        default_columns = [col['name'] for col in config['default_columns']]
+        tables = {}
+        for table_name, variables in config['variables'].items():
+            override_years = sorted({
+                year for variable_config in variables.values()
+                for year in (variable_config.get('overrides') or {})
+            })
+            tables[table_name] = {
+                str(year) if year is not None else 'default': cls.compile_year(config, table_name, variables, year)
+                for year in [None] + override_years
+            }
+        dtypes = {
+            'suffixes': {suffix['code']: suffix.get('dtype', DEFAULT_SUFFIX_DTYPE) for suffix in config['suffixes']},
+            'default_columns': {col['name']: col['dtype'] for col in config['default_columns'] if col.get('dtype')},
+            'geography': config.get('geography_dtypes') or DEFAULT_GEOGRAPHY_DTYPES
+        }
+        return cls(tables, default_columns, get_config_hash(config), dtypes)
+
+    @staticmethod
+    def compile_year(config: dict, table_name: str, variables: dict, year: int = None) -> list:
+        """Get the [code, column name, suffix code] entries of a table and year in configuration order"""
+        entries = []
+        columns_by_code = {}
+        for variable, variable_config in variables.items():
             for suffix in config['suffixes']:
-                variable_code = generate_variable_code(var_config, suffix['code'])
-                readable_name = f"{var_name}_{suffix['mapping'].lower()}"
-                
-                mapping[variable_code] = readable_name.lower()
-    
-    return mapping
\ No newline at end of file
+                code = generate_variable_code(variable_config, suffix['code'], year)
+                if code is None:
+                    continue
+                column = f"{variable}_{suffix['mapping']}".lower()
+                if code in columns_by_code:
+                    logger.warning(
+                        f"{table_name} {year or 'default'}: {code} is configured for both "
+                        f"{columns_by_code[code]} and {column}, keeping {columns_by_code[code]}"
+                    )
+                    continue
+                columns_by_code[code] = column
+                entries.append([code, column, suffix['code']])
+        return entries
+
+    def get_year_key(self, table_name: str, year: int = None) -> int | None:
+        """Get the compiled year of a table to use for a year, years without overrides use the defaults"""
+        return year if (table_name, year) in self.columns else None
+
+    def get_codes(self, table_name: str, year: int = None, suffix: str = None) -> list[str]:
+        """
+        Get the variable codes of a table and year in configuration order, default columns excluded
+        With suffix, e.g. 'E', only the codes with that suffix.
+        """
+        return list(self.codes.get((table_name, self.get_year_key(table_name, year), suffix), []))
+
+    def get_column_mapping(self, table_name: str = None, year: int = None) -> Dict[str, str]:
+        """
+        Get the code -> column name mapping of a table and year, default columns included
+        A year with overrides maps only its override codes, any other year only the default codes.
+        Without a table, the mapping of every table and year is merged, see create_column_mapping.
+        """
+        if table_name is not None:
+            return dict(self.columns.get((table_name, self.get_year_key(table_name, year)), {}))
+        mapping = {}
+        for table_mapping in self.columns.values():
+            mapping.update(table_mapping)
+        return mapping
+
+    def get_column_names(self, suffix: str = None) -> set[str]:
+        """Get the column names of the configured variables, with suffix only those measuring it"""
+        return {
+            column for column, column_suffix in self.column_suffixes.items()
+            if suffix is None or column_suffix == suffix
+        }
+
+    def get_column_suffix(self, column: str) -> str | None:
+        """Get the suffix code of a variable column, e.g. 'M' for median_rent_moe"""
+        return self.column_suffixes.get(column)
+
+    def get_dtype(self, column: str) -> str | None:
+        """
+        Get the pandas dtype of a raw or mapped column
+        Variable codes and columns get the dtype of their suffix, default columns their configured dtype
+        and any other column, e.g. a geography code like state or county, the geography dtype.
+        """
+        suffix = self.code_suffixes.get(column) or self.column_suffixes.get(column)
+        if suffix is not None:
+            return self.dtypes['suffixes'].get(suffix, DEFAULT_SUFFIX_DTYPE)
+        for name, dtype in self.dtypes['default_columns'].items():
+            if column in (name, name.lower()):
+                return dtype
+        if column == 'year':
+            return None
+        geography = self.dtypes['geography']
+        return geography.get(column, geography.get('default'))
+
+    def get_dtypes(self, columns: list) -> dict[str, str]:
+        """Get the dtype schema of columns, see get_dtype"""
+        dtypes = {column: self.get_dtype(column) for column in columns}
+        return {column: dtype for column, dtype in dtypes.items() if dtype is not None}
+
+    def to_dict(self) -> dict:
+        return {
+            'config_hash': self.config_hash,
+            'default_columns': self.default_columns,
+            'dtypes': self.dtypes,
+            'tables': self.tables
+        }
+
+    def save(self, file_path: str) -> None:
+        """Write the catalog atomically"""
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        temp_path = f"{file_path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(self.to_dict(), file)
+        os.replace(temp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'VariableCatalog':
+        with open(file_path, 'r') as file:
+            data = json.load(file)
+        return cls(data['tables'], data['default_columns'], data['config_hash'], data['dtypes'])
+
+
+def get_variable_catalog(config: dict, cache_folder: str = None) -> VariableCatalog:
+    """
+    Get the compiled catalog of a configuration
+    Catalogs are compiled once per process and, with cache_folder, saved to a file named
+    after the hash of the configuration so later runs with the same configuration load it instead.
+    """
+    config_hash = get_config_hash(config)
+    with catalog_lock:
+        catalog = catalogs.get(config_hash)
+    if catalog is not None:
+        return catalog
+
+    cache_path = os.path.join(cache_folder, f"catalog_{config_hash}.json") if cache_folder else None
+    if cache_path is not None and os.path.exists(cache_path):
+        try:
+            catalog = VariableCatalog.load(cache_path)
+            logger.info(f"Loaded the Census variable catalog from {cache_path}")
+        except (IOError, ValueError, KeyError) as e:
+            logger.error(f"Error reading variable catalog {cache_path}, compiling it again: {e}")
+    if catalog is None:
+        catalog = VariableCatalog.from_config(config)
+        if cache_path is not None:
+            catalog.save(cache_path)
+            logger.info(f"Saved the Census variable catalog to {cache_path}")
+
+    with catalog_lock:
+        catalogs[config_hash] = catalog
+    return catalog
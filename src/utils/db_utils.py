@@ -1,14 +1,144 @@
+import re
+import time
+import threading
 from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
 from utils.config import DB_CONFIG
 from utils.logger_utils import setup_logging
-from sqlalchemy import text
+from sqlalchemy import text, inspect
 import pandas as pd
 
 logger = setup_logging()
 
-def get_engine():
-    connection_string = f'{DB_CONFIG["type"]}://{DB_CONFIG["user"]}:{DB_CONFIG["password"]}@{DB_CONFIG["host"]}:{DB_CONFIG["port"]}/{DB_CONFIG["database"]}'
-    return create_engine(connection_string)
+#Pool settings used for engines that have not been configured explicitly
+DEFAULT_ENGINE_SETTINGS = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_timeout': 30,
+    'pool_pre_ping': True,
+    'statement_timeout': None,
+}
+
+#Engines and their settings keyed by DSN, shared by every caller in the process
+engines = {}
+engine_settings = {}
+engine_lock = threading.Lock()
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that counts checkouts and new connections and measures the time spent waiting for one"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.stats = {'checkouts': 0, 'opened': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+
+    def _do_get(self):
+        start_time = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait_seconds = time.perf_counter() - start_time
+            with self.stats_lock:
+                self.stats['checkouts'] += 1
+                self.stats['wait_seconds'] += wait_seconds
+                self.stats['max_wait_seconds'] = max(self.stats['max_wait_seconds'], wait_seconds)
+
+    def _create_connection(self):
+        with self.stats_lock:
+            self.stats['opened'] += 1
+        return super()._create_connection()
+
+
+def get_connection_string() -> str:
+    return f'{DB_CONFIG["type"]}://{DB_CONFIG["user"]}:{DB_CONFIG["password"]}@{DB_CONFIG["host"]}:{DB_CONFIG["port"]}/{DB_CONFIG["database"]}'
+
+
+def create_pooled_engine(
+    dsn: str,
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_timeout: float = 30,
+    pool_pre_ping: bool = True,
+    statement_timeout: int = None
+):
+    """
+    Create an engine with a metered connection pool
+    Parameters:
+    dsn (str): The database connection string
+    pool_size (int): The number of connections kept open
+    max_overflow (int): The number of extra connections opened under load
+    pool_timeout (float): Seconds to wait for a free connection before failing
+    pool_pre_ping (bool): Test connections on checkout so stale ones are replaced
+    statement_timeout (int): Milliseconds a statement may run before PostgreSQL cancels it
+    """
+    connect_args = {}
+    if statement_timeout and dsn.startswith('postgresql'):
+        connect_args['options'] = f'-c statement_timeout={int(statement_timeout)}'
+
+    return create_engine(
+        dsn,
+        poolclass=MeteredQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        pool_pre_ping=pool_pre_ping,
+        connect_args=connect_args
+    )
+
+
+def configure_engine(dsn: str = None, **settings):
+    """
+    Replace the shared engine for a DSN, e.g. to size the pool to the ingest concurrency
+    See create_pooled_engine for the settings, unspecified settings keep their defaults
+    """
+    if dsn is None:
+        dsn = get_connection_string()
+    with engine_lock:
+        engine_settings[dsn] = {**DEFAULT_ENGINE_SETTINGS, **settings}
+        old_engine = engines.pop(dsn, None)
+        if old_engine is not None:
+            old_engine.dispose()
+        engines[dsn] = create_pooled_engine(dsn, **engine_settings[dsn])
+        return engines[dsn]
+
+
+def get_engine(dsn: str = None):
+    """Get the shared engine for a DSN, defaulting to the ingest database in DB_CONFIG"""
+    if dsn is None:
+        dsn = get_connection_string()
+    with engine_lock:
+        if dsn not in engines:
+            engines[dsn] = create_pooled_engine(dsn, **engine_settings.get(dsn, DEFAULT_ENGINE_SETTINGS))
+        return engines[dsn]
+
+
+def get_pool_stats() -> dict[str, dict]:
+    """
+    Get checkout and wait metrics for every shared engine
+    Returns: dict: DSN without password -> {'checkouts', 'opened', 'wait_seconds', 'max_wait_seconds', 'checked_out'}
+    """
+    with engine_lock:
+        current_engines = list(engines.values())
+
+    pool_stats = {}
+    for engine in current_engines:
+        pool = engine.pool
+        with pool.stats_lock:
+            stats = dict(pool.stats)
+        stats['checked_out'] = pool.checkedout()
+        pool_stats[engine.url.render_as_string(hide_password=True)] = stats
+    return pool_stats
+
+
+def log_pool_stats() -> None:
+    """Log the pool metrics for every shared engine"""
+    for dsn, stats in get_pool_stats().items():
+        average_wait = stats['wait_seconds'] / stats['checkouts'] if stats['checkouts'] else 0
+        logger.info(
+            f"Connection pool for {dsn}: {stats['checkouts']} checkouts, {stats['opened']} connections opened, "
+            f"{average_wait * 1000:.1f}ms average wait, {stats['max_wait_seconds'] * 1000:.1f}ms max wait"
+        )
 
 
 def delete_table(schema: str, table_name: str) -> None:
@@ -32,21 +162,31 @@ def delete_table(schema: str, table_name: str) -> None:
         raise
         
 
-def create_table(df: pd.DataFrame, schema: str, table_name: str) -> None:
+def create_table(
+    df: pd.DataFrame,
+    schema: str,
+    table_name: str,
+    unlogged: bool = False,
+    column_types: dict = None
+) -> None:
     """
-    Create a table in the database with all columns as VARCHAR
+    Create a table in the database with all columns as VARCHAR unless typed
     Parameters:
     df (pd.DataFrame): The DataFrame to use to create the table
     schema (str): The schema to create the table in
     table_name (str): The name of the table to create
+    unlogged (bool): Create an UNLOGGED table, skipping the WAL until it is set LOGGED
+    column_types (dict): Column name -> SQL type, columns not listed are VARCHAR
     """
 
     engine = get_engine()
     columns_list = df.columns.tolist()
 
     #Create SQL Statement
-    column_definitions = ", ".join([f'"{col}" VARCHAR' for col in columns_list])
-    sql_statement = f'CREATE TABLE "{schema}"."{table_name}" ({column_definitions});'
+    column_types = column_types or {}
+    column_definitions = ", ".join([f'"{col}" {column_types.get(col, "VARCHAR")}' for col in columns_list])
+    table_type = 'UNLOGGED TABLE' if unlogged else 'TABLE'
+    sql_statement = f'CREATE {table_type} "{schema}"."{table_name}" ({column_definitions});'
 
     try:
         with engine.connect() as connection:
@@ -56,3 +196,105 @@ def create_table(df: pd.DataFrame, schema: str, table_name: str) -> None:
     except Exception as e:
         logger.error(f"An error occurred while creating table {table_name}: {str(e)}")
         raise
+
+
+def table_exists(schema: str, table_name: str) -> bool:
+    """
+    Check if a table exists in the database
+    Parameters:
+    schema (str): The schema of the table
+    table_name (str): The name of the table
+    """
+
+    engine = get_engine()
+    return inspect(engine).has_table(table_name, schema=schema)
+
+
+def get_row_count(schema: str, table_name: str) -> int:
+    """Count the rows of a table"""
+    with get_engine().connect() as connection:
+        return connection.execute(
+            text(f"SELECT COUNT(*) FROM {quote_identifier(schema)}.{quote_identifier(table_name)}")
+        ).scalar()
+
+
+def quote_identifier(name: str) -> str:
+    """Quote an identifier for use in a SQL statement"""
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def widen_column_to_text(schema: str, table_name: str, column: str) -> None:
+    """Change a column to VARCHAR, e.g. when a value does not fit its inferred type"""
+    sql_statement = (
+        f'ALTER TABLE {quote_identifier(schema)}.{quote_identifier(table_name)} '
+        f'ALTER COLUMN {quote_identifier(column)} TYPE VARCHAR'
+    )
+    with get_engine().connect() as connection:
+        connection.execute(text(sql_statement))
+        connection.commit()
+        logger.info(f"SQL Command: {sql_statement}")
+
+
+def get_copy_error_column(error: Exception) -> str | None:
+    """
+    Get the column a COPY failed on when a value could not be converted to the column type
+    Returns: str | None: The column name, or None for any other error
+    """
+    diag = getattr(error, 'diag', None)
+    if diag is None or not (getattr(error, 'pgcode', None) or '').startswith('22'):
+        return None
+    # The context looks like: COPY realtor_zip, line 42, column median_days_on_market: "n/a"
+    match = re.search(r', column (.+?): ', diag.context or '')
+    return match.group(1) if match else None
+
+
+def copy_from_stream(
+    stream,
+    schema: str,
+    table_name: str,
+    columns: list,
+    engine=None,
+    buffer_size: int = 1024 * 1024,
+    after_copy=None
+) -> int:
+    """
+    Bulk load CSV data from a file-like object with COPY ... FROM STDIN
+    Parameters:
+    stream: A binary file-like object positioned after the header line
+    schema (str): The schema of the table to load
+    table_name (str): The name of the table to load
+    columns (list): The columns in the order they appear in the CSV
+    engine (sqlalchemy.engine.base.Engine): The database engine to use, must be PostgreSQL
+    buffer_size (int): The number of bytes read from the stream per round trip
+    after_copy (Callable): Called with the cursor and row count before committing, e.g. to record
+        a checkpoint in the same transaction as the data
+    Returns: int: The number of rows loaded
+    """
+
+    if engine is None:
+        engine = get_engine()
+    if engine.dialect.name != 'postgresql':
+        raise ValueError(f"COPY is only supported for PostgreSQL, not {engine.dialect.name}")
+
+    column_list = ", ".join(quote_identifier(col) for col in columns)
+    sql_statement = (
+        f'COPY {quote_identifier(schema)}.{quote_identifier(table_name)} ({column_list}) '
+        f'FROM STDIN WITH (FORMAT csv)'
+    )
+
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.copy_expert(sql_statement, stream, size=buffer_size)
+            row_count = cursor.rowcount
+            if after_copy is not None:
+                after_copy(cursor, row_count)
+        connection.commit()
+        logger.info(f"SQL Command: COPY {schema}.{table_name} loaded {row_count} rows")
+        return row_count
+    except Exception as e:
+        connection.rollback()
+        logger.error(f"An error occurred while copying data into {table_name}: {str(e)}")
+        raise
+    finally:
+        connection.close()
@@ -1,9 +1,37 @@
+import io
 import os
+import csv
+import uuid
+import shutil
+import hashlib
+import pandas as pd
 from utils.logger_utils import setup_logging
 from pathlib import Path
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.dataset as pa_dataset
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
 logger = setup_logging()
 
+#Storage formats data files can be written in, and their file extensions
+STORAGE_FORMATS = {
+    'csv': '.csv',
+    'parquet': '.parquet'
+}
+DEFAULT_STORAGE_FORMAT = 'csv'
+
+PARQUET_COMPRESSION = 'zstd'
+
+#Floats are written without a trailing .0 when whole, so Census annotation values like -888888888
+#load as -888888888 into both text and NUMERIC columns. The dbt models cast the column to text
+#and match it against the value codes of the census__value_annotations seed
+CSV_FLOAT_FORMAT = '%.15g'
+
 
 def create_output_dir(folder_path: str) -> None:
     try:
@@ -14,30 +42,344 @@ def create_output_dir(folder_path: str) -> None:
         logger.error(f"Error creating directory {folder_path}: {e}")
         raise
 
-def write_response_to_csv(response, file_path: str) -> None:
+def get_part_file_path(file_path: str) -> str:
+    """Get the path an in-progress download is written to"""
+    return f"{file_path}.part"
+
+def get_expected_size(response) -> int | None:
+    """
+    Get the full size of the resource a response is transferring
+    Returns: int | None: The size in bytes, or None if the response does not tell
+    """
+    content_range = response.headers.get('Content-Range')
+    if response.status_code == 206 and content_range and '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        return int(total) if total.isdigit() else None
+    content_length = response.headers.get('Content-Length')
+    # The length of an encoded body does not match the decoded bytes written to disk
+    if content_length and content_length.isdigit() and not response.headers.get('Content-Encoding'):
+        return int(content_length)
+    return None
+
+def write_response_to_csv(response, file_path: str, append: bool = False, chunk_size: int = 8192) -> int:
+    """
+    Stream a response into a .part file and rename it into place once it is complete
+    Parameters:
+    response (requests.Response): The response to write
+    file_path (str): The path of the finished file
+    append (bool): Append to an existing .part file, e.g. for a 206 Partial Content response
+    chunk_size (int): The streaming buffer size in bytes
+    Returns: int: The number of bytes written by this response
+    """
+    part_path = get_part_file_path(file_path)
+    bytes_written = 0
     try:
-        with open(file_path, "wb") as file:
-            for chunk in response.iter_content(chunk_size=8192):
+        with open(part_path, "ab" if append else "wb") as file:
+            for chunk in response.iter_content(chunk_size=chunk_size):
                 if chunk:
                     file.write(chunk)
+                    bytes_written += len(chunk)
+
+        # Keep an incomplete transfer as .part so it can be resumed
+        expected_size = get_expected_size(response)
+        written_size = os.path.getsize(part_path)
+        if expected_size is not None and written_size != expected_size:
+            raise IOError(f"Incomplete download, wrote {written_size} of {expected_size} bytes to {part_path}")
+
+        os.replace(part_path, file_path)
         logger.info(f"Saved response to {file_path}")
+        return bytes_written
     except (IOError, OSError) as e:
         logger.error(f"Failed to write response to {file_path}: {e}")
         raise
 
-def write_df_to_csv(df, file_path: str, append: bool = False) -> None:
+def add_csv_columns(file_path: str, columns: list) -> None:
+    """
+    Rewrite a CSV file with columns added to the end of its header, empty in the existing rows
+    The file is rewritten to a temporary file and renamed into place.
+    """
+    temp_path = f"{file_path}.tmp"
+    with open(file_path, 'r', newline='', encoding='utf-8-sig') as source, open(temp_path, 'w', newline='', encoding='utf-8') as target:
+        reader = csv.reader(source)
+        writer = csv.writer(target, lineterminator=os.linesep)
+        writer.writerow(next(reader) + list(columns))
+        padding = [''] * len(columns)
+        for row in reader:
+            writer.writerow(row + padding)
+    os.replace(temp_path, file_path)
+
+def align_to_csv_header(df, file_path: str):
+    """
+    Order the columns of a DataFrame like the header of the CSV file it is appended to
+    Columns the file does not have yet are added to it, see add_csv_columns, rather than dropped.
+    """
+    with open(file_path, 'rb') as file:
+        header = read_csv_header(file)
+    if list(df.columns) == header:
+        return df
+    extra_columns = [col for col in df.columns if col not in header]
+    if extra_columns:
+        logger.info(f"Adding columns {extra_columns} to the header of {file_path}")
+        add_csv_columns(file_path, extra_columns)
+        header = header + extra_columns
+    return df.reindex(columns=header)
+
+def write_df_to_csv(df, file_path: str, append: bool = False, atomic: bool = False) -> None:
+    """
+    Write a DataFrame to a CSV file
+    Parameters:
+    df (pd.DataFrame): The DataFrame to write
+    file_path (str): The path of the CSV file
+    append (bool): Append to the file instead of overwriting it
+    atomic (bool): Write to a temporary file and rename it into place, ignored when appending
+    """
     try:
         if append:
             # Append to the file, avoid writing the header if the file exists
-            df.to_csv(file_path, index=False, mode='a', header=not os.path.exists(file_path))
+            file_exists = os.path.exists(file_path) and os.path.getsize(file_path) > 0
+            if file_exists:
+                df = align_to_csv_header(df, file_path)
+            df.to_csv(file_path, index=False, mode='a', header=not file_exists, float_format=CSV_FLOAT_FORMAT)
+        elif atomic:
+            # Readers never see a partially written file
+            temp_path = f"{file_path}.tmp"
+            df.to_csv(temp_path, index=False, float_format=CSV_FLOAT_FORMAT)
+            os.replace(temp_path, file_path)
         else:
             # Overwrite the file
-            df.to_csv(file_path, index=False)
+            df.to_csv(file_path, index=False, float_format=CSV_FLOAT_FORMAT)
         logger.info(f"Saved data to {file_path}")
     except Exception as e:
         logger.error(f"Error saving data to {file_path}: {e}")
         raise IOError(f"Failed to write DataFrame to CSV: {e}") from e
 
+def get_file_checksum(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """Get the SHA-256 checksum of a file"""
+    checksum = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+def get_storage_format(config: dict = None) -> str:
+    """
+    Get the storage format data files are written in, from the constants of a pipeline configuration
+    Returns: str: 'csv', or 'parquet' for compressed, typed files
+    """
+    constants = (config or {}).get('constants', {})
+    file_format = constants.get('storage_format') or DEFAULT_STORAGE_FORMAT
+    if file_format not in STORAGE_FORMATS:
+        raise ValueError(f"Unknown storage format {file_format}, expected one of {list(STORAGE_FORMATS)}")
+    if file_format == 'parquet':
+        require_pyarrow()
+    return file_format
+
+def get_file_extension(file_format: str = DEFAULT_STORAGE_FORMAT) -> str:
+    return STORAGE_FORMATS[file_format]
+
+def require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("The parquet storage format requires pyarrow, install it with pip install pyarrow or the parquet extra, pip install -e .[parquet]")
+
+def is_parquet_path(file_path: str) -> bool:
+    """Check if a path is a Parquet file or a partitioned Parquet dataset folder"""
+    return str(file_path).rstrip(os.sep).endswith(STORAGE_FORMATS['parquet'])
+
+def is_data_file(file_name: str) -> bool:
+    """Check if a file name has the extension of one of the storage formats"""
+    return file_name.endswith(tuple(STORAGE_FORMATS.values()))
+
+def write_df_to_parquet(df, file_path: str, partition_cols: list = None) -> None:
+    """
+    Write a DataFrame to a compressed Parquet file
+    With partition_cols, file_path is a dataset folder and every partition is written to its own
+    <column>=<value> subfolder as a new file, so writing a partition appends to the dataset.
+    Every file is written to a temporary file and renamed into place, readers never see a partial file.
+    """
+    require_pyarrow()
+    try:
+        if not partition_cols:
+            create_output_dir(os.path.dirname(file_path))
+            temp_path = f"{file_path}.tmp"
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), temp_path, compression=PARQUET_COMPRESSION)
+            os.replace(temp_path, file_path)
+        else:
+            for values, partition in df.groupby(partition_cols, sort=True):
+                values = values if isinstance(values, tuple) else (values,)
+                partition_path = os.path.join(
+                    file_path, *[f"{col}={value}" for col, value in zip(partition_cols, values)]
+                )
+                create_output_dir(partition_path)
+                part_path = os.path.join(partition_path, f"part-{uuid.uuid4().hex}{STORAGE_FORMATS['parquet']}")
+                table = pa.Table.from_pandas(partition.drop(columns=partition_cols), preserve_index=False)
+                pq.write_table(table, f"{part_path}.tmp", compression=PARQUET_COMPRESSION)
+                os.replace(f"{part_path}.tmp", part_path)
+        logger.info(f"Saved data to {file_path}")
+    except Exception as e:
+        logger.error(f"Error saving data to {file_path}: {e}")
+        raise IOError(f"Failed to write DataFrame to Parquet: {e}") from e
+
+def write_df(df, file_path: str, append: bool = False, atomic: bool = False, partition_cols: list = None) -> None:
+    """
+    Write a DataFrame in the storage format of its file extension, see write_df_to_csv
+    Parquet is written atomically, appending writes a new file to the partitions of a dataset.
+    """
+    if is_parquet_path(file_path):
+        write_df_to_parquet(df, file_path, partition_cols=partition_cols if append else None)
+    else:
+        write_df_to_csv(df, file_path, append=append, atomic=atomic)
+
+def get_parquet_dataset(file_path: str):
+    """Open a Parquet file or a hive partitioned dataset folder, with the columns of all its files"""
+    require_pyarrow()
+    dataset = pa_dataset.dataset(file_path, format='parquet', partitioning='hive')
+    schemas = [fragment.physical_schema for fragment in dataset.get_fragments()]
+    if len(schemas) > 1:
+        # Files of different years can hold different columns
+        partition_fields = [field for field in dataset.schema if field.name not in schemas[0].names]
+        schema = pa.unify_schemas(schemas + [pa.schema(partition_fields)], promote_options='permissive')
+        dataset = pa_dataset.dataset(file_path, format='parquet', partitioning='hive', schema=schema.remove_metadata())
+    return dataset
+
+def get_parquet_fragments(dataset) -> list:
+    """Get the files of a Parquet dataset in a stable order"""
+    return sorted(dataset.get_fragments(), key=lambda fragment: fragment.path)
+
+def read_columns(file_path: str) -> list:
+    """Get the column names of a CSV file, a Parquet file or a Parquet dataset"""
+    if is_parquet_path(file_path):
+        return get_parquet_dataset(file_path).schema.names
+    with open(file_path, 'rb') as file:
+        return read_csv_header(file)
+
+def read_df(file_path: str, columns: list = None, **kwargs) -> pd.DataFrame:
+    """
+    Read a CSV file, a Parquet file or a Parquet dataset into a DataFrame
+    Parameters:
+    file_path (str): The path to read
+    columns (list): Only read these columns, Parquet files skip the others entirely
+    kwargs: Passed to pd.read_csv for CSV files
+    """
+    if is_parquet_path(file_path):
+        return get_parquet_dataset(file_path).to_table(columns=columns).to_pandas()
+    return pd.read_csv(file_path, usecols=columns, **kwargs)
+
+
+class ParquetCsvStream(io.RawIOBase):
+    """
+    Read the rows of a Parquet file or dataset as CSV without a header, e.g. for COPY ... FROM STDIN
+    Only one record batch is held in memory at a time.
+    Parameters:
+    file_path (str): The path of the Parquet file or dataset
+    columns (list): The columns to read, in order
+    fragment (int): Only read this file of the dataset, see get_parquet_fragments
+    """
+
+    def __init__(self, file_path: str, columns: list = None, fragment: int = None) -> None:
+        dataset = get_parquet_dataset(file_path)
+        columns = columns or dataset.schema.names
+        if fragment is None:
+            self.batches = iter(dataset.to_batches(columns=columns))
+        else:
+            source = get_parquet_fragments(dataset)[fragment]
+            self.batches = iter(source.to_batches(schema=dataset.schema, columns=columns))
+        self.write_options = pa_csv.WriteOptions(include_header=False)
+        self.buffer = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.buffer:
+            batch = next(self.batches, None)
+            if batch is None:
+                return 0
+            output = io.BytesIO()
+            pa_csv.write_csv(batch, output, write_options=self.write_options)
+            self.buffer = output.getbuffer()
+        size = min(len(buffer), len(self.buffer))
+        buffer[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+def read_csv_header(stream) -> list:
+    """
+    Read the CSV header line from a binary stream, leaving it positioned at the first data row
+    Parameters:
+    stream: A binary file-like object supporting readline, e.g. an open file or io.BufferedReader
+    """
+    header_line = stream.readline().decode('utf-8-sig')
+    if not header_line:
+        raise ValueError("Stream is empty, no CSV header line to read")
+    return next(csv.reader([header_line]))
+
+def get_csv_byte_ranges(file_path: str, shard_size: int) -> list[tuple[int, int]]:
+    """
+    Split the data rows of a CSV file into byte ranges of roughly shard_size bytes
+    Every range starts and ends on a line boundary and the header line is excluded.
+    Rows must not contain line breaks inside quoted values.
+    Parameters:
+    file_path (str): The path of the CSV file
+    shard_size (int): The target size of each range in bytes
+    Returns: list: (start, end) byte offsets, end is exclusive
+    """
+    file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as file:
+        file.readline()
+        boundaries = [file.tell()]
+        while boundaries[-1] + shard_size < file_size:
+            file.seek(boundaries[-1] + shard_size)
+            # Finish the partial line so the next range starts on a new row
+            file.readline()
+            boundaries.append(file.tell())
+    if boundaries[-1] < file_size:
+        boundaries.append(file_size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+class FileRange(io.RawIOBase):
+    """
+    Read-only view of the bytes between start and end of a file
+    Parameters:
+    file_path (str): The path of the file
+    start (int): The first byte to read
+    end (int): The byte to stop before
+    """
+
+    def __init__(self, file_path: str, start: int, end: int) -> None:
+        self.file = open(file_path, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.remaining <= 0:
+            return 0
+        size = self.file.readinto(memoryview(buffer)[:min(len(buffer), self.remaining)])
+        self.remaining -= size
+        return size
+
+    def close(self) -> None:
+        self.file.close()
+        super().close()
+
+def write_csv_range(file_path: str, byte_range: tuple[int, int], output_path: str) -> None:
+    """Write the header and the rows in a byte range of a CSV file to a new CSV file"""
+    create_output_dir(os.path.dirname(output_path))
+    with open(file_path, 'rb') as source, open(output_path, 'wb') as output:
+        output.write(source.readline())
+        source.seek(byte_range[0])
+        remaining = byte_range[1] - byte_range[0]
+        while remaining > 0:
+            block = source.read(min(remaining, 1024 * 1024))
+            if not block:
+                break
+            output.write(block)
+            remaining -= len(block)
+    logger.info(f"Saved bytes {byte_range[0]}-{byte_range[1]} of {file_path} to {output_path}")
+
 def delete_csv(file_path: str) -> None:
     logger.info(f"Checking if CSV fie exists at {file_path}")
     if os.path.exists(file_path):
@@ -50,6 +392,17 @@ def delete_csv(file_path: str) -> None:
     else:
         logger.info(f"CSV file does not exist at {file_path}, ignoring delete request")
 
+def delete_parquet(path: str) -> None:
+    """Delete a Parquet file or a partitioned Parquet dataset folder"""
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        logger.info(f"Deleted {path}")
+    except Exception as e:
+        logger.error(f"Error deleting {path}: {e}")
+
 def clean_folder(folder_path: str) -> None:
     """
     Clean the folder by deleting any existing files
@@ -62,6 +415,9 @@ def clean_folder(folder_path: str) -> None:
             if file.endswith(".csv"):
                 logger.info(f"Deleting existing CSV file: {file}")
                 delete_csv(os.path.join(folder_path, file))
+            elif file.endswith(STORAGE_FORMATS['parquet']):
+                logger.info(f"Deleting existing Parquet data: {file}")
+                delete_parquet(os.path.join(folder_path, file))
     except Exception as e:
         logger.error(f"Error cleaning folder {folder_path}: {e}")
         raise
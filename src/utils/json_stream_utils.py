@@ -0,0 +1,138 @@
+import json
+import codecs
+from array import array
+from typing import Iterable, Iterator
+import numpy as np
+import pandas as pd
+from utils.logger_utils import setup_logging
+
+logger = setup_logging()
+
+#Trim the parse buffer once this many characters have been consumed
+BUFFER_TRIM_SIZE = 64 * 1024
+
+#Largest magnitude that round trips through float64 exactly
+MAX_EXACT_INTEGER = 2 ** 53
+
+
+def iter_json_rows(chunks: Iterable[bytes]) -> Iterator[list]:
+    """
+    Incrementally yield the rows of a JSON array of arrays, e.g. a Census API response,
+    without loading the whole document into a Python list.
+    Parameters:
+    chunks (Iterable[bytes]): The response body, e.g. response.iter_content()
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    started = False
+    exhausted = False
+
+    while True:
+        # Skip whitespace and row separators
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+
+        if position >= len(buffer):
+            if exhausted:
+                raise ValueError("Unexpected end of JSON response")
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+                buffer = buffer[position:] + text_decoder.decode(b'', final=True)
+            else:
+                buffer = buffer[position:] + text_decoder.decode(chunk)
+            position = 0
+            continue
+
+        if not started:
+            if buffer[position] != '[':
+                raise ValueError("JSON response is not an array")
+            started = True
+            position += 1
+            continue
+
+        if buffer[position] == ']':
+            return
+
+        try:
+            row, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # The row is incomplete, read more of the body
+            if exhausted:
+                raise
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+                chunk = b''
+            buffer = buffer[position:] + text_decoder.decode(chunk, final=exhausted)
+            position = 0
+            continue
+
+        yield row
+        position = end
+        if position > BUFFER_TRIM_SIZE:
+            buffer = buffer[position:]
+            position = 0
+
+
+def format_number(value: float) -> str | None:
+    """Format a parsed number back to the string the API sent"""
+    if np.isnan(value):
+        return None
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def finalize_numeric_column(values: array) -> np.ndarray | pd.api.extensions.ExtensionArray:
+    """
+    Convert a float buffer to an array for pandas.
+    Columns holding only whole numbers become nullable integers so they are
+    written back out as e.g. 12 rather than 12.0.
+    """
+    data = np.frombuffer(values, dtype=np.float64) if len(values) else np.array([], dtype=np.float64)
+    present = data[~np.isnan(data)]
+    if np.all(np.mod(present, 1) == 0) and np.all(np.abs(present) < MAX_EXACT_INTEGER):
+        mask = np.isnan(data)
+        return pd.arrays.IntegerArray(np.where(mask, 0, data).astype(np.int64), mask)
+    return data
+
+
+def decode_census_response(chunks: Iterable[bytes], numeric_columns: set[str]) -> pd.DataFrame:
+    """
+    Decode a Census API response straight into typed column buffers.
+    numeric_columns are parsed into float buffers, everything else (GEO_ID, NAME,
+    geography codes) is kept as strings. A numeric column holding a value that is
+    not a number falls back to strings for the whole column.
+
+    Parameters:
+    chunks (Iterable[bytes]): The response body
+    numeric_columns (set): The columns holding estimate and MOE values
+    """
+    rows = iter_json_rows(chunks)
+    header = next(rows, None)
+    if header is None:
+        raise ValueError("JSON response has no header row")
+
+    is_numeric = [column in numeric_columns for column in header]
+    buffers = [array('d') if numeric else [] for numeric in is_numeric]
+    nan = float('nan')
+
+    for row in rows:
+        for index, value in enumerate(row):
+            if is_numeric[index]:
+                try:
+                    buffers[index].append(nan if value is None else float(value))
+                    continue
+                except (TypeError, ValueError):
+                    logger.info(f"Column {header[index]} holds non-numeric value {value!r}, keeping it as strings")
+                    is_numeric[index] = False
+                    buffers[index] = [format_number(item) for item in buffers[index]]
+            buffers[index].append(value)
+
+    columns = {}
+    for column, numeric, values in zip(header, is_numeric, buffers):
+        columns[column] = finalize_numeric_column(values) if numeric else np.array(values, dtype=object)
+
+    return pd.DataFrame(columns, columns=header, copy=False)
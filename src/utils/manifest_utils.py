@@ -0,0 +1,89 @@
+import os
+import json
+import hashlib
+import datetime
+import threading
+from utils.logger_utils import setup_logging
+from utils.file_utils import get_file_checksum
+
+logger = setup_logging()
+
+
+def get_unit_signature(values: list) -> str:
+    """Get a signature for the contents of a unit, e.g. the variables requested for a chunk"""
+    return hashlib.sha256(json.dumps(values).encode('utf-8')).hexdigest()
+
+
+class DownloadManifest:
+    """
+    Persisted record of completed download units.
+    Each unit stores its file, row count, checksum and a signature of what was
+    requested so a rerun can skip units that are already complete and unchanged.
+
+    Parameters:
+    manifest_path (str): The path of the manifest JSON file
+    """
+
+    def __init__(self, manifest_path: str) -> None:
+        self.manifest_path = manifest_path
+        self.lock = threading.Lock()
+        self.units = self._load()
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, 'r') as file:
+                return json.load(file).get('units', {})
+        except (IOError, ValueError) as e:
+            logger.error(f"Error reading manifest {self.manifest_path}, all units will be downloaded again: {e}")
+            return {}
+
+    def _save(self) -> None:
+        """Write the manifest atomically so a crash never leaves a partial file"""
+        temp_path = f"{self.manifest_path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump({'units': self.units}, file, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+    def clear(self) -> None:
+        """Forget every unit, e.g. when the download folder has been cleaned"""
+        with self.lock:
+            self.units = {}
+            self._save()
+
+    def is_complete(self, unit_key: str, file_path: str, signature: str = None) -> bool:
+        """Check if a unit completed, is unchanged and its file still matches the recorded checksum"""
+        with self.lock:
+            unit = self.units.get(unit_key)
+        if unit is None or unit['status'] != 'complete':
+            return False
+        if signature is not None and unit.get('signature') != signature:
+            return False
+        if not os.path.exists(file_path):
+            return False
+        return get_file_checksum(file_path) == unit['checksum']
+
+    def record_success(self, unit_key: str, file_path: str, rows: int, signature: str = None) -> None:
+        """Record a unit as complete with the row count and checksum of its file"""
+        with self.lock:
+            self.units[unit_key] = {
+                'status': 'complete',
+                'file_name': os.path.basename(file_path),
+                'rows': rows,
+                'checksum': get_file_checksum(file_path),
+                'signature': signature,
+                'completed_at': datetime.datetime.now().isoformat()
+            }
+            self._save()
+
+    def record_failure(self, unit_key: str, error: str, signature: str = None) -> None:
+        """Record a unit as failed so it is retried on the next run"""
+        with self.lock:
+            self.units[unit_key] = {
+                'status': 'failed',
+                'error': error,
+                'signature': signature,
+                'failed_at': datetime.datetime.now().isoformat()
+            }
+            self._save()
@@ -0,0 +1,25 @@
+import tracemalloc
+from contextlib import contextmanager
+from utils.logger_utils import setup_logging
+
+logger = setup_logging()
+
+
+@contextmanager
+def track_peak_memory(stage: str):
+    """
+    Log the peak memory allocated while a stage runs, as traced by tracemalloc
+    Allocations of worker processes, e.g. a transform process pool, are not included.
+    Tracing slows allocations down, so only wrap stages when measuring.
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        logger.info(f"{stage} peak memory: {peak / 1024 / 1024:.1f} MiB, {current / 1024 / 1024:.1f} MiB still allocated")
+        if started:
+            tracemalloc.stop()
@@ -0,0 +1,198 @@
+import time
+import random
+import threading
+import collections
+import email.utils
+import requests
+from utils.logger_utils import setup_logging
+
+logger = setup_logging()
+
+#Statuses worth retrying, any other 4xx will never succeed
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+#Statuses whose Retry-After header is honored
+RETRY_AFTER_STATUSES = frozenset({429, 503})
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Parse a Retry-After header given as seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+class RetryPolicy:
+    """
+    Decides which failed requests are retried and how long to wait between attempts.
+    Delays use exponential backoff with full jitter so concurrent workers do not retry in lockstep.
+
+    Parameters:
+    max_retries (int): The maximum number of attempts
+    base_delay (float): The backoff ceiling in seconds for the first retry
+    max_delay (float): The largest backoff ceiling in seconds
+    backoff_factor (float): The growth of the backoff ceiling per attempt
+    retryable_statuses (set): HTTP statuses that are retried
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 10,
+        base_delay: float = 5,
+        max_delay: float = 120,
+        backoff_factor: float = 1.5,
+        retryable_statuses: frozenset[int] = RETRYABLE_STATUSES
+    ) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.backoff_factor = backoff_factor
+        self.retryable_statuses = retryable_statuses
+
+    def is_retryable(self, error: requests.exceptions.RequestException) -> bool:
+        """Check if a failed request can succeed when retried"""
+        response = getattr(error, 'response', None)
+        if response is not None:
+            return response.status_code in self.retryable_statuses
+        return isinstance(error, (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            requests.exceptions.ChunkedEncodingError
+        ))
+
+    def get_backoff(self, attempt: int) -> float:
+        """Get a fully jittered backoff for a zero based attempt number"""
+        ceiling = min(self.max_delay, self.base_delay * self.backoff_factor ** attempt)
+        return random.uniform(0, ceiling)
+
+    def get_delay(self, attempt: int, response: requests.Response = None) -> float:
+        """Get the delay before the next attempt, honoring Retry-After on 429 and 503"""
+        if response is not None and response.status_code in RETRY_AFTER_STATUSES:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                return retry_after
+        return self.get_backoff(attempt)
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker shared by every worker.
+    When the error rate over the last window_size requests reaches error_rate the
+    circuit opens and all workers pause for cooldown seconds before trying again.
+
+    Parameters:
+    host (str): The host the breaker protects
+    error_rate (float): The error rate that opens the circuit
+    window_size (int): The number of recent requests the error rate is measured over
+    min_requests (int): The number of requests needed before the circuit can open
+    cooldown (float): Seconds the circuit stays open
+    """
+
+    def __init__(
+        self,
+        host: str,
+        error_rate: float = 0.5,
+        window_size: int = 20,
+        min_requests: int = 10,
+        cooldown: float = 60
+    ) -> None:
+        self.host = host
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.outcomes = collections.deque(maxlen=window_size)
+        self.open_until = 0.0
+        self.lock = threading.Lock()
+
+    def wait_until_closed(self) -> None:
+        """Block while the circuit is open"""
+        while True:
+            with self.lock:
+                wait_time = self.open_until - time.monotonic()
+            if wait_time <= 0:
+                return
+            logger.info(f"Circuit for {self.host} is open, pausing for {wait_time:.1f} seconds")
+            time.sleep(wait_time)
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.outcomes.append(True)
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.outcomes.append(False)
+            failures = self.outcomes.count(False)
+            if len(self.outcomes) >= self.min_requests and failures / len(self.outcomes) >= self.error_rate:
+                self.open_until = time.monotonic() + self.cooldown
+                # Start measuring again once the circuit closes
+                self.outcomes.clear()
+                record_retry_stat(self.host, 'circuit_opens')
+                logger.error(
+                    f"Circuit for {self.host} opened after {failures} failed requests, "
+                    f"pausing all requests for {self.cooldown} seconds"
+                )
+
+
+#Retry statistics and circuit breakers keyed by host
+retry_stats: dict[str, dict[str, float]] = {}
+circuit_breakers: dict[str, CircuitBreaker] = {}
+circuit_breaker_settings: dict[str, dict] = {}
+registry_lock = threading.Lock()
+
+RETRY_STAT_NAMES = (
+    'requests', 'successes', 'retries', 'non_retryable', 'exhausted',
+    'retry_after_waits', 'circuit_opens', 'backoff_seconds'
+)
+
+
+def record_retry_stat(host: str, stat: str, value: float = 1) -> None:
+    """Add to a retry statistic for a host"""
+    with registry_lock:
+        host_stats = retry_stats.setdefault(host, dict.fromkeys(RETRY_STAT_NAMES, 0))
+        host_stats[stat] += value
+
+
+def get_retry_stats() -> dict[str, dict[str, float]]:
+    """Get the retry statistics for every host since the last reset"""
+    with registry_lock:
+        return {host: dict(stats) for host, stats in retry_stats.items()}
+
+
+def reset_retry_stats() -> None:
+    """Reset the retry statistics, e.g. at the start of a run"""
+    with registry_lock:
+        retry_stats.clear()
+
+
+def log_retry_stats() -> None:
+    """Log the retry statistics for every host"""
+    for host, stats in get_retry_stats().items():
+        logger.info(
+            f"Requests to {host}: {stats['requests']} attempts, {stats['successes']} succeeded, "
+            f"{stats['retries']} retried, {stats['non_retryable']} non-retryable, "
+            f"{stats['exhausted']} exhausted retries, {stats['retry_after_waits']} Retry-After waits, "
+            f"{stats['circuit_opens']} circuit opens, {stats['backoff_seconds']:.1f}s spent backing off"
+        )
+
+
+def configure_circuit_breaker(host: str, **settings) -> None:
+    """Set the circuit breaker settings for a host, see CircuitBreaker for the options"""
+    with registry_lock:
+        circuit_breaker_settings[host] = settings
+        circuit_breakers.pop(host, None)
+
+
+def get_circuit_breaker(host: str) -> CircuitBreaker:
+    """Get the shared circuit breaker for a host"""
+    with registry_lock:
+        if host not in circuit_breakers:
+            circuit_breakers[host] = CircuitBreaker(host, **circuit_breaker_settings.get(host, {}))
+        return circuit_breakers[host]
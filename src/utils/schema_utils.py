@@ -0,0 +1,154 @@
+import os
+import re
+import csv
+import pandas as pd
+from utils.logger_utils import setup_logging
+from utils.census_utils import get_variable_catalog
+from utils.file_utils import read_columns, read_df
+
+logger = setup_logging()
+
+#Rows sampled from each CSV to infer its column types
+DEFAULT_SAMPLE_ROWS = 10000
+
+#Number of evenly spaced places in the file the sample is taken from
+DEFAULT_SAMPLE_SEGMENTS = 10
+
+# Integers with a leading zero (zip codes, FIPS codes) are identifiers and stay text
+INTEGER_PATTERN = re.compile(r'^-?(0|[1-9][0-9]*)$')
+FLOAT_PATTERN = re.compile(r'^-?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?$')
+
+#Numeric dtypes of the Census dtype schema, see census_utils.VariableCatalog.get_dtype
+FLOAT_DTYPES = ('float32', 'float64')
+
+INT32_RANGE = (-2**31, 2**31 - 1)
+INT64_RANGE = (-2**63, 2**63 - 1)
+
+
+def read_csv_sample(file_path: str, sample_rows: int = DEFAULT_SAMPLE_ROWS, segments: int = DEFAULT_SAMPLE_SEGMENTS) -> tuple[list, list]:
+    """
+    Read a sample of rows spread across a CSV file instead of only its first rows
+    Rows must not contain line breaks inside quoted values.
+    Returns: tuple: The header and the sampled rows as lists of strings
+    """
+    file_size = os.path.getsize(file_path)
+    rows_per_segment = max(sample_rows // segments, 1)
+    lines = []
+
+    with open(file_path, 'rb') as file:
+        header = next(csv.reader([file.readline().decode('utf-8-sig')]))
+        data_start = file.tell()
+        for segment in range(segments):
+            offset = data_start + (file_size - data_start) * segment // segments
+            if offset > file.tell():
+                file.seek(offset)
+                # Skip the partial line the offset landed in
+                file.readline()
+            for _ in range(rows_per_segment):
+                line = file.readline()
+                if not line:
+                    break
+                lines.append(line.decode('utf-8'))
+
+    return header, list(csv.reader(lines))
+
+
+def infer_sql_type(values: list[str]) -> str:
+    """Get the narrowest SQL type every non-empty value can be loaded as"""
+    values = [value for value in values if value != '']
+    if not values:
+        return 'VARCHAR'
+    if all(INTEGER_PATTERN.match(value) for value in values):
+        low, high = min(int(value) for value in values), max(int(value) for value in values)
+        if INT32_RANGE[0] <= low and high <= INT32_RANGE[1]:
+            return 'INTEGER'
+        if INT64_RANGE[0] <= low and high <= INT64_RANGE[1]:
+            return 'BIGINT'
+        return 'NUMERIC'
+    if all(FLOAT_PATTERN.match(value) for value in values):
+        return 'DOUBLE PRECISION'
+    return 'VARCHAR'
+
+
+def infer_column_types(
+    file_path: str,
+    sample_rows: int = DEFAULT_SAMPLE_ROWS,
+    text_columns: list = None
+) -> dict[str, str]:
+    """
+    Infer the SQL type of each column of a CSV file from a sample of its rows
+    Parameters:
+    file_path (str): The path to the CSV file
+    sample_rows (int): The number of rows to sample
+    text_columns (list): Columns that are always text, e.g. identifiers like postal_code
+    Returns: dict: Column name -> SQL type
+    """
+    header, rows = read_csv_sample(file_path, sample_rows)
+    text_columns = set(text_columns or [])
+    column_types = {}
+    for index, column in enumerate(header):
+        if column in text_columns:
+            column_types[column] = 'VARCHAR'
+        else:
+            column_types[column] = infer_sql_type([row[index] for row in rows if index < len(row)])
+    logger.info(f"Inferred column types for {file_path} from {len(rows)} sampled rows: {column_types}")
+    return column_types
+
+
+def get_census_column_types(file_path: str, config: dict) -> dict[str, str]:
+    """
+    Get the SQL types of a processed census file or Parquet dataset from the variable config instead of sampling
+    Configured variables are NUMERIC, year is INTEGER and geography columns stay text.
+    """
+    header = read_columns(file_path)
+    numeric_columns = get_variable_catalog(config).get_column_names()
+    column_types = {}
+    for column in header:
+        if column in numeric_columns:
+            column_types[column] = 'NUMERIC'
+        elif column == 'year':
+            column_types[column] = 'INTEGER'
+        else:
+            column_types[column] = 'VARCHAR'
+    return column_types
+
+
+def get_read_dtypes(dtypes: dict) -> dict:
+    """Get the dtypes pd.read_csv can parse columns into directly, numeric columns are converted after reading"""
+    return {column: dtype for column, dtype in dtypes.items() if dtype not in FLOAT_DTYPES}
+
+
+def apply_dtype_schema(df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    """
+    Convert the columns of a DataFrame to the compact dtypes of a schema
+    Numeric columns holding only whole numbers, e.g. counts, are kept as integers instead of floats.
+    A column whose values do not fit its dtype is left unchanged.
+    Parameters:
+    df (pd.DataFrame): The DataFrame to convert
+    dtypes (dict): Column name -> pandas dtype, e.g. from VariableCatalog.get_dtypes
+    """
+    for column, dtype in dtypes.items():
+        if column not in df.columns or str(df[column].dtype) == dtype:
+            continue
+        try:
+            if dtype in FLOAT_DTYPES:
+                values = df[column]
+                if not pd.api.types.is_numeric_dtype(values):
+                    values = pd.to_numeric(values)
+                df[column] = values if pd.api.types.is_integer_dtype(values) else values.astype(dtype)
+            else:
+                df[column] = df[column].astype(dtype)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Keeping column {column} as {df[column].dtype}, its values do not fit {dtype}: {e}")
+    return df
+
+
+def read_census_file(file_path: str, catalog, columns: list = None) -> pd.DataFrame:
+    """
+    Read a Census CSV or Parquet file in the dtype schema of a VariableCatalog
+    Geography columns are read as strings so codes keep their leading zeros.
+    """
+    columns = columns or read_columns(file_path)
+    dtypes = catalog.get_dtypes(columns)
+    df = read_df(file_path, columns=columns, dtype=get_read_dtypes(dtypes), low_memory=False)
+    return apply_dtype_schema(df, dtypes)
@@ -0,0 +1,135 @@
+import threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from utils.logger_utils import setup_logging
+
+logger = setup_logging()
+
+DEFAULT_HEADERS = {
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive'
+}
+
+#Connection counters keyed by host
+connection_stats: dict[str, dict[str, int]] = {}
+stats_lock = threading.Lock()
+
+session = None
+session_lock = threading.Lock()
+
+
+def record_connection_stat(host: str, stat: str) -> None:
+    """Increment a connection counter for a host"""
+    with stats_lock:
+        host_stats = connection_stats.setdefault(host, {'opened': 0, 'requests': 0})
+        host_stats[stat] += 1
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    """HTTP connection pool that counts every new connection it opens"""
+
+    def _new_conn(self):
+        record_connection_stat(self.host, 'opened')
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    """HTTPS connection pool that counts every new connection (and TLS handshake) it opens"""
+
+    def _new_conn(self):
+        record_connection_stat(self.host, 'opened')
+        return super()._new_conn()
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that keeps connections alive in counting connection pools"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool
+        }
+
+    def send(self, request, **kwargs):
+        record_connection_stat(urlparse(request.url).hostname, 'requests')
+        return super().send(request, **kwargs)
+
+
+def create_session(
+    pool_connections: int = 10,
+    pool_maxsize: int = 10,
+    host_pool_limits: dict[str, int] = None
+) -> requests.Session:
+    """
+    Create a requests session with pooled keep-alive adapters
+    Parameters:
+    pool_connections (int): The number of host pools to keep
+    pool_maxsize (int): The maximum number of connections kept per host
+    host_pool_limits (dict): Maximum connections for specific hosts, e.g. {'api.census.gov': 8}
+    """
+    new_session = requests.Session()
+    new_session.headers.update(DEFAULT_HEADERS)
+
+    adapter = PooledHTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    new_session.mount('http://', adapter)
+    new_session.mount('https://', adapter)
+
+    #Mount a dedicated, blocking pool for hosts with their own limit
+    for host, limit in (host_pool_limits or {}).items():
+        host_adapter = PooledHTTPAdapter(pool_connections=1, pool_maxsize=limit, pool_block=True)
+        new_session.mount(f'https://{host}', host_adapter)
+        new_session.mount(f'http://{host}', host_adapter)
+        logger.info(f"Limiting connection pool for {host} to {limit} connections")
+
+    return new_session
+
+
+def configure_session(
+    pool_connections: int = 10,
+    pool_maxsize: int = 10,
+    host_pool_limits: dict[str, int] = None
+) -> requests.Session:
+    """Replace the shared session, e.g. to size the pools to the download concurrency"""
+    global session
+    with session_lock:
+        if session is not None:
+            session.close()
+        session = create_session(pool_connections, pool_maxsize, host_pool_limits)
+        return session
+
+
+def get_session() -> requests.Session:
+    """Get the shared session, creating it with the default pool sizes if needed"""
+    global session
+    with session_lock:
+        if session is None:
+            session = create_session()
+        return session
+
+
+def get_connection_stats() -> dict[str, dict[str, int]]:
+    """
+    Get connections opened vs. reused per host
+    Returns: dict: host -> {'opened', 'reused', 'requests'}
+    """
+    with stats_lock:
+        return {
+            host: {
+                'opened': stats['opened'],
+                'reused': max(stats['requests'] - stats['opened'], 0),
+                'requests': stats['requests']
+            }
+            for host, stats in connection_stats.items()
+        }
+
+
+def log_connection_stats() -> None:
+    """Log the connection counters for every host"""
+    for host, stats in get_connection_stats().items():
+        logger.info(
+            f"Connections to {host}: {stats['opened']} opened, {stats['reused']} reused "
+            f"across {stats['requests']} requests"
+        )
@@ -0,0 +1,89 @@
+from utils.batch_utils import BatchSizeController
+
+# Large enough to never limit the batch size unless a test sets it
+NO_MEMORY_LIMIT = 10 ** 12
+
+
+def make_controller(initial_size: int = 1000, memory_limit: int = NO_MEMORY_LIMIT, **kwargs) -> BatchSizeController:
+    return BatchSizeController(initial_size=initial_size, min_size=500, max_size=1000000, memory_limit=memory_limit, **kwargs)
+
+
+def test_size_doubles_while_throughput_improves():
+    controller = make_controller()
+
+    controller.record(1000, 1.0, 1000 * 100)
+    assert controller.next_size() == 2000
+    controller.record(2000, 1.0, 2000 * 100)
+    assert controller.next_size() == 4000
+    assert controller.exploring
+    assert controller.measured_batches == 2
+
+
+def test_size_settles_on_best_after_two_misses():
+    controller = make_controller()
+    controller.record(1000, 1.0, 1000 * 100)
+    controller.record(2000, 1.0, 2000 * 100)
+
+    # 4000 rows are slower than 2000 rows/sec, the first miss keeps measuring 4000
+    controller.record(4000, 4.0, 4000 * 100)
+    assert controller.next_size() == 4000
+    assert controller.exploring
+
+    controller.record(4000, 4.0, 4000 * 100)
+    assert controller.next_size() == 2000
+    assert not controller.exploring
+    state = controller.get_state()
+    assert state['batch_size'] == 2000
+    assert state['rows_per_second'] == 2000.0
+    assert state['bytes_per_row'] == 100.0
+
+
+def test_small_improvement_counts_as_a_miss():
+    controller = make_controller()
+    controller.record(1000, 1.0, 1000 * 100)
+
+    # Below the improvement threshold, 2% faster is noise
+    controller.record(2000, 2000 / 1020, 2000 * 100)
+    assert controller.next_size() == 2000
+    assert controller.misses == 1
+
+
+def test_short_batches_are_not_measured():
+    controller = make_controller()
+
+    # e.g. the last rows of a file
+    controller.record(10, 0.001, 10 * 100)
+    assert controller.next_size() == 1000
+    assert controller.best_rate == 0.0
+    assert controller.measured_batches == 0
+    assert controller.bytes_per_row == 100.0
+
+
+def test_empty_or_instant_batches_are_ignored():
+    controller = make_controller()
+
+    controller.record(0, 1.0, 0)
+    controller.record(1000, 0.0, 1000 * 100)
+    assert controller.bytes_per_row is None
+    assert controller.measured_batches == 0
+
+
+def test_growth_is_capped_by_memory_limit():
+    # 200 bytes per row within 1 MB allows 5000 rows
+    controller = make_controller(memory_limit=1000000)
+
+    controller.record(1000, 1.0, 1000 * 200)
+    controller.record(2000, 1.0, 2000 * 200)
+    assert controller.next_size() == 4000
+    controller.record(4000, 1.0, 4000 * 200)
+    assert controller.next_size() == 5000
+
+
+def test_learned_bytes_per_row_caps_the_first_batch():
+    controller = make_controller(initial_size=100000, memory_limit=1000000, bytes_per_row=100.0)
+    assert controller.next_size() == 10000
+
+
+def test_memory_limit_never_goes_below_min_size():
+    controller = make_controller(initial_size=100000, memory_limit=1000, bytes_per_row=100.0)
+    assert controller.next_size() == 500
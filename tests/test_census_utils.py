@@ -0,0 +1,85 @@
+from pathlib import Path
+import pytest
+from utils.census_utils import (
+    VariableCatalog, load_census_config, create_column_mapping, generate_variable_code, get_variable_catalog
+)
+
+CONFIG_PATH = Path(__file__).resolve().parents[1] / 'config' / 'census_variables.yml'
+
+
+@pytest.fixture(scope='module')
+def config() -> dict:
+    return load_census_config(str(CONFIG_PATH))
+
+
+@pytest.fixture(scope='module')
+def catalog(config) -> VariableCatalog:
+    return VariableCatalog.from_config(config)
+
+
+def get_every_variable_code(config: dict) -> dict:
+    """Map the default and every override code of each variable, as the mapping did before the catalog"""
+    mapping = {col['name']: col['name'].lower() for col in config['default_columns']}
+    for variables in config['variables'].values():
+        for variable, variable_config in variables.items():
+            for year in [None] + list(variable_config.get('overrides') or {}):
+                for suffix in config['suffixes']:
+                    code = generate_variable_code(variable_config, suffix['code'], year)
+                    if code is not None:
+                        mapping[code] = f"{variable}_{suffix['mapping']}".lower()
+    return mapping
+
+
+def test_override_year_maps_only_its_override_codes(catalog):
+    mapping_2016 = catalog.get_column_mapping('subject', 2016)
+    assert mapping_2016['S1903_C02_001E'] == 'median_household_income_estimate'
+    assert mapping_2016['S1903_C02_001M'] == 'median_household_income_moe'
+    assert 'S1903_C03_001E' not in mapping_2016
+    assert 'S1903_C02_001E' in catalog.get_codes('subject', 2016, 'E')
+
+
+@pytest.mark.parametrize('year', [None, 2015, 2017, 2022])
+def test_other_years_map_the_default_codes(catalog, year):
+    mapping = catalog.get_column_mapping('subject', year)
+    assert mapping['S1903_C03_001E'] == 'median_household_income_estimate'
+    assert 'S1903_C02_001E' not in mapping
+    assert 'S1903_C02_001E' not in catalog.get_codes('subject', year)
+
+
+def test_merged_mapping_holds_default_and_override_codes(config):
+    mapping = create_column_mapping(config)
+
+    assert mapping == get_every_variable_code(config)
+    # 226 variable codes plus NAME and GEO_ID
+    assert len(mapping) == 228
+    assert mapping['NAME'] == 'name' and mapping['GEO_ID'] == 'geo_id'
+    for code in ('S1903_C03_001E', 'S1903_C02_001E'):
+        assert mapping[code] == 'median_household_income_estimate'
+
+
+def test_codes_exclude_default_columns(config, catalog):
+    default_columns = {col['name'] for col in config['default_columns']}
+    for table_name in config['variables']:
+        assert not default_columns & set(catalog.get_codes(table_name))
+
+
+def test_catalog_round_trips_through_cache_file(tmp_path, catalog):
+    file_path = tmp_path / 'catalog' / f"catalog_{catalog.config_hash}.json"
+    catalog.save(str(file_path))
+    loaded = VariableCatalog.load(str(file_path))
+
+    assert loaded.to_dict() == catalog.to_dict()
+    assert loaded.codes == catalog.codes
+    assert loaded.columns == catalog.columns
+    assert loaded.get_column_mapping('subject', 2016) == catalog.get_column_mapping('subject', 2016)
+    assert loaded.get_dtypes(['S1903_C03_001E', 'median_household_income_moe', 'zip code tabulation area']) == \
+        catalog.get_dtypes(['S1903_C03_001E', 'median_household_income_moe', 'zip code tabulation area'])
+
+
+def test_cached_catalog_is_loaded_by_config_hash(tmp_path, config, catalog, monkeypatch):
+    catalog.save(str(tmp_path / f"catalog_{catalog.config_hash}.json"))
+    monkeypatch.setattr('utils.census_utils.catalogs', {})
+    monkeypatch.setattr(VariableCatalog, 'from_config', classmethod(lambda cls, config: pytest.fail('compiled again')))
+
+    loaded = get_variable_catalog(config, cache_folder=str(tmp_path))
+    assert loaded.to_dict() == catalog.to_dict()
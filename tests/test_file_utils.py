@@ -0,0 +1,51 @@
+import pytest
+from utils.file_utils import get_csv_byte_ranges, FileRange
+
+HEADER = b"postal_code,month_date_yyyymm,median_listing_price\n"
+ROWS = [f"{i:05d},2024{i % 12 + 1:02d},{i * 1000.5}\n".encode() for i in range(200)]
+
+
+def read_ranges(file_path, ranges) -> list[bytes]:
+    chunks = []
+    for start, end in ranges:
+        with FileRange(str(file_path), start, end) as stream:
+            chunks.append(stream.read())
+    return chunks
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    file_path = tmp_path / "realtor_zip.csv"
+    file_path.write_bytes(HEADER + b"".join(ROWS))
+    return file_path
+
+
+@pytest.mark.parametrize("shard_size", [1, 7, 64, 100, 1000, 10 ** 6])
+def test_byte_ranges_cover_every_row_once(csv_file, shard_size):
+    ranges = get_csv_byte_ranges(str(csv_file), shard_size)
+
+    assert ranges[0][0] == len(HEADER)
+    assert ranges[-1][1] == csv_file.stat().st_size
+    # Ranges are contiguous, so no byte is skipped or read twice
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+
+    chunks = read_ranges(csv_file, ranges)
+    assert all(chunk.endswith(b"\n") for chunk in chunks)
+    assert b"".join(chunks).splitlines(keepends=True) == ROWS
+
+
+def test_byte_ranges_without_trailing_newline(tmp_path):
+    file_path = tmp_path / "realtor_zip.csv"
+    data = b"".join(ROWS).rstrip(b"\n")
+    file_path.write_bytes(HEADER + data)
+
+    ranges = get_csv_byte_ranges(str(file_path), 50)
+
+    assert b"".join(read_ranges(file_path, ranges)) == data
+
+
+def test_byte_ranges_of_header_only_file(tmp_path):
+    file_path = tmp_path / "realtor_zip.csv"
+    file_path.write_bytes(HEADER)
+
+    assert get_csv_byte_ranges(str(file_path), 100) == []